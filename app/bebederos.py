@@ -0,0 +1,274 @@
+import argparse, hashlib, io, json, random, sys, time
+import numpy as np
+
+from graph import Graph, INF
+from snap import SnapIndex
+
+# Bebedero más cercano (distancia caminando) para cada nodo de la red.
+# Un único Dijkstra multi-origen sembrado desde todos los bebederos (snap al nodo
+# más cercano, con la distancia del snap como costo inicial); cada nodo hereda
+# el bebedero de su predecesor en el orden en que se asienta. La API carga la
+# tabla en arreglos alineados con el grafo y responde /nearest-bebedero en O(1),
+# reconstruyendo el camino con los punteros a la arista predecesora.
+#
+#   python bebederos.py build             # recalcula via_nodo_bebedero
+#   python bebederos.py check --pairs 200 # compara contra un Dijkstra por bebedero
+
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS via_nodo_bebedero;
+DROP TABLE IF EXISTS via_bebedero_snap;
+DROP TABLE IF EXISTS via_bebedero_meta;
+CREATE TABLE via_bebedero_meta (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  n_nodos INTEGER NOT NULL,
+  n_aristas INTEGER NOT NULL,
+  n_bebederos INTEGER NOT NULL,
+  creado TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE via_nodo_bebedero (
+  nodo_id BIGINT PRIMARY KEY,
+  bebedero_id BIGINT NOT NULL,
+  dist_m DOUBLE PRECISION NOT NULL,   -- red + tramo recto del snap del bebedero
+  pred_arista BIGINT                  -- NULL en el nodo donde se hizo snap el bebedero
+);
+-- posición y snap de cada bebedero al construir: la API descarta la tabla si el
+-- bebedero se movió o su nodo más cercano ya no es el mismo
+CREATE TABLE via_bebedero_snap (
+  bebedero_id BIGINT PRIMARY KEY,
+  lon DOUBLE PRECISION NOT NULL,
+  lat DOUBLE PRECISION NOT NULL,
+  nodo_id BIGINT,                     -- NULL si no hubo nodo (grafo vacío)
+  snap_m DOUBLE PRECISION
+);
+-- la API recarga la tabla junto con el grafo cuando cambia grafo_version
+CREATE TRIGGER trg_via_bebedero_meta_version
+  AFTER INSERT ON via_bebedero_meta
+  FOR EACH STATEMENT EXECUTE FUNCTION grafo_version_bump();
+"""
+
+FOUNTAINS_SQL = """
+SELECT id, ST_X(geom), ST_Y(geom) FROM bebedero
+WHERE geom IS NOT NULL ORDER BY id;
+"""
+
+# arreglos que guarda graph_file.py (archivo hermano del grafo); los de __init__
+ARRAYS = ("fountain", "dist", "pred", "fountain_ids", "fountain_lon", "fountain_lat", "snap_node", "snap_m")
+
+
+class Nearest:
+    def __init__(self, g, fountain, dist, pred, fountain_ids, fountain_lon, fountain_lat,
+                 snap_node=None, snap_m=None):
+        # fountain/dist/pred: por nodo denso (-1 / inf / -1 si no alcanza ninguno);
+        # fountain es índice en fountain_ids; snap_node/snap_m por bebedero (-1 / inf)
+        self.g = g
+        self.fountain = np.asarray(fountain, dtype=np.int32)
+        self.dist = np.asarray(dist, dtype=np.float64)
+        self.pred = np.asarray(pred, dtype=np.int32)
+        self.fountain_ids = np.asarray(fountain_ids, dtype=np.int64)
+        self.fountain_lon = np.asarray(fountain_lon, dtype=np.float64)
+        self.fountain_lat = np.asarray(fountain_lat, dtype=np.float64)
+        k = len(self.fountain_ids)
+        self.snap_node = np.full(k, -1, dtype=np.int32) if snap_node is None else np.asarray(snap_node, dtype=np.int32)
+        self.snap_m = np.full(k, INF) if snap_m is None else np.asarray(snap_m, dtype=np.float64)
+
+    def lookup(self, node):
+        # -> (índice del bebedero, distancia en m, [aristas hacia el bebedero]) o None
+        f = int(self.fountain[node])
+        if f < 0:
+            return None
+        d = float(self.dist[node])
+        path = []
+        e = int(self.pred[node])
+        while e >= 0:
+            path.append(e)
+            node = self.g.other_end(e, node)
+            e = int(self.pred[node])
+        return f, d, path
+
+    def save(self, conn):
+        # requiere SCHEMA_SQL ejecutado (ver main)
+        g = self.g
+        buf = io.StringIO()
+        for v in np.flatnonzero(self.fountain >= 0).tolist():
+            e = int(self.pred[v])
+            buf.write(f"{g.node_ids[v]}\t{self.fountain_ids[self.fountain[v]]}\t{float(self.dist[v])!r}\t" +
+                      (str(g.edge_ids[e]) if e >= 0 else "\\N") + "\n")
+        buf.seek(0)
+        snap = io.StringIO()
+        for k, n in enumerate(self.snap_node.tolist()):
+            snap.write(f"{self.fountain_ids[k]}\t{float(self.fountain_lon[k])!r}\t{float(self.fountain_lat[k])!r}\t" +
+                       (f"{g.node_ids[n]}\t{float(self.snap_m[k])!r}" if n >= 0 else "\\N\t\\N") + "\n")
+        snap.seek(0)
+        with conn.cursor() as cur:
+            cur.copy_from(buf, "via_nodo_bebedero", columns=("nodo_id", "bebedero_id", "dist_m", "pred_arista"))
+            cur.copy_from(snap, "via_bebedero_snap", columns=("bebedero_id", "lon", "lat", "nodo_id", "snap_m"))
+            cur.execute("INSERT INTO via_bebedero_meta (n_nodos, n_aristas, n_bebederos) VALUES (%s,%s,%s)",
+                        (g.n_nodes, g.n_edges, len(self.fountain_ids)))
+
+    @classmethod
+    def load(cls, conn, g: Graph, ix=None):
+        # None si la tabla no existe o no corresponde al grafo cargado o a los
+        # bebederos actuales (mismos ids y posiciones; con `ix`, mismo nodo de snap)
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('via_bebedero_meta') IS NOT NULL, "
+                        "to_regclass('via_bebedero_snap') IS NOT NULL")
+            if not all(cur.fetchone()):
+                return None
+            cur.execute("SELECT n_nodos, n_aristas FROM via_bebedero_meta WHERE id = 1")
+            meta = cur.fetchone()
+            if not meta or meta[0] != g.n_nodes or meta[1] != g.n_edges:
+                return None
+            cur.execute(FOUNTAINS_SQL)
+            fountains = cur.fetchall()
+            cur.execute("SELECT bebedero_id, lon, lat, COALESCE(nodo_id, -1), COALESCE(snap_m, 'Infinity') "
+                        "FROM via_bebedero_snap ORDER BY bebedero_id")
+            snaps = cur.fetchall()
+            cur.execute("SELECT nodo_id, bebedero_id, dist_m, COALESCE(pred_arista, -1) FROM via_nodo_bebedero")
+            rows = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 4)
+        f = np.array(fountains, dtype=np.float64).reshape(-1, 3)
+        f_ids = np.array([r[0] for r in fountains], dtype=np.int64)
+        s = np.array(snaps, dtype=np.float64).reshape(-1, 5)
+        if not np.array_equal(f_ids, np.array([r[0] for r in snaps], dtype=np.int64)) or \
+                not np.array_equal(f[:, 1:], s[:, 1:3]):
+            return None  # bebederos recargados o movidos después del build
+        snap_node = cls._dense(g.node_ids, s[:, 3].astype(np.int64), allow_missing=True)
+        nodes = cls._dense(g.node_ids, rows[:, 0].astype(np.int64))
+        beb = cls._dense(f_ids, rows[:, 1].astype(np.int64))
+        has = rows[:, 3] >= 0
+        pred_e = cls._dense(g.edge_ids, rows[has, 3].astype(np.int64))
+        if snap_node is None or nodes is None or beb is None or pred_e is None:
+            return None
+        if ix is not None:
+            # el snap se rehace con el índice del grafo cargado: mismo nodo, misma distancia
+            for k, (lon, lat) in enumerate(f[:, 1:].tolist()):
+                n, d = ix.nearest_node(lon, lat)
+                if (-1 if n is None else n) != snap_node[k] or \
+                        (n is not None and abs(d - s[k, 4]) > 1e-6 * max(1.0, d)):
+                    return None
+        # cada nodo semilla (sin predecesor) es el snap de su bebedero, a esa distancia
+        seed = ~has
+        if (snap_node[beb[seed]] != nodes[seed]).any() or \
+                not np.allclose(s[beb[seed], 4], rows[seed, 2], rtol=1e-9, atol=1e-9):
+            return None
+        fountain = np.full(g.n_nodes, -1, dtype=np.int32)
+        dist = np.full(g.n_nodes, INF)
+        pred = np.full(g.n_nodes, -1, dtype=np.int32)
+        fountain[nodes], dist[nodes] = beb, rows[:, 2]
+        pred[nodes[has]] = pred_e
+        return cls(g, fountain, dist, pred, f_ids, f[:, 1], f[:, 2], snap_node, s[:, 4])
+
+    def to_arrays(self):
+        return {k: getattr(self, k) for k in ARRAYS}
+
+    @staticmethod
+    def stamp(cur):
+        # via_bebedero_meta (el build también sube grafo_version) y un hash de los
+        # bebederos actuales, que pueden moverse sin rehacer la tabla: los arreglos
+        # guardados en graph_file sólo valen si coincide
+        cur.execute("SELECT to_regclass('via_bebedero_meta') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT n_nodos, n_aristas, n_bebederos, creado::text FROM via_bebedero_meta WHERE id = 1")
+        meta = cur.fetchone()
+        cur.execute(FOUNTAINS_SQL)
+        h = hashlib.sha256(json.dumps(cur.fetchall()).encode()).hexdigest()
+        return [list(meta) if meta else None, h]
+
+    @staticmethod
+    def _dense(sorted_ids, ids, allow_missing=False):
+        # ids -> índices en sorted_ids; None si alguno no está (-1 con allow_missing, para id -1)
+        idx = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+        ok = (sorted_ids[idx] == ids) if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+        if allow_missing:
+            ok |= ids == -1
+            idx = np.where(ids == -1, -1, idx)
+        return idx if ok.all() else None
+
+
+def build(g: Graph, fountains, ix=None):
+    # fountains: [(id, lon, lat)]; Dijkstra multi-origen por largo (profile=shortest)
+    ix = ix or SnapIndex(g)
+    seeds = {}
+    snap_node = np.full(len(fountains), -1, dtype=np.int32)
+    snap_m = np.full(len(fountains), INF)
+    for k, (_, lon, lat) in enumerate(fountains):
+        n, d = ix.nearest_node(lon, lat)
+        if n is not None:
+            snap_node[k], snap_m[k] = n, d
+        if n is not None and d < seeds.get(n, (INF,))[0]:
+            seeds[n] = (d, k)
+    done, _, pred = g.one_to_many([(n, d, d, -1) for n, (d, _) in seeds.items()], None, "shortest")
+    fountain = np.full(g.n_nodes, -1, dtype=np.int32)
+    dist = np.full(g.n_nodes, INF)
+    pr = np.full(g.n_nodes, -1, dtype=np.int32)
+    # `done` conserva el orden de asentamiento: el predecesor siempre viene antes
+    for v, d in done.items():
+        e = pred[v]
+        fountain[v] = seeds[v][1] if e < 0 else fountain[g.other_end(e, v)]
+        dist[v], pr[v] = d, e
+    f = np.array([(i, lon, lat) for i, lon, lat in fountains], dtype=np.float64).reshape(-1, 3)
+    return Nearest(g, fountain, dist, pr, f[:, 0].astype(np.int64), f[:, 1], f[:, 2], snap_node, snap_m)
+
+
+def check(g: Graph, near: Nearest, pairs=200, seed=0, log=print):
+    # compara contra el mínimo de un Dijkstra por bebedero en nodos al azar
+    ix = SnapIndex(g)
+    rnd = random.Random(seed)
+    nodes = [rnd.randrange(g.n_nodes) for _ in range(min(pairs, g.n_nodes))]
+    best = {v: INF for v in nodes}
+    for lon, lat in zip(near.fountain_lon, near.fountain_lat):
+        n, d = ix.nearest_node(lon, lat)
+        if n is None:
+            continue
+        done, _, _ = g.one_to_many([(n, d, d, -1)], nodes, "shortest")
+        for v in nodes:
+            best[v] = min(best[v], done.get(v, INF))
+    bad = 0
+    for v in nodes:
+        d = near.dist[v]
+        if not ((d == best[v] == INF) or abs(d - best[v]) <= 1e-6 * max(1.0, best[v])):
+            bad += 1
+            if bad <= 5:
+                log(f"[diff] nodo={g.node_ids[v]} tabla={d:.3f} ref={best[v]:.3f}")
+    log(f"[check] bebederos={len(near.fountain_ids)} nodos={len(nodes)} diferencias={bad}")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cmd", choices=["build", "check"])
+    ap.add_argument("--pairs", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    from db import DBPool
+    pool = DBPool(minconn=1, maxconn=1, statement_timeout_ms=0).open()
+    try:
+        with pool.connection() as conn:
+            g = Graph.from_db(conn)
+            print(f"[bebederos] grafo nodos={g.n_nodes} aristas={g.n_edges}")
+            if args.cmd == "build":
+                with conn.cursor() as cur:
+                    cur.execute(FOUNTAINS_SQL)
+                    fountains = cur.fetchall()
+                    cur.execute(SCHEMA_SQL)
+                t0 = time.perf_counter()
+                near = build(g, fountains)
+                reached = int((near.fountain >= 0).sum())
+                print(f"[bebederos] bebederos={len(fountains)} nodos_alcanzados={reached} "
+                      f"t={time.perf_counter()-t0:.1f}s")
+                near.save(conn)
+            else:
+                near = Nearest.load(conn, g)
+                if near is None:
+                    print("[ERR] via_nodo_bebedero ausente o desactualizada; "
+                          "ejecuta: python bebederos.py build", file=sys.stderr)
+                    sys.exit(2)
+            bad = check(g, near, args.pairs, args.seed)
+    finally:
+        pool.close()
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os, threading, time
+from collections import OrderedDict
+
+# Caché LRU + TTL en memoria para respuestas ya serializadas.
+# Thread-safe (los handlers síncronos de FastAPI corren en un threadpool).
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "2048"))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "3600"))
+
+
+class LRUCache:
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE, ttl_s=ROUTE_CACHE_TTL_S):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._data = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = self.clears = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[0] < now:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_s, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.clears += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "clears": self.clears,
+            }
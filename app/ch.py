@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+import argparse, heapq, io, random, sys, time
+import numpy as np
+from graph import Graph, INF, PROFILES
+
+# Contraction Hierarchies sobre el grafo no dirigido de via_arista, una por
+# perfil de costo (graph.PROFILES).
+# Preproceso offline (después de db/load/load_infra.sql y load_exposicion.sql):
+#   python ch.py build            -> via_ch_nodo / via_ch_arista / via_ch_meta
+#   python ch.py check --pairs 200 -> compara distancias CH vs Dijkstra
+# Cada arista CH es una arista original (arista >= 0) o un atajo con dos
+# hijos (hijo1, hijo2) que se expanden recursivamente al desempaquetar.
+
+SCHEMA_SQL = """
+DROP TABLE IF EXISTS via_ch_meta, via_ch_nodo, via_ch_arista;
+CREATE TABLE via_ch_meta (
+  perfil TEXT PRIMARY KEY,
+  n_nodos INTEGER, n_aristas INTEGER, costo_total DOUBLE PRECISION,
+  n_atajos INTEGER, creado TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE via_ch_nodo (
+  perfil TEXT NOT NULL,
+  id BIGINT NOT NULL,
+  rank INTEGER NOT NULL,
+  PRIMARY KEY (perfil, id)
+);
+CREATE TABLE via_ch_arista (
+  perfil TEXT NOT NULL,
+  id INTEGER NOT NULL,
+  source BIGINT NOT NULL,
+  target BIGINT NOT NULL,
+  cost DOUBLE PRECISION NOT NULL,
+  arista_id BIGINT,         -- via_arista.id (NULL si es atajo)
+  hijo1 INTEGER,
+  hijo2 INTEGER,
+  PRIMARY KEY (perfil, id)
+);
+"""
+
+# arreglos de una CH que guarda graph_file.py (archivo hermano del grafo)
+ARRAYS = ("rank", "src", "dst", "cost", "orig", "child1", "child2", "up_node", "up_edge", "up_offsets")
+
+WITNESS_SETTLE = 60      # nodos asentados por búsqueda de testigo al contraer
+SIMULATE_SETTLE = 20     # idem al estimar la prioridad
+
+
+def _witness(adj, u, skip, targets, max_cost, settle_limit):
+    # Dijkstra acotado desde u evitando `skip`; devuelve distancias alcanzadas
+    dist = {u: 0.0}
+    heap = [(0.0, u)]
+    settled = 0
+    pending = set(targets)
+    while heap and pending and settled < settle_limit:
+        d, x = heapq.heappop(heap)
+        if d > dist[x]:
+            continue
+        if d > max_cost:
+            break
+        settled += 1
+        pending.discard(x)
+        for y, (c, _) in adj[x].items():
+            if y == skip:
+                continue
+            nd = d + c
+            if nd < dist.get(y, INF):
+                dist[y] = nd
+                heapq.heappush(heap, (nd, y))
+    return dist
+
+
+def _shortcuts(adj, v, settle_limit):
+    nbrs = list(adj[v].items())
+    out = []
+    for i, (u, (cu, eu)) in enumerate(nbrs):
+        rest = nbrs[i + 1:]
+        if not rest:
+            break
+        max_cost = cu + max(cw for _, (cw, _) in rest)
+        dist = _witness(adj, u, v, [w for w, _ in rest], max_cost, settle_limit)
+        for w, (cw, ew) in rest:
+            if dist.get(w, INF) > cu + cw:
+                out.append((u, w, cu + cw, eu, ew))
+    return out
+
+
+def build(g: Graph, profile="shortest", log=print):
+    n = g.n_nodes
+    w = g.costs[profile]
+    # aristas CH: (a, b, costo, arista original, hijo1, hijo2)
+    ea, eb, ec, eo, h1, h2 = [], [], [], [], [], []
+    adj = [dict() for _ in range(n)]
+
+    def add_edge(a, b, c, orig, c1, c2):
+        k = len(ea)
+        ea.append(a); eb.append(b); ec.append(c); eo.append(orig); h1.append(c1); h2.append(c2)
+        adj[a][b] = (c, k)
+        adj[b][a] = (c, k)
+
+    for e in range(g.n_edges):
+        a, b, c = int(g.edge_src[e]), int(g.edge_dst[e]), float(w[e])
+        if a == b:
+            continue
+        if c < adj[a].get(b, (INF, -1))[0]:
+            add_edge(a, b, c, e, -1, -1)
+
+    deleted = [0] * n
+    level = [0] * n
+
+    def priority(v):
+        sc = _shortcuts(adj, v, SIMULATE_SETTLE)
+        return len(sc) - len(adj[v]) + deleted[v] + level[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.zeros(n, dtype=np.int32)
+    keep = []  # aristas vigentes al contraer su extremo inferior (cerrado bajo hijos)
+    r = 0
+    t0 = time.perf_counter()
+    while heap:
+        _, v = heapq.heappop(heap)
+        if rank[v]:
+            continue
+        p = priority(v)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+        for u, w_, c, eu, ew in _shortcuts(adj, v, WITNESS_SETTLE):
+            if c < adj[u].get(w_, (INF, -1))[0]:
+                add_edge(u, w_, c, -1, eu, ew)
+        for u, (_, k) in adj[v].items():
+            keep.append(k)
+            del adj[u][v]
+            deleted[u] += 1
+            level[u] = max(level[u], level[v] + 1)
+        adj[v] = {}
+        r += 1
+        rank[v] = r
+        if r % 5000 == 0:
+            log(f"[ch] contraidos={r}/{n} atajos={len(ea) - g.n_edges} t={time.perf_counter()-t0:.1f}s")
+
+    # renumerar sólo las aristas vigentes
+    keep = sorted(set(keep))
+    remap = {k: i for i, k in enumerate(keep)}
+    src = np.array([ea[k] for k in keep], dtype=np.int32)
+    dst = np.array([eb[k] for k in keep], dtype=np.int32)
+    cost = np.array([ec[k] for k in keep], dtype=np.float64)
+    orig = np.array([eo[k] for k in keep], dtype=np.int32)
+    c1 = np.array([remap[h1[k]] if h1[k] >= 0 else -1 for k in keep], dtype=np.int32)
+    c2 = np.array([remap[h2[k]] if h2[k] >= 0 else -1 for k in keep], dtype=np.int32)
+    return CH(g, rank, src, dst, cost, orig, c1, c2, profile)
+
+
+class CH:
+    def __init__(self, g, rank, src, dst, cost, orig, child1, child2, profile="shortest"):
+        self.g = g
+        self.profile = profile
+        self.rank = np.asarray(rank, dtype=np.int32)
+        self.src = np.asarray(src, dtype=np.int32)
+        self.dst = np.asarray(dst, dtype=np.int32)
+        self.cost = np.asarray(cost, dtype=np.float64)
+        self.orig = np.asarray(orig, dtype=np.int32)
+        self.child1 = np.asarray(child1, dtype=np.int32)
+        self.child2 = np.asarray(child2, dtype=np.int32)
+        # grafo "hacia arriba": desde cada nodo, aristas al extremo de mayor rango
+        up = self.rank[self.dst] > self.rank[self.src]
+        tail = np.where(up, self.src, self.dst)
+        head = np.where(up, self.dst, self.src)
+        order = np.argsort(tail, kind="stable")
+        self.up_node = head[order].astype(np.int32)
+        self.up_edge = order.astype(np.int32)
+        self.up_offsets = np.zeros(g.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tail, minlength=g.n_nodes), out=self.up_offsets[1:])
+
+    @property
+    def n_shortcuts(self):
+        return int((self.orig < 0).sum())
+
+    def shortest_path(self, s, t, profile=None):
+        # búsqueda bidireccional hacia arriba; misma firma que Graph.shortest_path
+        # (profile se ignora: la jerarquía ya corresponde a self.profile)
+        cost, path, _, _ = self.route([(s, 0.0)], [(t, 0.0)])
+        return cost, path
+
+    def route(self, sources, targets, profile=None):
+        # misma firma que Graph.route (semillas (nodo, costo inicial) en cada extremo)
+        off, adj, aed = memoryview(self.up_offsets), memoryview(self.up_node), memoryview(self.up_edge)
+        w = memoryview(self.cost)
+        dist = ({}, {})
+        pred = ({}, {})
+        heaps = ([], [])
+        for side, seeds in ((0, sources), (1, targets)):
+            for v, c, *_ in seeds:
+                if c < dist[side].get(v, INF):
+                    dist[side][v] = c
+                    pred[side][v] = -1
+                    heapq.heappush(heaps[side], (c, v))
+        best, meet = INF, -1
+        while heaps[0] or heaps[1]:
+            side = 0 if (heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0])) else 1
+            d, u = heapq.heappop(heaps[side])
+            if d >= best:
+                heaps[side].clear()
+                continue
+            ds = dist[side]
+            if d > ds[u]:
+                continue
+            other = dist[1 - side]
+            if u in other and d + other[u] < best:
+                best, meet = d + other[u], u
+            ps = pred[side]
+            for k in range(off[u], off[u + 1]):
+                v, e = adj[k], aed[k]
+                nd = d + w[e]
+                if nd < ds.get(v, INF):
+                    ds[v] = nd
+                    ps[v] = e
+                    heapq.heappush(heaps[side], (nd, v))
+        if meet < 0:
+            return INF, None, None, None
+        up_f, s = self._chain(pred[0], meet)
+        up_b, t = self._chain(pred[1], meet)
+        path = []
+        node = s
+        for e in up_f[::-1] + up_b:
+            node = self._unpack(e, node, path)
+        return best, path, s, t
+
+    def _chain(self, pred, node):
+        src, dst = memoryview(self.src), memoryview(self.dst)
+        out = []
+        e = pred[node]
+        while e >= 0:
+            out.append(e)
+            node = src[e] if dst[e] == node else dst[e]
+            e = pred[node]
+        return out, node
+
+    def _unpack(self, e, node, out):
+        # expande la arista CH e recorrida desde `node`; devuelve el nodo final
+        src, dst, orig = memoryview(self.src), memoryview(self.dst), memoryview(self.orig)
+        c1, c2 = memoryview(self.child1), memoryview(self.child2)
+        stack = [(e, node)]
+        while stack:
+            e, node = stack.pop()
+            if orig[e] >= 0:
+                out.append(orig[e])
+                node = src[e] if dst[e] == node else dst[e]
+                continue
+            a, b = c1[e], c2[e]
+            # el hijo que toca `node` va primero
+            if node != src[a] and node != dst[a]:
+                a, b = b, a
+            mid = src[a] if dst[a] == node else dst[a]
+            stack.append((b, mid))
+            stack.append((a, node))
+        return node
+
+    # --- persistencia en PostGIS ---
+
+    def save(self, conn):
+        # requiere SCHEMA_SQL ejecutado (ver main)
+        g, p = self.g, self.profile
+        with conn.cursor() as cur:
+            buf = io.StringIO()
+            for nid, r in zip(g.node_ids.tolist(), self.rank.tolist()):
+                buf.write(f"{p}\t{nid}\t{r}\n")
+            buf.seek(0)
+            cur.copy_from(buf, "via_ch_nodo", columns=("perfil", "id", "rank"))
+            buf = io.StringIO()
+            nids, eids = g.node_ids, g.edge_ids
+            for k in range(len(self.cost)):
+                o = int(self.orig[k])
+                buf.write("\t".join((p, str(k), str(nids[self.src[k]]), str(nids[self.dst[k]]),
+                                     repr(float(self.cost[k])),
+                                     str(eids[o]) if o >= 0 else "\\N",
+                                     str(self.child1[k]) if o < 0 else "\\N",
+                                     str(self.child2[k]) if o < 0 else "\\N")) + "\n")
+            buf.seek(0)
+            cur.copy_from(buf, "via_ch_arista",
+                          columns=("perfil", "id", "source", "target", "cost", "arista_id", "hijo1", "hijo2"))
+            cur.execute("""INSERT INTO via_ch_meta (perfil, n_nodos, n_aristas, costo_total, n_atajos)
+                           VALUES (%s,%s,%s,%s,%s)""",
+                        (p, g.n_nodes, g.n_edges, float(g.costs[p].sum()), self.n_shortcuts))
+
+    @classmethod
+    def load(cls, conn, g: Graph, profile="shortest"):
+        # None si no hay CH para el perfil o no corresponde al grafo cargado
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('via_ch_meta') IS NOT NULL")
+            if not cur.fetchone()[0]:
+                return None
+            cur.execute("SELECT n_nodos, n_aristas, costo_total FROM via_ch_meta WHERE perfil = %s", (profile,))
+            meta = cur.fetchone()
+            total = float(g.costs[profile].sum())
+            if not meta or meta[0] != g.n_nodes or meta[1] != g.n_edges or abs(meta[2] - total) > 1e-3 * max(1.0, total):
+                return None
+            cur.execute("SELECT id, rank FROM via_ch_nodo WHERE perfil = %s ORDER BY id", (profile,))
+            nodes = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+            cur.execute("""SELECT source, target, cost, COALESCE(arista_id, -1),
+                                  COALESCE(hijo1, -1), COALESCE(hijo2, -1)
+                           FROM via_ch_arista WHERE perfil = %s ORDER BY id""", (profile,))
+            rows = cur.fetchall()
+        if len(nodes) != g.n_nodes or not np.array_equal(nodes[:, 0], g.node_ids):
+            return None
+        e = np.array(rows, dtype=np.float64).reshape(-1, 6)
+        src = _index(g.node_ids, e[:, 0].astype(np.int64))
+        dst = _index(g.node_ids, e[:, 1].astype(np.int64))
+        orig_ids = e[:, 3].astype(np.int64)
+        m = orig_ids >= 0
+        o = _index(g.edge_ids, orig_ids[m])
+        if src is None or dst is None or o is None:
+            return None  # nodos o aristas que ya no están en el grafo
+        # cada arco original une los mismos nodos que su arista; cada atajo, dos arcos existentes
+        a, b = np.minimum(g.edge_src[o], g.edge_dst[o]), np.maximum(g.edge_src[o], g.edge_dst[o])
+        if not (np.array_equal(np.minimum(src[m], dst[m]), a) and np.array_equal(np.maximum(src[m], dst[m]), b)):
+            return None
+        kids = e[~m, 4:6]
+        if ((kids < 0) | (kids >= len(e))).any():
+            return None
+        orig = np.full(len(e), -1, dtype=np.int32)
+        orig[m] = o
+        return cls(g, nodes[:, 1], src, dst,
+                   e[:, 2], orig, e[:, 4].astype(np.int32), e[:, 5].astype(np.int32), profile)
+
+    @classmethod
+    def from_arrays(cls, g: Graph, a, profile="shortest"):
+        # arreglos ya calculados (graph_file.load_part), incluido el grafo "hacia arriba"
+        ch = cls.__new__(cls)
+        ch.g, ch.profile = g, profile
+        for k in ARRAYS:
+            setattr(ch, k, a[k])
+        return ch
+
+    @staticmethod
+    def stamp(cur):
+        # estado de via_ch_meta (cambia con cada build, que no toca grafo_version):
+        # la CH guardada en graph_file sólo vale si coincide
+        cur.execute("SELECT to_regclass('via_ch_meta') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT perfil, n_nodos, n_aristas, costo_total, creado::text FROM via_ch_meta ORDER BY perfil")
+        return [list(r) for r in cur.fetchall()]
+
+
+def _index(sorted_ids, ids):
+    # ids -> posiciones en sorted_ids; None si alguno no está
+    if not len(sorted_ids):
+        return None if len(ids) else np.zeros(0, dtype=np.int64)
+    idx = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return idx if np.array_equal(sorted_ids[idx], ids) else None
+
+
+def check(g: Graph, ch: CH, pairs=200, seed=0, log=print):
+    # compara CH contra Dijkstra bidireccional en pares aleatorios
+    rnd = random.Random(seed)
+    w = g.costs[ch.profile]
+    bad = 0
+    for _ in range(pairs):
+        s, t = rnd.randrange(g.n_nodes), rnd.randrange(g.n_nodes)
+        d_ref, _ = g.shortest_path(s, t, ch.profile)
+        d_ch, path = ch.shortest_path(s, t)
+        ok = (d_ref == d_ch == INF) or abs(d_ref - d_ch) <= 1e-6 * max(1.0, d_ref)
+        if ok and path is not None:
+            ok = abs(float(w[path].sum()) - d_ch) <= 1e-6 * max(1.0, d_ch)
+        if not ok:
+            bad += 1
+            log(f"[check] DIFF s={g.node_ids[s]} t={g.node_ids[t]} dijkstra={d_ref} ch={d_ch}")
+    log(f"[check] perfil={ch.profile} pares={pairs} diferencias={bad}")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cmd", choices=["build", "check"])
+    ap.add_argument("--pairs", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--profiles", default=",".join(PROFILES),
+                    help="perfiles separados por coma (default: todos)")
+    args = ap.parse_args()
+    profiles = [p.strip() for p in args.profiles.split(",") if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        ap.error(f"perfiles desconocidos: {unknown}")
+
+    from db import DBPool
+    pool = DBPool(minconn=1, maxconn=1, statement_timeout_ms=0).open()
+    try:
+        with pool.connection() as conn:
+            g = Graph.from_db(conn)
+            print(f"[ch] grafo nodos={g.n_nodes} aristas={g.n_edges}")
+            bad = 0
+            if args.cmd == "build":
+                with conn.cursor() as cur:
+                    cur.execute(SCHEMA_SQL)
+            for p in profiles:
+                if args.cmd == "build":
+                    t0 = time.perf_counter()
+                    ch = build(g, p)
+                    print(f"[ch] perfil={p} atajos={ch.n_shortcuts} aristas_ch={len(ch.cost)} "
+                          f"t={time.perf_counter()-t0:.1f}s")
+                    ch.save(conn)
+                else:
+                    ch = CH.load(conn, g, p)
+                    if ch is None:
+                        print(f"[ERR] via_ch_* ausente o desactualizada (perfil={p}); "
+                              "ejecuta: python ch.py build", file=sys.stderr)
+                        sys.exit(2)
+                bad += check(g, ch, args.pairs, args.seed)
+    finally:
+        pool.close()
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import os, time, threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+# Capa de acceso a PostGIS compartida por los servidores FastAPI.
+# Pool acotado: como mucho DB_POOL_MAX conexiones; si todas están en uso,
+# se espera hasta DB_POOL_TIMEOUT_S antes de fallar con PoolTimeout.
+
+DB_HOST = os.getenv("DB_HOST", "db")
+DB_NAME = os.getenv("DB_NAME", "gis")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "postgres")
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "5"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class DBPool:
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout_s=POOL_TIMEOUT_S,
+                 statement_timeout_ms=STATEMENT_TIMEOUT_MS):
+        self.minconn, self.maxconn = minconn, maxconn
+        self.timeout_s = timeout_s
+        self.statement_timeout_ms = statement_timeout_ms
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_s = 0.0
+        self.on_wait = None  # callback(segundos) por cada conexión obtenida (metrics.add_stage)
+
+    def open(self, retries=30, delay=1.0):
+        # al arrancar la BD puede no estar lista todavía (docker compose)
+        last_err = None
+        for _ in range(retries):
+            try:
+                self._pool = ThreadedConnectionPool(
+                    self.minconn, self.maxconn,
+                    host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                    options=f"-c statement_timeout={self.statement_timeout_ms}")
+                return self
+            except psycopg2.OperationalError as e:
+                last_err = e
+                time.sleep(delay)
+        raise last_err
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
+
+    @contextmanager
+    def connection(self):
+        if self._pool is None:
+            raise RuntimeError("pool de BD no inicializado")
+        t0 = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout_s):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"sin conexión libre tras {self.timeout_s}s (max={self.maxconn})")
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_s += waited
+        if self.on_wait is not None:
+            self.on_wait(waited)
+        broken = False
+        try:
+            with conn:  # commit/rollback al salir
+                yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            broken = broken or conn.closed != 0
+            self._pool.putconn(conn, close=broken)
+            with self._lock:
+                self.in_use -= 1
+                self.discarded += int(broken)
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            yield cur
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "idle": len(self._pool._pool) if self._pool is not None else 0,
+                "acquired": self.acquired,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "wait_s": round(self.wait_s, 6),
+            }
+
+
+def graph_version(cur):
+    # grafo_version la incrementan los triggers de via_arista / via_arista_exposicion
+    # y cada `python bebederos.py build`; la leen la API y graph_file.py
+    cur.execute("SELECT to_regclass('grafo_version') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("SELECT version FROM grafo_version WHERE id = 1")
+    row = cur.fetchone()
+    return row[0] if row else None
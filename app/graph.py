@@ -0,0 +1,322 @@
+import heapq
+import numpy as np
+
+# Grafo vial en memoria (CSR, no dirigido como en pgr_dijkstra(directed := false)).
+# Los nodos y aristas se indexan en forma densa (0..n-1); node_ids / edge_ids
+# traducen de vuelta a via_nodo.id / via_arista.id.
+
+EDGES_SQL = """
+SELECT id, source, target, length_m, ST_AsBinary(geom, 'NDR')
+FROM via_arista
+WHERE source IS NOT NULL AND target IS NOT NULL AND length_m IS NOT NULL AND length_m >= 0
+ORDER BY id
+"""
+NODES_SQL = "SELECT id, ST_X(geom), ST_Y(geom) FROM via_nodo ORDER BY id"
+# atributos de exposición precalculados por db/load/load_exposicion.sql
+EXPO_SQL = "SELECT arista_id, frac_sombra, temp_c, uv_index FROM via_arista_exposicion"
+
+INF = float("inf")
+
+# Perfiles de costo: (w_sol, w_temp, w_uv). Para cada arista
+#   costo = largo * (1 + w_sol*(1-sombra) + w_temp*temp_n + w_uv*uv_n*(1-sombra))
+# con temp_n, uv_n normalizados a [0,1] sobre la red completa.
+PROFILES = {
+    "shortest": (0.0, 0.0, 0.0),
+    "shadiest": (2.0, 0.0, 0.0),
+    "coolest":  (0.0, 2.0, 0.0),
+    "balanced": (1.0, 1.0, 1.0),
+}
+
+
+def pack_wkb_lines(geoms):
+    # WKB LineString (little endian, 2D) -> (offsets, vértices) en arreglos contiguos
+    counts = np.zeros(len(geoms) + 1, dtype=np.int64)
+    parts = []
+    for i, b in enumerate(geoms):
+        b = bytes(b)
+        n = int.from_bytes(b[5:9], "little")
+        counts[i + 1] = n
+        parts.append(np.frombuffer(b, dtype="<f8", count=2 * n, offset=9))
+    xy = np.concatenate(parts).reshape(-1, 2) if parts else np.zeros((0, 2))
+    return np.cumsum(counts), xy
+
+
+class Graph:
+    def __init__(self, node_ids, lon, lat, edge_ids, edge_src, edge_dst, length, expo=None,
+                 geom_offsets=None, geom_xy=None):
+        self.node_ids = np.asarray(node_ids, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        self.edge_src = np.asarray(edge_src, dtype=np.int32)
+        self.edge_dst = np.asarray(edge_dst, dtype=np.int32)
+        self.length = np.asarray(length, dtype=np.float64)
+        self.version = None  # grafo_version al cargar (ver server.load_graph)
+        # geometría empaquetada: vértices (lon, lat) de la arista e en
+        # geom_xy[geom_offsets[e]:geom_offsets[e+1]]
+        self.geom_offsets = None if geom_offsets is None else np.asarray(geom_offsets, dtype=np.int64)
+        self.geom_xy = None if geom_xy is None else np.asarray(geom_xy, dtype=np.float64).reshape(-1, 2)
+        self._set_exposure(expo)
+        self.costs = {k: self.weighted_cost(w) for k, w in PROFILES.items()}
+        self._custom = {}
+        self._build_csr()
+
+    @classmethod
+    def from_rows(cls, edge_rows, node_rows=(), expo_rows=None, geoms=None):
+        # edge_rows: (id, source, target, length_m); node_rows: (id, lon, lat);
+        # expo_rows: (arista_id, frac_sombra, temp_c, uv_index);
+        # geoms: WKB (LineString) alineado con edge_rows
+        e = np.array(edge_rows, dtype=np.float64).reshape(-1, 4)
+        eid = e[:, 0].astype(np.int64)
+        src = e[:, 1].astype(np.int64)
+        dst = e[:, 2].astype(np.int64)
+        nd = np.array(node_rows, dtype=np.float64).reshape(-1, 3)
+        ids = np.union1d(np.union1d(src, dst), nd[:, 0].astype(np.int64))
+        lon = np.full(len(ids), np.nan)
+        lat = np.full(len(ids), np.nan)
+        if len(nd):
+            k = np.searchsorted(ids, nd[:, 0].astype(np.int64))
+            lon[k] = nd[:, 1]
+            lat[k] = nd[:, 2]
+        expo = None
+        if expo_rows:
+            x = np.array(expo_rows, dtype=np.float64).reshape(-1, 4)  # None -> nan
+            k = np.searchsorted(eid, x[:, 0].astype(np.int64))
+            ok = (k < len(eid)) & (eid[np.minimum(k, len(eid) - 1)] == x[:, 0])
+            expo = {}
+            for j, name in ((1, "shade"), (2, "temp"), (3, "uv")):
+                col = np.full(len(eid), np.nan)
+                col[k[ok]] = x[ok, j]
+                expo[name] = col
+        goff = gxy = None
+        if geoms is not None:
+            goff, gxy = pack_wkb_lines(geoms)
+        return cls(ids, lon, lat, eid,
+                   np.searchsorted(ids, src), np.searchsorted(ids, dst),
+                   e[:, 3], expo, goff, gxy)
+
+    @classmethod
+    def from_arrays(cls, a, version=None):
+        # arreglos ya calculados (CSR, exposición normalizada, costo por perfil),
+        # p.ej. mapeados desde graph_file.py: se usan tal cual, sin copiar
+        g = cls.__new__(cls)
+        for k in ("node_ids", "lon", "lat", "edge_ids", "edge_src", "edge_dst", "length",
+                  "shade", "temp_n", "uv_n", "offsets", "adj_node", "adj_edge"):
+            setattr(g, k, a[k])
+        g.geom_offsets, g.geom_xy = a.get("geom_offsets"), a.get("geom_xy")
+        g.version = version
+        g.costs = {p: a[f"cost_{p}"] for p in PROFILES}
+        g._custom = {}
+        return g
+
+    @classmethod
+    def from_db(cls, conn):
+        with conn.cursor() as cur:
+            cur.execute(EDGES_SQL)
+            rows = cur.fetchall()
+            edges = [r[:4] for r in rows]
+            geoms = [r[4] for r in rows]
+            cur.execute(NODES_SQL)
+            nodes = cur.fetchall()
+            cur.execute("SELECT to_regclass('via_arista_exposicion') IS NOT NULL")
+            expo = None
+            if cur.fetchone()[0]:
+                cur.execute(EXPO_SQL)
+                expo = cur.fetchall()
+        return cls.from_rows(edges, nodes, expo, geoms)
+
+    def _set_exposure(self, expo):
+        # sin datos: todo al sol, temperatura/UV neutras (perfiles ~ shortest)
+        m = len(self.edge_ids)
+        expo = expo or {}
+        shade = np.asarray(expo.get("shade", np.zeros(m)), dtype=np.float64)
+        self.shade = np.clip(np.nan_to_num(shade, nan=0.0), 0.0, 1.0)
+        self.temp_n = self._normalize(expo.get("temp"), m)
+        self.uv_n = self._normalize(expo.get("uv"), m)
+
+    @staticmethod
+    def _normalize(v, m):
+        if v is None:
+            return np.zeros(m)
+        v = np.asarray(v, dtype=np.float64)
+        ok = np.isfinite(v)
+        if not ok.any():
+            return np.zeros(m)
+        lo, hi = v[ok].min(), v[ok].max()
+        out = np.where(ok, v, v[ok].mean())
+        return (out - lo) / (hi - lo) if hi > lo else np.zeros(m)
+
+    def weighted_cost(self, weights):
+        w_sol, w_temp, w_uv = (float(x) for x in weights)
+        sun = 1.0 - self.shade
+        return self.length * (1.0 + w_sol * sun + w_temp * self.temp_n + w_uv * self.uv_n * sun)
+
+    def cost(self, profile="shortest"):
+        # nombre de perfil o tupla (w_sol, w_temp, w_uv)
+        if isinstance(profile, str):
+            return self.costs[profile]
+        key = tuple(round(float(x), 3) for x in profile)
+        c = self._custom.get(key)
+        if c is None:
+            if len(self._custom) >= 16:
+                self._custom.pop(next(iter(self._custom)), None)
+            c = self._custom[key] = self.weighted_cost(key)
+        return c
+
+    def edge_coords(self, e):
+        return self.geom_xy[self.geom_offsets[e]:self.geom_offsets[e + 1]]
+
+    def _build_csr(self):
+        n, m = len(self.node_ids), len(self.edge_ids)
+        # cada arista aparece en ambos sentidos
+        tail = np.concatenate([self.edge_src, self.edge_dst])
+        head = np.concatenate([self.edge_dst, self.edge_src])
+        edge = np.concatenate([np.arange(m, dtype=np.int32)] * 2)
+        order = np.argsort(tail, kind="stable")
+        self.adj_node = head[order].astype(np.int32)
+        self.adj_edge = edge[order].astype(np.int32)
+        self.offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tail, minlength=n), out=self.offsets[1:])
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def n_edges(self):
+        return len(self.edge_ids)
+
+    def node_index(self, node_id):
+        i = int(np.searchsorted(self.node_ids, node_id))
+        if i < len(self.node_ids) and self.node_ids[i] == node_id:
+            return i
+        return None
+
+    def shortest_path(self, s, t, profile="shortest"):
+        # Dijkstra bidireccional; s, t son índices densos.
+        # Devuelve (costo, [índices de arista en orden]) o (inf, None).
+        cost, path, _, _ = self.route([(s, 0.0)], [(t, 0.0)], profile)
+        return cost, path
+
+    def route(self, sources, targets, profile="shortest"):
+        # Igual que shortest_path, pero cada extremo es una lista de semillas
+        # (nodo, costo inicial), p.ej. los dos extremos de una arista partida
+        # por el snap. Devuelve (costo, aristas, nodo semilla origen, nodo semilla destino).
+        off, adj, aed = memoryview(self.offsets), memoryview(self.adj_node), memoryview(self.adj_edge)
+        w = memoryview(self.cost(profile))
+        dist = ({}, {})
+        pred = ({}, {})  # nodo -> arista por la que se llegó (-1 = semilla)
+        heaps = ([], [])
+        for side, seeds in ((0, sources), (1, targets)):
+            for v, c, *_ in seeds:
+                if c < dist[side].get(v, INF):
+                    dist[side][v] = c
+                    pred[side][v] = -1
+                    heapq.heappush(heaps[side], (c, v))
+        best, meet = INF, -1
+        for v, c in dist[0].items():
+            if v in dist[1] and c + dist[1][v] < best:
+                best, meet = c + dist[1][v], v
+        done = (set(), set())
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            d, u = heapq.heappop(heaps[side])
+            if u in done[side]:
+                continue
+            done[side].add(u)
+            ds, ps, other = dist[side], pred[side], dist[1 - side]
+            for k in range(off[u], off[u + 1]):
+                v, e = adj[k], aed[k]
+                nd = d + w[e]
+                if nd < ds.get(v, INF):
+                    ds[v] = nd
+                    ps[v] = e
+                    heapq.heappush(heaps[side], (nd, v))
+                if v in other and nd + other[v] < best:
+                    best, meet = nd + other[v], v
+        if meet < 0:
+            return INF, None, None, None
+        fwd, s = self.walk(pred[0], meet)
+        bwd, t = self.walk(pred[1], meet)
+        return best, fwd[::-1] + bwd, s, t
+
+    def one_to_many(self, sources, targets=None, profile="shortest", limit=INF):
+        # Dijkstra desde semillas (nodo, costo inicial, largo inicial, ...). Se detiene al
+        # asentar todos los `targets` (si se dan) o al superar `limit` de costo.
+        # Devuelve dicts por nodo asentado: costo, largo en metros, arista predecesora.
+        off, adj, aed = memoryview(self.offsets), memoryview(self.adj_node), memoryview(self.adj_edge)
+        w, ln = memoryview(self.cost(profile)), memoryview(self.length)
+        dist, length, pred = {}, {}, {}
+        heap = []
+        for v, c, l, *_ in sources:
+            if c < dist.get(v, INF):
+                dist[v], length[v], pred[v] = c, l, -1
+                heapq.heappush(heap, (c, v))
+        pending = set(targets) if targets is not None else None
+        done = {}
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if d > limit:
+                break
+            done[u] = d
+            if pending is not None:
+                pending.discard(u)
+                if not pending:
+                    break
+            lu = length[u]
+            for k in range(off[u], off[u + 1]):
+                v, e = adj[k], aed[k]
+                nd = d + w[e]
+                # lo que ya supera el límite no entra al heap: la búsqueda acotada
+                # sólo toca la parte alcanzable del grafo y su borde
+                if nd <= limit and nd < dist.get(v, INF):
+                    dist[v], length[v], pred[v] = nd, lu + ln[e], e
+                    heapq.heappush(heap, (nd, v))
+        return done, {v: length[v] for v in done}, {v: pred[v] for v in done}
+
+    def coverage(self, done, cutoff, profile="shortest"):
+        # tramos de arista alcanzables con costo <= cutoff dado el costo por nodo `done`
+        # (salida de one_to_many): lista de (arista, f0, f1), fracciones a lo largo del
+        # costo de la arista desde edge_src. Una arista con ambos extremos alcanzados
+        # queda completa si su punto más caro, (du + dv + w) / 2, entra en el límite.
+        off, aed = memoryview(self.offsets), memoryview(self.adj_edge)
+        w = memoryview(self.cost(profile))
+        src, dst = self.edge_src, self.edge_dst
+        out, seen = [], set()
+        for u, du in done.items():
+            if du > cutoff:
+                continue
+            for k in range(off[u], off[u + 1]):
+                e = aed[k]
+                if e in seen:
+                    continue
+                seen.add(e)
+                a, b = int(src[e]), int(dst[e])
+                ca, cb, we = done.get(a, INF), done.get(b, INF), w[e]
+                if we <= 0 or (ca + cb + we) / 2 <= cutoff:
+                    out.append((e, 0.0, 1.0))
+                    continue
+                fa = (cutoff - ca) / we if ca <= cutoff else 0.0
+                fb = (cutoff - cb) / we if cb <= cutoff else 0.0
+                if fa > 0:
+                    out.append((e, 0.0, min(1.0, fa)))
+                if fb > 0:
+                    out.append((e, max(0.0, 1.0 - fb), 1.0))
+        return out
+
+    def other_end(self, e, node):
+        return int(self.edge_src[e]) if self.edge_dst[e] == node else int(self.edge_dst[e])
+
+    def walk(self, pred, node):
+        # sigue los predecesores desde `node` hasta la semilla; devuelve (aristas, semilla)
+        out = []
+        e = pred[node]
+        while e >= 0:
+            out.append(e)
+            node = self.other_end(e, node)
+            e = pred[node]
+        return out, node
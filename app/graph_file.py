@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import argparse, hashlib, json, mmap, os, struct, sys, time
+import numpy as np
+from graph import Graph, PROFILES
+from ch import CH, ARRAYS as CH_ARRAYS
+from bebederos import Nearest
+from snap import SnapIndex
+
+# Grafo en un archivo binario versionado que los workers de la API mapean en
+# memoria (sólo lectura): arrancan en milisegundos y el sistema operativo
+# comparte las páginas entre procesos en vez de una copia por worker.
+#   python graph_file.py export [--out /app/artifacts/graph.bin]   # después de cargar la BD
+#   python graph_file.py check                                     # archivo vs. BD
+#
+# Formato: MAGIC | u32 versión de esquema | u32 largo del encabezado | encabezado JSON
+# (tipo, grafo_version, n_nodos, n_aristas, sha256 de los datos, arreglos con dtype/
+# forma/desplazamiento) | datos, cada arreglo alineado a 64 bytes.
+#
+# El sha256 se verifica al exportar (se relee el archivo recién escrito) y en `check`;
+# al arrancar un worker sólo se validan encabezado, esquema, grafo_version, perfiles y
+# tamaños (GRAPH_FILE_VERIFY=1 en la API fuerza también el checksum).
+# Lo que se deriva del grafo va en archivos hermanos con el mismo formato
+# (<archivo>.ch, .nearest, .snap): la CH por perfil, el bebedero más cercano y el
+# índice de snap ya armados. Cada uno guarda además el estado de su fuente (via_ch_meta,
+# via_bebedero_meta + bebederos, tamaño de celda) y se descarta si ya no coincide: la CH
+# y los bebederos pueden rehacerse en la BD sin reexportar, el worker los vuelve a leer
+# de ahí y reescribe su archivo.
+MAGIC = b"FASE2GRF"
+SCHEMA_VERSION = 2
+ALIGN = 64
+PREFIX = struct.Struct("<8sII")
+ARRAYS = ("node_ids", "lon", "lat", "edge_ids", "edge_src", "edge_dst", "length",
+          "shade", "temp_n", "uv_n", "offsets", "adj_node", "adj_edge",
+          "geom_offsets", "geom_xy")
+
+
+class GraphFileError(Exception):
+    # archivo ausente, dañado, de otro esquema o de otra grafo_version
+    pass
+
+
+def _pad(n):
+    return -n % ALIGN
+
+
+def _write(path, arrays, meta):
+    # meta (dict) + arreglos -> archivo con el formato de arriba, reemplazo atómico
+    layout, off = {}, 0
+    for k, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        arrays[k] = a
+        layout[k] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": off}
+        off += a.nbytes + _pad(a.nbytes)
+    h = hashlib.sha256()
+    for a in arrays.values():
+        h.update(memoryview(a).cast("B"))
+        h.update(b"\0" * _pad(a.nbytes))
+    header = json.dumps({**meta, "sha256": h.hexdigest(), "arrays": layout,
+                         "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}).encode()
+    header += b" " * _pad(PREFIX.size + len(header))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, SCHEMA_VERSION, len(header)))
+        f.write(header)
+        for a in arrays.values():
+            f.write(memoryview(a).cast("B"))
+            f.write(b"\0" * _pad(a.nbytes))
+    # reemplazo atómico: los workers que ya lo tienen mapeado siguen con el anterior
+    os.replace(tmp, path)
+    return off
+
+
+def read_header(buf):
+    if len(buf) < PREFIX.size:
+        raise GraphFileError("archivo truncado")
+    magic, schema, hlen = PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise GraphFileError("no es un archivo de grafo")
+    if schema != SCHEMA_VERSION:
+        raise GraphFileError(f"esquema {schema}, se esperaba {SCHEMA_VERSION}")
+    try:
+        header = json.loads(bytes(buf[PREFIX.size:PREFIX.size + hlen]))
+    except ValueError:
+        raise GraphFileError("encabezado ilegible")
+    return header, PREFIX.size + hlen
+
+
+def _read(path, kind, version, verify):
+    # -> (encabezado, arreglos sobre el archivo mapeado); GraphFileError si no es
+    # un archivo `kind` de esa grafo_version o está dañado
+    try:
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise GraphFileError(str(e))
+    header, start = read_header(buf)
+    if header.get("kind") != kind:
+        raise GraphFileError(f"contiene {header.get('kind')}, se esperaba {kind}")
+    if version is None or header.get("grafo_version") != version:
+        raise GraphFileError(f"grafo_version {header.get('grafo_version')} en el archivo, {version} en la BD")
+    if verify and hashlib.sha256(memoryview(buf)[start:]).hexdigest() != header["sha256"]:
+        raise GraphFileError("checksum no coincide")
+    size = max((s["offset"] + int(np.prod(s["shape"])) * np.dtype(s["dtype"]).itemsize
+                for s in header["arrays"].values()), default=0)
+    if start + size + _pad(size) != len(buf):
+        raise GraphFileError(f"tamaño {len(buf)}, el encabezado indica {start + size + _pad(size)}")
+    arrays = {}
+    for k, spec in header["arrays"].items():
+        dt = np.dtype(spec["dtype"])
+        n = int(np.prod(spec["shape"]))
+        if start + spec["offset"] + n * dt.itemsize > len(buf):
+            raise GraphFileError(f"arreglo {k} fuera del archivo")
+        arrays[k] = np.frombuffer(buf, dtype=dt, count=n, offset=start + spec["offset"]).reshape(spec["shape"])
+    return header, arrays
+
+
+def save(g: Graph, path):
+    arrays = {k: getattr(g, k) for k in ARRAYS if getattr(g, k, None) is not None}
+    arrays.update({f"cost_{p}": g.costs[p] for p in PROFILES})
+    return _write(path, arrays, {"kind": "graph", "grafo_version": g.version, "n_nodes": g.n_nodes,
+                                 "n_edges": g.n_edges, "profiles": list(PROFILES)})
+
+
+def load(path, version, verify=True):
+    # -> Graph sobre el archivo mapeado; GraphFileError si no sirve para `version`.
+    # verify: además recalcula el sha256 de todos los datos (lee el archivo completo)
+    header, arrays = _read(path, "graph", version, verify)
+    if header.get("profiles") != list(PROFILES):
+        raise GraphFileError("perfiles distintos a graph.PROFILES")
+    g = Graph.from_arrays(arrays, version)
+    if g.n_nodes != header["n_nodes"] or g.n_edges != header["n_edges"]:
+        raise GraphFileError("tamaños del encabezado no coinciden con los arreglos")
+    return g
+
+
+# --- componentes derivados del grafo, cada uno en su archivo hermano -----------
+
+def part_path(path, kind):
+    return f"{path}.{kind}"
+
+
+def save_part(path, kind, g: Graph, stamp, arrays, meta=None):
+    # stamp: estado de la fuente del componente (p.ej. CH.stamp) al armarlo;
+    # meta: escalares que el componente necesita además de los arreglos
+    return _write(part_path(path, kind), dict(arrays),
+                  {"kind": kind, "grafo_version": g.version, "n_nodes": g.n_nodes,
+                   "n_edges": g.n_edges, "stamp": stamp, "meta": meta})
+
+
+def load_part(path, kind, g: Graph, stamp, verify=False):
+    # -> (arreglos, meta) si el archivo es de este grafo y de la misma `stamp`
+    header, arrays = _read(part_path(path, kind), kind, g.version, verify)
+    if header.get("n_nodes") != g.n_nodes or header.get("n_edges") != g.n_edges:
+        raise GraphFileError("tamaños distintos a los del grafo")
+    if header.get("stamp") != stamp:
+        raise GraphFileError(f"{kind} cambió en la BD desde que se guardó")
+    return arrays, header.get("meta")
+
+
+def save_ch(path, g: Graph, stamp, hier):
+    # {perfil: CH}; sin CH se guarda vacío, así el worker no vuelve a la BD a buscarla
+    return save_part(path, "ch", g, stamp, {f"{p}.{k}": getattr(ch, k) for p, ch in hier.items() for k in CH_ARRAYS})
+
+
+def load_ch(path, g: Graph, stamp, verify=False):
+    a, _ = load_part(path, "ch", g, stamp, verify)
+    return {p: CH.from_arrays(g, {k: a[f"{p}.{k}"] for k in CH_ARRAYS}, p) for p in PROFILES if f"{p}.rank" in a}
+
+
+def save_nearest(path, g: Graph, stamp, near):
+    return save_part(path, "nearest", g, stamp, near.to_arrays() if near is not None else {})
+
+
+def load_nearest(path, g: Graph, stamp, verify=False):
+    a, _ = load_part(path, "nearest", g, stamp, verify)
+    return Nearest(g, **a) if a else None
+
+
+def save_snap(path, g: Graph, stamp, ix: SnapIndex):
+    # stamp: {"cell": tamaño de celda}; el índice depende sólo de eso y del grafo
+    return save_part(path, "snap", g, stamp, *ix.to_arrays())
+
+
+def load_snap(path, g: Graph, stamp, verify=False):
+    a, meta = load_part(path, "snap", g, stamp, verify)
+    return SnapIndex.from_arrays(g, a, meta)
+
+
+# nombre -> (load, save), para server.load_part
+PARTS = {"ch": (load_ch, save_ch), "nearest": (load_nearest, save_nearest), "snap": (load_snap, save_snap)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("cmd", choices=["export", "check"])
+    ap.add_argument("--out", default=os.getenv("GRAPH_FILE") or "graph.bin")
+    args = ap.parse_args()
+
+    from db import DBPool, graph_version
+    pool = DBPool(minconn=1, maxconn=1, statement_timeout_ms=0).open()
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                version = graph_version(cur)
+                ch_stamp, near_stamp = CH.stamp(cur), Nearest.stamp(cur)
+            t0 = time.perf_counter()
+            g = Graph.from_db(conn)
+            g.version = version
+            t_db = time.perf_counter() - t0
+            if args.cmd == "export":
+                hier = {p: CH.load(conn, g, p) for p in PROFILES}
+                hier = {p: ch for p, ch in hier.items() if ch is not None}
+                ix = SnapIndex(g)
+                near = Nearest.load(conn, g, ix)
+    finally:
+        pool.close()
+    if args.cmd == "export":
+        n = save(g, args.out)
+        n += save_ch(args.out, g, ch_stamp, hier)
+        n += save_nearest(args.out, g, near_stamp, near)
+        n += save_snap(args.out, g, {"cell": ix.cell}, ix)
+        try:
+            # única verificación completa del checksum
+            load(args.out, version, verify=True)
+            load_ch(args.out, g, ch_stamp, verify=True)
+            load_nearest(args.out, g, near_stamp, verify=True)
+            load_snap(args.out, g, {"cell": ix.cell}, verify=True)
+        except GraphFileError as e:
+            print(f"[ERR] {args.out} recién escrito no verifica: {e}", file=sys.stderr)
+            sys.exit(2)
+        print(f"[graph_file] {args.out} version={version} nodos={g.n_nodes} aristas={g.n_edges} "
+              f"ch={','.join(hier) or 'no'} bebederos={'si' if near else 'no'} "
+              f"datos={n/1e6:.1f}MB t_bd={t_db:.2f}s")
+        return
+    t0 = time.perf_counter()
+    try:
+        m = load(args.out, version)
+    except GraphFileError as e:
+        print(f"[ERR] {args.out}: {e}", file=sys.stderr)
+        sys.exit(2)
+    t_file = time.perf_counter() - t0
+    bad = [k for k in ARRAYS if getattr(g, k) is not None and not np.array_equal(getattr(g, k), getattr(m, k), equal_nan=True)]
+    bad += [p for p in PROFILES if not np.array_equal(g.costs[p], m.costs[p])]
+    print(f"[check] version={version} t_bd={t_db:.2f}s t_archivo={t_file*1000:.1f}ms diferencias={bad or 0}")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
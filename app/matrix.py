@@ -0,0 +1,79 @@
+import math, os
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+# Matriz de distancias muchos-a-muchos: un Dijkstra uno-a-muchos por origen,
+# compartido entre todos los destinos, repartido en un pool de workers.
+# Por omisión, hilos (MATRIX_EXECUTOR=thread): quedan limitados por el GIL, pero el
+# runner se crea en load_graph(), que también corre desde el watcher de versión en
+# un proceso con hilos (uvicorn, pool de BD), y ahí un fork puede heredar locks tomados.
+# MATRIX_EXECUTOR=process usa procesos con forkserver: cada worker recibe una copia
+# del grafo (pickle) al arrancar, a cambio de paralelismo real.
+
+MATRIX_MAX_CELLS = int(os.getenv("MATRIX_MAX_CELLS", "250000"))
+MATRIX_WORKERS = int(os.getenv("MATRIX_WORKERS", str(os.cpu_count() or 2)))
+MATRIX_EXECUTOR = os.getenv("MATRIX_EXECUTOR", "thread")
+
+_G = None  # grafo del worker (procesos)
+
+
+def _init_worker(g):
+    global _G
+    _G = g
+
+
+def _row_worker(args):
+    return one_row(_G, *args)
+
+
+def one_row(g, seeds, targets, profile):
+    # seeds: semillas del origen; targets: lista de semillas por destino.
+    # -> (largo en m, costo) por destino; nan si no es alcanzable
+    need = {s[0] for t in targets for s in t}
+    dist, length, _ = g.one_to_many(seeds, need, profile)
+    # origen sobre una arista partida: un destino en la misma arista se alcanza directo
+    src_edge = {s[3]: s for s in seeds if s[3] >= 0}
+    lens, costs = [], []
+    for t in targets:
+        best_c, best_l = math.inf, math.nan
+        for v, c, l, e in t:
+            if v in dist and dist[v] + c < best_c:
+                best_c, best_l = dist[v] + c, length[v] + l
+            s = src_edge.get(e)
+            if s is not None and s[0] == v and abs(s[1] - c) < best_c:
+                best_c, best_l = abs(s[1] - c), abs(s[2] - l)
+        lens.append(best_l)
+        costs.append(best_c if best_c < math.inf else math.nan)
+    return lens, costs
+
+
+class MatrixRunner:
+    def __init__(self, g, workers=MATRIX_WORKERS, kind=MATRIX_EXECUTOR):
+        self.g = g
+        self.kind = kind
+        self.workers = workers
+        if kind == "process":
+            self.pool = ProcessPoolExecutor(workers, mp_context=mp.get_context("forkserver"),
+                                            initializer=_init_worker, initargs=(g,))
+            # los workers nacen en el primer submit (y copian el grafo): forzarlo
+            # aquí, al cargar el grafo, y no en medio de una petición
+            self.pool.submit(int).result()
+        else:
+            self.pool = ThreadPoolExecutor(workers)
+
+    def run(self, src_seeds, tgt_seeds, profile="shortest"):
+        # -> (largos, costos) como arreglos float32 de forma (n_src, n_tgt)
+        if self.kind == "process":
+            chunk = max(1, len(src_seeds) // (4 * self.workers))
+            rows = self.pool.map(_row_worker, [(s, tgt_seeds, profile) for s in src_seeds], chunksize=chunk)
+        else:
+            rows = self.pool.map(lambda s: one_row(self.g, s, tgt_seeds, profile), src_seeds)
+        lens = np.full((len(src_seeds), len(tgt_seeds)), np.nan, dtype=np.float32)
+        costs = np.full_like(lens, np.nan)
+        for i, (l, c) in enumerate(rows):
+            lens[i], costs[i] = l, c
+        return lens, costs
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
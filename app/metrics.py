@@ -0,0 +1,209 @@
+import bisect, contextvars, os, threading, time
+from contextlib import contextmanager
+
+# Instrumentación liviana de la API, sin dependencias:
+# - TimingMiddleware (ASGI puro) mide cada request; los handlers marcan etapas con
+#   `with stage("snap"): ...` y el total por etapa vuelve en el header Server-Timing.
+# - Metrics acumula contadores e histogramas por ruta (plantilla, p.ej. /tiles/{layer}/...)
+#   y por etapa; render() los entrega en formato de texto de Prometheus para /metrics.
+# - Requests más lentos que SLOW_REQUEST_MS se registran con su desglose por etapa.
+# Las etapas viajan en un contextvar: los handlers síncronos corren en el threadpool
+# con una copia del contexto del request, así que ven el mismo objeto.
+# Con varios workers de uvicorn cada proceso expone sus propios contadores.
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))   # 0 = sin log
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+# límites superiores de los baldes (segundos), como los de prometheus_client más 1-2.5 ms
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_CURRENT = contextvars.ContextVar("request_timing", default=None)
+
+
+class Timing:
+    __slots__ = ("t0", "stages", "notes")
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.stages = {}   # etapa -> segundos (acumulados si se repite)
+        self.notes = {}    # etapa -> descripción (p.ej. cache=hit)
+
+    def add(self, name, dt):
+        self.stages[name] = self.stages.get(name, 0.0) + dt
+
+    def header(self, total):
+        parts = []
+        for k, v in self.stages.items():
+            d = self.notes.get(k)
+            parts.append(f"{k};dur={v*1000:.3f}" + (f';desc="{d}"' if d else ""))
+        for k, d in self.notes.items():
+            if k not in self.stages:
+                parts.append(f'{k};desc="{d}"')
+        parts.append(f"total;dur={total*1000:.3f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def stage(name):
+    t = _CURRENT.get()
+    if t is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.add(name, time.perf_counter() - t0)
+
+
+def add_stage(name, dt):
+    # para tiempos medidos por otro componente (p.ej. la espera del pool en db.py)
+    t = _CURRENT.get()
+    if t is not None:
+        t.add(name, dt)
+
+
+def note(name, desc):
+    t = _CURRENT.get()
+    if t is not None:
+        t.notes[name] = desc
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)   # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(BUCKETS, v)] += 1
+        self.sum += v
+        self.count += 1
+
+
+def _esc(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**kw):
+    return "{" + ",".join(f'{k}="{_esc(v)}"' for k, v in kw.items()) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}   # (ruta, método, status) -> n
+        self.errors = {}     # (ruta, método) -> n (status >= 500 o excepción)
+        self.latency = {}    # (ruta, método) -> Histogram
+        self.stages = {}     # (ruta, etapa) -> Histogram
+        self.slow = 0
+        self.inflight = 0
+        self.started = time.time()
+
+    def begin(self):
+        with self._lock:
+            self.inflight += 1
+
+    def observe(self, route, method, status, total, stages, slow=False):
+        with self._lock:
+            self.inflight -= 1
+            self.slow += slow
+            k = (route, method, status)
+            self.requests[k] = self.requests.get(k, 0) + 1
+            if status >= 500:
+                self.errors[(route, method)] = self.errors.get((route, method), 0) + 1
+            h = self.latency.get((route, method))
+            if h is None:
+                h = self.latency[(route, method)] = Histogram()
+            h.observe(total)
+            for name, dt in stages.items():
+                h = self.stages.get((route, name))
+                if h is None:
+                    h = self.stages[(route, name)] = Histogram()
+                h.observe(dt)
+
+    def render(self, extra=()):
+        # extra: [(nombre, "gauge"|"counter", ayuda, [(labels dict, valor)])] leídos al
+        # momento de /metrics (pool, cachés, grafo)
+        out = []
+
+        def hist(name, help_, items):
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} histogram")
+            for lbl, h in items:
+                acc = 0
+                for le, c in zip(BUCKETS + ("+Inf",), h.counts):
+                    acc += c
+                    out.append(f"{name}_bucket{_labels(**lbl, le=le)} {acc}")
+                out.append(f"{name}_sum{_labels(**lbl)} {h.sum:.6f}")
+                out.append(f"{name}_count{_labels(**lbl)} {h.count}")
+
+        with self._lock:
+            out += ["# HELP api_requests_total Requests atendidos por ruta, método y status.",
+                    "# TYPE api_requests_total counter"]
+            out += [f"api_requests_total{_labels(route=r, method=m, status=s)} {n}"
+                    for (r, m, s), n in sorted(self.requests.items())]
+            out += ["# HELP api_request_errors_total Requests con status >= 500 o excepción.",
+                    "# TYPE api_request_errors_total counter"]
+            out += [f"api_request_errors_total{_labels(route=r, method=m)} {n}"
+                    for (r, m), n in sorted(self.errors.items())]
+            out += ["# HELP api_slow_requests_total Requests sobre SLOW_REQUEST_MS.",
+                    "# TYPE api_slow_requests_total counter", f"api_slow_requests_total {self.slow}",
+                    "# HELP api_requests_in_flight Requests en curso.",
+                    "# TYPE api_requests_in_flight gauge", f"api_requests_in_flight {self.inflight}",
+                    "# HELP api_start_time_seconds Inicio del proceso (epoch).",
+                    "# TYPE api_start_time_seconds gauge", f"api_start_time_seconds {self.started:.0f}"]
+            hist("api_request_duration_seconds", "Latencia total por ruta.",
+                 [({"route": r, "method": m}, h) for (r, m), h in sorted(self.latency.items())])
+            hist("api_stage_duration_seconds", "Tiempo por etapa del request (ver Server-Timing).",
+                 [({"route": r, "stage": s}, h) for (r, s), h in sorted(self.stages.items())])
+        for name, kind, help_, values in extra:
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+            for lbl, v in values:
+                if v is not None:
+                    out.append(f"{name}{_labels(**lbl) if lbl else ''} {float(v):g}")
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+class TimingMiddleware:
+    def __init__(self, app, metrics=METRICS):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        t = Timing()
+        token = _CURRENT.set(t)
+        status = [500]
+
+        async def send_timed(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+                if SERVER_TIMING:
+                    msg["headers"] = list(msg.get("headers", [])) + [
+                        (b"server-timing", t.header(time.perf_counter() - t.t0).encode())]
+            await send(msg)
+
+        self.metrics.begin()
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _CURRENT.reset(token)
+            total = time.perf_counter() - t.t0
+            # plantilla de la ruta (cardinalidad acotada); lo que no calza con ninguna, "other"
+            r = scope.get("route")
+            route = getattr(r, "path", None) or "other"
+            slow = SLOW_REQUEST_MS > 0 and total * 1000 >= SLOW_REQUEST_MS
+            self.metrics.observe(route, scope["method"], status[0], total, t.stages, slow)
+            if slow:
+                qs = scope.get("query_string", b"").decode("latin-1")
+                detail = " ".join(f"{k}={v*1000:.1f}ms" for k, v in t.stages.items())
+                print(f"[slow] {scope['method']} {scope['path']}{'?' + qs if qs else ''} "
+                      f"status={status[0]} t={total*1000:.1f}ms {detail}", flush=True)
@@ -1,25 +1,187 @@
-from fastapi import FastAPI
-from fastapi.responses import JSONResponse
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware  # <— NUEVO
-import os, time, json
-import psycopg2
+from pydantic import BaseModel
+import math, os, time, json
+import numpy as np
+from db import DBPool, PoolTimeout, graph_version
+from graph import Graph, PROFILES
+import graph_file
+from ch import CH
+from snap import SnapIndex, SNAP_CELL_M, SNAP_MARGIN_M
+from bebederos import Nearest
+from matrix import MatrixRunner, MATRIX_MAX_CELLS
+from cache import LRUCache
+import tiles
+from metrics import METRICS, TimingMiddleware, add_stage, note, stage
 
-DB_HOST = os.getenv("DB_HOST", "db")
-DB_NAME = os.getenv("DB_NAME", "gis")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASS = os.getenv("DB_PASS", "postgres")
+# "memory" = grafo CSR cargado al inicio (CH si via_ch_* está al día, si no Dijkstra
+# bidireccional); "dijkstra" fuerza lo segundo; "sql" = pgr_dijkstra (para comparar)
+ROUTE_ENGINE = os.getenv("ROUTE_ENGINE", "memory")
+ENGINES = ("memory", "ch", "dijkstra", "sql")
+# "node" = nodo via_nodo más cercano (como antes); "edge" = punto más cercano sobre
+# la arista, partiéndola virtualmente para no salir desde una esquina lejana
+SNAP_MODE = os.getenv("SNAP_MODE", "node")
+SNAP_BATCH_MAX = int(os.getenv("SNAP_BATCH_MAX", "10000"))
+WALK_SPEED_KMH = float(os.getenv("WALK_SPEED_KMH", "4.8"))
+# /isochrone: tope de cortes por llamada, presupuesto máximo (m de costo) y forma del polígono
+ISO_MAX_CUTOFFS = int(os.getenv("ISO_MAX_CUTOFFS", "6"))
+ISO_MAX_M = float(os.getenv("ISO_MAX_M", "5000"))
+ISO_HULL_RATIO = float(os.getenv("ISO_HULL_RATIO", "0.3"))
+ISO_BUFFER_M = float(os.getenv("ISO_BUFFER_M", "25"))
+# cada cuánto se consulta grafo_version para invalidar la caché y recargar el grafo
+GRAPH_VERSION_POLL_S = float(os.getenv("GRAPH_VERSION_POLL_S", "10"))
+# grafo binario mapeado en memoria (graph_file.py); vacío = cargar siempre desde la BD.
+# Si falta o es de otra grafo_version se carga desde la BD y se reescribe.
+GRAPH_FILE = os.getenv("GRAPH_FILE", "")
+GRAPH_FILE_WRITE = os.getenv("GRAPH_FILE_WRITE", "1") == "1"
+# el sha256 del archivo se verifica al exportar; 1 = también en cada arranque (lee todo el archivo)
+GRAPH_FILE_VERIFY = os.getenv("GRAPH_FILE_VERIFY", "0") == "1"
+# /tiles: caché en disco de teselas MVT (0 MB = sin caché), por capa y versión de su tabla
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", "/tmp/fase2_tiles")
+TILE_CACHE_MB = float(os.getenv("TILE_CACHE_MB", "256"))
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "20"))
 
-def db_conn(retries=30, delay=1.0):
-    last_err = None
-    for _ in range(retries):
+POOL = DBPool()
+POOL.on_wait = lambda dt: add_stage("pool", dt)   # etapa "pool" del Server-Timing
+GRAPH = None
+HIER = {}   # perfil -> CH
+SNAP = None
+MATRIX = None
+NEAREST = None  # bebedero más cercano por nodo (via_nodo_bebedero)
+GRAPH_VERSION = None
+LAYER_VERSIONS = {}  # capa -> clave de caché de teselas (tiles.layer_versions)
+CACHE = LRUCache()   # (versión, snap, origen, destino, perfil, motor) -> FeatureCollection serializada
+TILES = tiles.TileCache(TILE_CACHE_DIR, TILE_CACHE_MB)
+
+def load_graph_file(version):
+    if not GRAPH_FILE:
+        return None
+    try:
+        return graph_file.load(GRAPH_FILE, version, verify=GRAPH_FILE_VERIFY)
+    except graph_file.GraphFileError as e:
+        print(f"[graph] {GRAPH_FILE} descartado: {e}", flush=True)
+        return None
+
+def load_part(g, name, stamp, build):
+    # componente derivado del grafo (graph_file.PARTS): desde su archivo hermano de
+    # GRAPH_FILE si sigue al día con `stamp`; si no, build() (BD o cálculo en memoria)
+    # y se reescribe el archivo. -> (componente, True si vino del archivo)
+    load, save = graph_file.PARTS[name]
+    if GRAPH_FILE:
+        try:
+            return load(GRAPH_FILE, g, stamp, verify=GRAPH_FILE_VERIFY), True
+        except graph_file.GraphFileError as e:
+            print(f"[graph] {graph_file.part_path(GRAPH_FILE, name)} descartado: {e}", flush=True)
+    obj = build()
+    if GRAPH_FILE and GRAPH_FILE_WRITE:
+        try:
+            save(GRAPH_FILE, g, stamp, obj)
+        except OSError as e:
+            print(f"[graph] WARN no se pudo escribir {graph_file.part_path(GRAPH_FILE, name)}: {e}", flush=True)
+    return obj, False
+
+def load_graph():
+    global GRAPH, HIER, SNAP, MATRIX, NEAREST, GRAPH_VERSION
+    t0 = time.perf_counter()
+    with POOL.connection() as conn:
+        with conn.cursor() as cur:
+            version = graph_version(cur)
+            ch_stamp, near_stamp = CH.stamp(cur), Nearest.stamp(cur)
+        g, src = load_graph_file(version), "archivo"
+        if g is None:
+            g, src = Graph.from_db(conn), "bd"
+            g.version = version
+            if GRAPH_FILE and GRAPH_FILE_WRITE:
+                try:
+                    graph_file.save(g, GRAPH_FILE)
+                except OSError as e:
+                    print(f"[graph] WARN no se pudo escribir {GRAPH_FILE}: {e}", flush=True)
+
+
+        def build_ch():
+            h = {p: CH.load(conn, g, p) for p in PROFILES}
+            return {p: ch for p, ch in h.items() if ch is not None}
+        h, ch_file = load_part(g, "ch", ch_stamp, build_ch)
+        ix, snap_file = load_part(g, "snap", {"cell": SNAP_CELL_M}, lambda: SnapIndex(g))
+        near, near_file = load_part(g, "nearest", near_stamp, lambda: Nearest.load(conn, g, ix))
+    old = MATRIX
+    GRAPH, HIER, SNAP, MATRIX, NEAREST = g, h, ix, MatrixRunner(g), near
+    GRAPH_VERSION = version
+    CACHE.clear()
+    if old is not None:
+        old.close()
+    parts = [k for k, f in (("ch", ch_file), ("snap", snap_file), ("bebederos", near_file)) if f]
+    print(f"[graph] version={version} origen={src} nodos={g.n_nodes} aristas={g.n_edges} "
+          f"ch={','.join(h) or 'no'} bebederos={'si' if near else 'no'} "
+          f"desde_archivo={','.join(parts) or 'no'} t={time.perf_counter()-t0:.2f}s", flush=True)
+
+def refresh_layers(cur):
+    # teselas: cada capa con la versión de su tabla; se borran las de versiones viejas
+    global LAYER_VERSIONS
+    new = tiles.layer_versions(cur)
+    if new != LAYER_VERSIONS:
+        changed = [k for k in new if new[k] != LAYER_VERSIONS.get(k)]
+        if LAYER_VERSIONS:
+            print(f"[tiles] capas actualizadas: {', '.join(changed)}", flush=True)
+        TILES.clear(keep=new)
+        LAYER_VERSIONS = new
+
+def check_version(state):
+    # la caché se vacía apenas cambia la versión; el grafo se recarga cuando la
+    # versión se estabiliza (una carga en curso la incrementa muchas veces)
+    with POOL.cursor() as cur:
+        v = graph_version(cur)
+        refresh_layers(cur)
+    if v == GRAPH_VERSION:
+        state["pending"] = None
+        return
+    if v != state.get("pending"):
+        print(f"[graph] version {GRAPH_VERSION} -> {v}: caché invalidada", flush=True)
+        CACHE.clear()
+        state["pending"] = v
+        return
+    if ROUTE_ENGINE != "sql":
+        load_graph()
+    state["pending"] = None
+
+async def watch_version():
+    state = {}
+    while True:
+        await asyncio.sleep(GRAPH_VERSION_POLL_S)
+        try:
+            await run_in_threadpool(check_version, state)
+        except Exception as e:
+            print(f"[graph] WARN chequeo de versión: {e}", flush=True)
+
+@asynccontextmanager
+async def lifespan(app):
+    POOL.open()
+    # las teselas en disco llevan la versión de su capa: se conservan las que siguen
+    # vigentes y se borran las demás (ver tiles.layer_versions)
+    try:
+        with POOL.cursor() as cur:
+            refresh_layers(cur)
+    except Exception as e:
+        TILES.clear()
+        print(f"[tiles] WARN sin versiones de capa: {e}", flush=True)
+    if ROUTE_ENGINE != "sql":
         try:
-            return psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+            load_graph()
         except Exception as e:
-            last_err = e
-            time.sleep(delay)
-    raise last_err
+            # sin grafo (p.ej. via_arista aún no cargada) se usa la ruta SQL
+            print(f"[graph] WARN no se pudo cargar: {e}", flush=True)
+    watcher = asyncio.create_task(watch_version())
+    yield
+    watcher.cancel()
+    if MATRIX is not None:
+        MATRIX.close()
+    POOL.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # --- CORS ---
 app.add_middleware(
@@ -30,35 +192,397 @@ app.add_middleware(
     allow_headers=["*"],
 )
 # -------------
+# tiempos por etapa (Server-Timing), métricas para /metrics y log de requests lentos
+app.add_middleware(TimingMiddleware)
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=503)
+
+# aristas completas + tramos parciales (ST_LineSubstring) de las aristas partidas por el snap
+GEOM_SQL = """
+SELECT ST_AsGeoJSON(ST_LineMerge(ST_Union(geom))) FROM (
+  SELECT geom FROM via_arista WHERE id = ANY(%s)
+  UNION ALL
+  SELECT ST_LineSubstring(a.geom, p.f0, p.f1)
+  FROM unnest(%s::bigint[], %s::float8[], %s::float8[]) AS p(id, f0, f1)
+  JOIN via_arista a ON a.id = p.id
+  WHERE p.f1 > p.f0
+) x;
+"""
+
+def route_sql(cur, slat, slon, dlat, dlon):
+    cur.execute("""
+    WITH s AS (
+      SELECT id FROM via_nodo
+      ORDER BY geom <-> ST_SetSRID(ST_Point(%s,%s),4326) LIMIT 1
+    ), d AS (
+      SELECT id FROM via_nodo
+      ORDER BY geom <-> ST_SetSRID(ST_Point(%s,%s),4326) LIMIT 1
+    )
+    SELECT ST_AsGeoJSON(ST_LineMerge(ST_Union(geom)))
+    FROM via_arista WHERE id IN (
+      SELECT edge FROM pgr_dijkstra(
+        'SELECT id, source, target, length_m AS cost FROM via_arista',
+        (SELECT id FROM s), (SELECT id FROM d), directed := false
+      )
+    );
+    """, (slon, slat, dlon, dlat))
+    return cur.fetchone()
+
+def partial(g, hit, node):
+    # tramo de la arista partida entre el punto proyectado y el nodo por el que sale/entra la ruta
+    if node == int(g.edge_src[hit["edge"]]):
+        return hit["edge"], 0.0, hit["frac"]
+    return hit["edge"], hit["frac"], 1.0
+
+def snap_key(seeds, hit):
+    # clave de caché de un extremo: nodo, o (arista, fracción redondeada) si se partió
+    if hit is not None:
+        return (hit["edge"], round(hit["frac_m"], 3))
+    return seeds[0][0] if seeds else None
+
+def route_memory(cur, g, engine, profile, S, hs, T, ht):
+    if not S or not T:
+        return None
+    w = g.cost(profile)
+    with stage("route"):
+        cost, path, s_node, t_node = engine.route(S, T, profile)
+    pieces = []
+    if hs and ht and hs["edge"] == ht["edge"] and abs(hs["frac_m"] - ht["frac_m"]) * w[hs["edge"]] <= cost:
+        # ambos extremos sobre la misma arista: basta el tramo entre ellos
+        path = []
+        pieces.append((hs["edge"], min(hs["frac"], ht["frac"]), max(hs["frac"], ht["frac"])))
+    elif path is not None:
+        if hs:
+            pieces.append(partial(g, hs, s_node))
+        if ht:
+            pieces.append(partial(g, ht, t_node))
+    if not path and not pieces:
+        return None
+    ids = g.edge_ids[path].tolist() if path else []
+    with stage("geom"):  # ST_Union + ST_LineMerge
+        cur.execute(GEOM_SQL, (ids, [int(g.edge_ids[e]) for e, _, _ in pieces],
+                               [f0 for _, f0, _ in pieces], [f1 for _, _, f1 in pieces]))
+        return cur.fetchone()
 
 @app.get("/health")
 def health():
-    with db_conn() as conn, conn.cursor() as cur:
+    with POOL.cursor() as cur:
         cur.execute("SELECT 1")
-        return {"ok": True}
+    return {"ok": True, "graph_version": GRAPH_VERSION, "pool": POOL.stats(), "cache": CACHE.stats(),
+            "tiles": TILES.stats()}
+
+@app.get("/metrics")
+def metrics():
+    # formato de texto de Prometheus: contadores/histogramas del middleware + estado actual
+    p, c, t, g = POOL.stats(), CACHE.stats(), TILES.stats(), GRAPH
+    extra = [
+        ("db_pool_connections", "gauge", "Conexiones del pool por estado.",
+         [({"state": "in_use"}, p["in_use"]), ({"state": "idle"}, p["idle"]), ({"state": "max"}, p["max"])]),
+        ("db_pool_acquired_total", "counter", "Conexiones entregadas.", [({}, p["acquired"])]),
+        ("db_pool_timeouts_total", "counter", "Esperas de conexión vencidas (503).", [({}, p["timeouts"])]),
+        ("db_pool_wait_seconds_total", "counter", "Tiempo esperando conexión.", [({}, p["wait_s"])]),
+        ("route_cache_entries", "gauge", "Respuestas de /route en caché.", [({}, c["size"])]),
+        ("route_cache_events_total", "counter", "Aciertos, fallos y desalojos de la caché de /route.",
+         [({"event": k}, c[k]) for k in ("hits", "misses", "evictions", "expired", "clears")]),
+        ("tile_cache_events_total", "counter", "Aciertos, fallos y desalojos de la caché de teselas.",
+         [({"event": k}, t[k]) for k in ("hits", "misses", "evicted")]),
+        ("graph_version", "gauge", "grafo_version cargada.", [({}, GRAPH_VERSION)]),
+        ("graph_size", "gauge", "Nodos y aristas del grafo en memoria.",
+         [({"kind": "nodes"}, g.n_nodes if g is not None else None),
+          ({"kind": "edges"}, g.n_edges if g is not None else None)]),
+    ]
+    return PlainTextResponse(METRICS.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def check_point(ix, lat, lon):
+    # 400 si el punto no es finito o cae lejos de la red (p.ej. lat/lon invertidas):
+    # el snap de esos puntos sólo devolvería una esquina del borde, a kilómetros
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        raise HTTPException(400, "coordenadas no finitas")
+    if ix is not None and not ix.covers(lon, lat):
+        raise HTTPException(400, f"punto ({lat},{lon}) a más de {SNAP_MARGIN_M:g} m del área de la red")
+
+def parse_point(s, ix):
+    # "lat,lon" -> (lat, lon) validado con check_point
+    try:
+        lat, lon = map(float, s.split(","))
+    except ValueError:
+        raise HTTPException(400, f"punto inválido {s!r}: se espera 'lat,lon'")
+    check_point(ix, lat, lon)
+    return lat, lon
+
+def resolve_profile(profile, w_sol, w_temp, w_uv):
+    # nombre de perfil, o tupla de pesos si "balanced" llega con pesos propios
+    if profile not in PROFILES:
+        raise HTTPException(400, f"profile debe ser uno de {list(PROFILES)}")
+    custom = (w_sol, w_temp, w_uv)
+    if profile != "balanced" or all(w is None for w in custom):
+        return profile
+    weights = tuple(d if w is None else w for w, d in zip(custom, PROFILES["balanced"]))
+    if any(w < 0 for w in weights):
+        raise HTTPException(400, "los pesos deben ser >= 0")
+    return weights
 
 @app.get("/route")
-def route(src: str, dst: str):
-    slat, slon = map(float, src.split(","))
-    dlat, dlon = map(float, dst.split(","))
-    with db_conn() as conn, conn.cursor() as cur:
-        cur.execute("""
-        WITH s AS (
-          SELECT id FROM via_nodo
-          ORDER BY geom <-> ST_SetSRID(ST_Point(%s,%s),4326) LIMIT 1
-        ), d AS (
-          SELECT id FROM via_nodo
-          ORDER BY geom <-> ST_SetSRID(ST_Point(%s,%s),4326) LIMIT 1
-        )
-        SELECT ST_AsGeoJSON(ST_LineMerge(ST_Union(geom)))
-        FROM via_arista WHERE id IN (
-          SELECT edge FROM pgr_dijkstra(
-            'SELECT id, source, target, length_m AS cost FROM via_arista',
-            (SELECT id FROM s), (SELECT id FROM d), directed := false
-          )
-        );
-        """, (slon, slat, dlon, dlat))
-        row = cur.fetchone()
-    geom = json.loads(row[0]) if row and row[0] else None
-    fc = {"type":"FeatureCollection","features":[{"type":"Feature","geometry":geom,"properties":{"algo":"pgr_dijkstra"}}]}
-    return JSONResponse(fc)
+def route(src: str, dst: str, engine: str = None, profile: str = "shortest",
+          w_sol: float = None, w_temp: float = None, w_uv: float = None, snap: str = None):
+    slat, slon = parse_point(src, SNAP)
+    dlat, dlon = parse_point(dst, SNAP)
+    prof = resolve_profile(profile, w_sol, w_temp, w_uv)
+    engine = engine or ROUTE_ENGINE
+    if engine not in ENGINES:
+        raise HTTPException(400, f"engine debe ser uno de {list(ENGINES)}")
+    snap = snap or SNAP_MODE
+    if snap not in ("node", "edge"):
+        raise HTTPException(400, "snap debe ser 'node' o 'edge'")
+    g, ix = GRAPH, SNAP
+    h = HIER.get(prof) if isinstance(prof, str) else None
+    if engine == "memory":
+        engine = "ch" if h is not None else "dijkstra"
+    if engine in ("ch", "dijkstra") and g is None:
+        engine = "sql"
+    if engine == "ch" and h is None:
+        engine = "dijkstra"
+    if engine == "sql" and (prof != "shortest" or snap != "node"):
+        raise HTTPException(400, "engine=sql sólo admite profile=shortest y snap=node")
+    key = None
+    if engine != "sql":
+        w = g.cost(prof)
+        with stage("snap"):
+            S, hs = ix.seeds(slon, slat, w, snap)
+            T, ht = ix.seeds(dlon, dlat, w, snap)
+        # la versión va en la clave: una respuesta calculada con el grafo anterior
+        # que llegue después del clear() nunca se vuelve a servir
+        key = (g.version, snap, snap_key(S, hs), snap_key(T, ht), prof, engine)
+        body = CACHE.get(key)
+        note("cache", "hit" if body is not None else "miss")
+        if body is not None:
+            return Response(body, media_type="application/json")
+    with POOL.cursor() as cur:
+        if engine == "ch":
+            row = route_memory(cur, g, h, prof, S, hs, T, ht)
+        elif engine == "dijkstra":
+            row = route_memory(cur, g, g, prof, S, hs, T, ht)
+        else:
+            with stage("sql"):  # KNN de ambos extremos + pgr_dijkstra + ST_Union en una consulta
+                row = route_sql(cur, slat, slon, dlat, dlon)
+    with stage("serialize"):
+        geom = json.loads(row[0]) if row and row[0] else None
+        # "algo" se mantiene como antes para los clientes; el motor que respondió
+        # (ch / dijkstra / sql, como el parámetro engine) va en "engine"
+        props = {"algo": "pgr_dijkstra", "engine": engine, "profile": profile}
+        fc = {"type":"FeatureCollection","features":[{"type":"Feature","geometry":geom,"properties":props}]}
+        resp = JSONResponse(fc)
+    if key is not None:
+        CACHE.put(key, resp.body)
+    return resp
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.mvt")
+def tile(layer: str, z: int, x: int, y: int):
+    if layer not in tiles.LAYERS:
+        raise HTTPException(404, f"capa desconocida; disponibles: {', '.join(tiles.LAYERS)}")
+    if not (0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(400, f"tesela fuera de rango (zoom máximo {TILE_MAX_ZOOM})")
+    # sin versión (tabla aún no cargada) no se guarda en caché
+    version = LAYER_VERSIONS.get(layer)
+    data = TILES.get(version, layer, z, x, y) if version is not None else None
+    hit = data is not None
+    note("cache", "hit" if hit else "miss")
+    if not hit:
+        with POOL.cursor() as cur, stage("render"):
+            data = tiles.render(cur, layer, z, x, y)
+        if version is not None:
+            TILES.put(version, layer, z, x, y, data)
+    return Response(data, media_type="application/vnd.mapbox-vector-tile",
+                    headers={"X-Tile-Cache": "hit" if hit else "miss", "Cache-Control": "public, max-age=60"})
+
+class SnapRequest(BaseModel):
+    points: list[tuple[float, float]]   # [[lat, lon], ...]
+    mode: str = "node"
+
+@app.post("/snap")
+def snap_batch(req: SnapRequest):
+    g, ix = GRAPH, SNAP
+    if ix is None:
+        raise HTTPException(503, "grafo no cargado")
+    if req.mode not in ("node", "edge"):
+        raise HTTPException(400, "mode debe ser 'node' o 'edge'")
+    if len(req.points) > SNAP_BATCH_MAX:
+        raise HTTPException(413, f"máximo {SNAP_BATCH_MAX} puntos por llamada")
+    for lat, lon in req.points:
+        check_point(ix, lat, lon)
+    if req.mode == "node":
+        out = {"mode": "node", "node_id": [], "dist_m": []}
+        for lat, lon in req.points:
+            n, d = ix.nearest_node(lon, lat)
+            out["node_id"].append(int(g.node_ids[n]) if n is not None else None)
+            out["dist_m"].append(round(d, 2) if n is not None else None)
+        return out
+    out = {"mode": "edge", "edge_id": [], "frac": [], "dist_m": [], "lat": [], "lon": []}
+    for lat, lon in req.points:
+        hit = ix.nearest_edge(lon, lat)
+        out["edge_id"].append(int(g.edge_ids[hit["edge"]]) if hit else None)
+        out["frac"].append(round(hit["frac"], 6) if hit else None)
+        out["dist_m"].append(round(hit["dist_m"], 2) if hit else None)
+        out["lat"].append(hit["lat"] if hit else None)
+        out["lon"].append(hit["lon"] if hit else None)
+    return out
+
+class MatrixRequest(BaseModel):
+    sources: list[tuple[float, float]]   # [[lat, lon], ...]
+    targets: list[tuple[float, float]]
+    profile: str = "shortest"
+    snap: str = "node"
+    durations: bool = False
+    speed_kmh: float = WALK_SPEED_KMH
+    format: str = "json"                 # "json" | "f32"
+
+@app.post("/matrix")
+def matrix(req: MatrixRequest):
+    g, ix, runner = GRAPH, SNAP, MATRIX
+    if runner is None:
+        raise HTTPException(503, "grafo no cargado")
+    if req.snap not in ("node", "edge") or req.format not in ("json", "f32"):
+        raise HTTPException(400, "snap debe ser 'node'/'edge' y format 'json'/'f32'")
+    if req.profile not in PROFILES:
+        raise HTTPException(400, f"profile debe ser uno de {list(PROFILES)}")
+    if req.speed_kmh <= 0:
+        raise HTTPException(400, "speed_kmh debe ser > 0")
+    n, m = len(req.sources), len(req.targets)
+    if n * m > MATRIX_MAX_CELLS:
+        raise HTTPException(413, f"matriz {n}x{m} supera MATRIX_MAX_CELLS={MATRIX_MAX_CELLS}")
+    for lat, lon in req.sources + req.targets:
+        check_point(ix, lat, lon)
+    w = g.cost(req.profile)
+    with stage("snap"):
+        src = [ix.seeds(lon, lat, w, req.snap)[0] for lat, lon in req.sources]
+        tgt = [ix.seeds(lon, lat, w, req.snap)[0] for lat, lon in req.targets]
+    with stage("matrix"):
+        lens, _ = runner.run(src, tgt, req.profile)
+    dur = lens / np.float32(req.speed_kmh / 3.6) if req.durations else None
+    if req.format == "f32":
+        # float32 little-endian, fila por origen; NaN = sin ruta. Duraciones a continuación.
+        body = lens.astype("<f4").tobytes() + (dur.astype("<f4").tobytes() if dur is not None else b"")
+        return Response(body, media_type="application/octet-stream",
+                        headers={"X-Matrix-Shape": f"{n},{m}",
+                                 "X-Matrix-Arrays": "distances,durations" if dur is not None else "distances"})
+    # a float64 antes de redondear: 123.4 en float32 se serializa como 123.4000015258789
+    lens = lens.astype(np.float64)
+    out = {"shape": [n, m], "profile": req.profile,
+           "distances": np.where(np.isnan(lens), None, np.round(lens, 1)).tolist()}
+    if dur is not None:
+        dur = dur.astype(np.float64)
+        out["durations"] = np.where(np.isnan(dur), None, np.round(dur, 1)).tolist()
+    return out
+
+# un polígono (y opcionalmente las aristas) por corte; fracciones de ST_LineSubstring
+ISO_SQL = """
+WITH p AS (
+  SELECT p.k, CASE WHEN p.f0 <= 0 AND p.f1 >= 1 THEN a.geom
+                   ELSE ST_LineSubstring(a.geom, p.f0, p.f1) END AS geom
+  FROM unnest(%s::int[], %s::bigint[], %s::float8[], %s::float8[]) AS p(k, id, f0, f1)
+  JOIN via_arista a ON a.id = p.id
+  WHERE p.f1 > p.f0
+), c AS (
+  SELECT k, ST_Collect(geom) AS geom FROM p GROUP BY k
+)
+SELECT k,
+       ST_AsGeoJSON(CASE WHEN %s = 'buffer' THEN ST_Buffer(geom::geography, %s)::geometry
+                         ELSE ST_ConcaveHull(geom, %s) END, 6),
+       CASE WHEN %s THEN ST_AsGeoJSON(ST_LineMerge(ST_Union(geom)), 6) END
+FROM c ORDER BY k;
+"""
+
+@app.get("/isochrone")
+def isochrone(src: str, minutes: str = None, meters: str = None, speed_kmh: float = WALK_SPEED_KMH,
+              profile: str = "shortest", w_sol: float = None, w_temp: float = None, w_uv: float = None,
+              snap: str = None, shape: str = "hull", edges: bool = False):
+    # Un solo Dijkstra acotado por el corte mayor; cada corte se arma del mismo resultado.
+    # Los cortes son presupuestos de costo del perfil (metros equivalentes): con
+    # profile=shortest son metros caminados; con un perfil de exposición el área se
+    # achica donde hay sol/calor/UV.
+    g, ix = GRAPH, SNAP
+    if ix is None:
+        raise HTTPException(503, "grafo no cargado")
+    lat, lon = parse_point(src, ix)
+    prof = resolve_profile(profile, w_sol, w_temp, w_uv)
+    snap = snap or SNAP_MODE
+    if snap not in ("node", "edge") or shape not in ("hull", "buffer"):
+        raise HTTPException(400, "snap debe ser 'node'/'edge' y shape 'hull'/'buffer'")
+    if (minutes is None) == (meters is None):
+        raise HTTPException(400, "indicar minutes o meters (lista separada por comas)")
+    if not (math.isfinite(speed_kmh) and speed_kmh > 0):
+        raise HTTPException(400, "speed_kmh debe ser > 0")
+    try:
+        vals = [float(x) for x in (minutes or meters).split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(400, f"cortes inválidos {minutes or meters!r}: se esperan números separados por comas")
+    cuts = sorted({v * speed_kmh * 1000 / 60 if minutes else v for v in vals})
+    # NaN pasaría las comparaciones de abajo
+    if not all(map(math.isfinite, cuts)) or not cuts or len(cuts) > ISO_MAX_CUTOFFS or cuts[0] <= 0 or cuts[-1] > ISO_MAX_M:
+        raise HTTPException(400, f"entre 1 y {ISO_MAX_CUTOFFS} cortes > 0, hasta {ISO_MAX_M:g} m")
+    w = g.cost(prof)
+    with stage("snap"):
+        S, hit = ix.seeds(lon, lat, w, snap)
+    if not S:
+        raise HTTPException(404, "sin red cercana")
+    with stage("search"):
+        done, _, _ = g.one_to_many(S, None, prof, limit=cuts[-1])
+    ks, ids, f0s, f1s = [], [], [], []
+    for k, cut in enumerate(cuts):
+        pieces = g.coverage(done, cut, prof)
+        if hit is not None and w[hit["edge"]] > 0:
+            # la arista partida se recorre desde el punto proyectado hacia ambos lados
+            f, r = hit["frac_m"], cut / w[hit["edge"]]
+            pieces.append((hit["edge"], max(0.0, f - r), min(1.0, f + r)))
+        for e, f0, f1 in pieces:
+            ks.append(k)
+            ids.append(int(g.edge_ids[e]))
+            f0s.append(f0)
+            f1s.append(f1)
+    with POOL.cursor() as cur, stage("geom"):
+        cur.execute(ISO_SQL, (ks, ids, f0s, f1s, shape, ISO_BUFFER_M, ISO_HULL_RATIO, edges))
+        rows = cur.fetchall()
+    feats = []
+    # el corte mayor primero, para que los menores queden encima al dibujar
+    for k, poly, lines in reversed(rows):
+        props = {"cutoff_m": round(cuts[k], 1), "minutes": round(cuts[k] * 60 / (speed_kmh * 1000), 2),
+                 "profile": profile, "shape": shape}
+        feats.append({"type": "Feature", "geometry": json.loads(poly) if poly else None,
+                      "properties": {**props, "kind": "area"}})
+        if edges:
+            feats.append({"type": "Feature", "geometry": json.loads(lines) if lines else None,
+                          "properties": {**props, "kind": "edges"}})
+    return {"type": "FeatureCollection", "features": feats,
+            "properties": {"nodes_settled": len(done)}}
+
+@app.get("/nearest-bebedero")
+def nearest_bebedero(src: str, speed_kmh: float = WALK_SPEED_KMH):
+    # consulta precalculada (python bebederos.py build): snap al nodo + lectura O(1)
+    # y camino siguiendo las aristas predecesoras hasta el bebedero
+    g, ix, near = GRAPH, SNAP, NEAREST
+    if near is None:
+        raise HTTPException(503, "via_nodo_bebedero ausente o desactualizada")
+    if speed_kmh <= 0:
+        raise HTTPException(400, "speed_kmh debe ser > 0")
+    lat, lon = parse_point(src, ix)
+    with stage("snap"):
+        n, snap_d = ix.nearest_node(lon, lat)
+        hit = near.lookup(n) if n is not None else None
+    if hit is None:
+        raise HTTPException(404, "ningún bebedero alcanzable desde el punto")
+    f, dist, path = hit
+    geom = None
+    if path:
+        with POOL.cursor() as cur, stage("geom"):
+            cur.execute(GEOM_SQL, (g.edge_ids[path].tolist(), [], [], []))
+            row = cur.fetchone()
+        geom = json.loads(row[0]) if row and row[0] else None
+    props = {"bebedero_id": int(near.fountain_ids[f]), "dist_m": round(dist, 1),
+             "minutes": round(dist * 60 / (speed_kmh * 1000), 1), "snap_dist_m": round(snap_d, 1)}
+    point = {"type": "Point", "coordinates": [float(near.fountain_lon[f]), float(near.fountain_lat[f])]}
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "geometry": geom, "properties": {**props, "kind": "path"}},
+        {"type": "Feature", "geometry": point, "properties": {**props, "kind": "bebedero"}},
+    ]}
@@ -0,0 +1,247 @@
+import math, os
+import numpy as np
+
+# Índice espacial en memoria para el snap de extremos de ruta.
+# Grilla uniforme sobre coordenadas locales en metros (equirectangular centrada
+# en la red); cada celda guarda los nodos / segmentos de arista que la tocan.
+# La búsqueda recorre anillos de celdas alrededor del punto hasta que ninguna
+# celda no visitada puede contener algo más cercano. Un punto fuera de la grilla
+# empieza en el primer anillo que la toca y cada anillo se recorta a la grilla, así
+# que el costo no crece con la distancia; la API rechaza igual los puntos a más de
+# SNAP_MARGIN_M del bbox de la red (coordenadas erradas, lat/lon invertidas).
+
+SNAP_CELL_M = float(os.getenv("SNAP_CELL_M", "100"))
+SNAP_MARGIN_M = float(os.getenv("SNAP_MARGIN_M", "2000"))
+M_PER_DEG_LAT = 110540.0
+M_PER_DEG_LON = 111320.0  # en el ecuador; se escala por cos(lat)
+# arreglos que guarda graph_file.py (archivo hermano del grafo): los de cada grilla
+# y los de los segmentos de arista
+GRID_ARRAYS = ("keys", "starts", "items", "bounds")
+SEG_ARRAYS = ("sx0", "sy0", "sx1", "sy1", "seg_edge", "seg_len_m", "seg_len_d",
+              "seg_cum_m", "seg_cum_d", "edge_len_m", "edge_len_d")
+
+
+class _Grid:
+    def __init__(self, ix0, iy0, ix1, iy1, items):
+        # ix0..iy1: rango de celdas (inclusive) por ítem; items: id del ítem
+        spans_x = ix1 - ix0 + 1
+        spans_y = iy1 - iy0 + 1
+        reps = spans_x * spans_y
+        item = np.repeat(items, reps)
+        # expandir cada ítem a todas las celdas de su bbox
+        k = np.arange(reps.sum()) - np.repeat(np.cumsum(reps) - reps, reps)
+        sx = np.repeat(spans_x, reps)
+        cx = np.repeat(ix0, reps) + k % sx
+        cy = np.repeat(iy0, reps) + k // sx
+        key = (cx.astype(np.int64) << 32) + (cy.astype(np.int64) & 0xffffffff)
+        order = np.argsort(key, kind="stable")
+        key, items = key[order], item[order]
+        keys, starts = np.unique(key, return_index=True)
+        self._set(keys, np.append(starts, len(key)), items,
+                  np.array([cx.min(), cx.max(), cy.min(), cy.max()], dtype=np.int64))
+
+    def _set(self, keys, starts, items, bounds):
+        self.keys, self.starts, self.items, self.bounds = keys, starts, items, bounds
+        self.cells = dict(zip(keys.tolist(), range(len(keys))))
+        self.ix_min, self.ix_max, self.iy_min, self.iy_max = (int(b) for b in bounds)
+
+    @classmethod
+    def from_arrays(cls, a, prefix):
+        grid = cls.__new__(cls)
+        grid._set(*(a[f"{prefix}.{k}"] for k in GRID_ARRAYS))
+        return grid
+
+    def to_arrays(self, prefix):
+        return {f"{prefix}.{k}": getattr(self, k) for k in GRID_ARRAYS}
+
+    def ring(self, cx, cy, r):
+        # ítems de las celdas a distancia de Chebyshev exactamente r de (cx, cy),
+        # sólo las que caen dentro del rango de la grilla
+        if r == 0:
+            cells = [(cx, cy)]
+        else:
+            xs = range(max(cx - r, self.ix_min), min(cx + r, self.ix_max) + 1)
+            ys = range(max(cy - r + 1, self.iy_min), min(cy + r - 1, self.iy_max) + 1)
+            cells = []
+            for y in (cy - r, cy + r):
+                if self.iy_min <= y <= self.iy_max:
+                    cells += [(x, y) for x in xs]
+            for x in (cx - r, cx + r):
+                if self.ix_min <= x <= self.ix_max:
+                    cells += [(x, y) for y in ys]
+        out = []
+        for x, y in cells:
+            i = self.cells.get((x << 32) + (y & 0xffffffff))
+            if i is not None:
+                out.append(self.items[self.starts[i]:self.starts[i + 1]])
+        return np.concatenate(out) if out else None
+
+    def min_ring(self, cx, cy):
+        # primer anillo que toca la grilla (0 si la celda está dentro)
+        return max(self.ix_min - cx, cx - self.ix_max, self.iy_min - cy, cy - self.iy_max, 0)
+
+    def max_ring(self, cx, cy):
+        return max(abs(cx - self.ix_min), abs(cx - self.ix_max),
+                   abs(cy - self.iy_min), abs(cy - self.iy_max))
+
+
+class SnapIndex:
+    def __init__(self, g, cell_m=SNAP_CELL_M):
+        self.g = g
+        self.cell = float(cell_m)
+        ok = np.isfinite(g.lon) & np.isfinite(g.lat)
+        self.lon0 = float(np.mean(g.lon[ok])) if ok.any() else 0.0
+        self.lat0 = float(np.mean(g.lat[ok])) if ok.any() else 0.0
+        self.kx = M_PER_DEG_LON * math.cos(math.radians(self.lat0))
+        self.ky = M_PER_DEG_LAT
+        self.nx, self.ny = self.to_m(g.lon, g.lat)
+        nodes = np.flatnonzero(ok)
+        # bbox de la red en metros locales, para covers()
+        self.bbox_m = ((float(self.nx[nodes].min()), float(self.ny[nodes].min()),
+                        float(self.nx[nodes].max()), float(self.ny[nodes].max())) if len(nodes) else None)
+        ix = np.floor(self.nx[nodes] / self.cell).astype(np.int64)
+        iy = np.floor(self.ny[nodes] / self.cell).astype(np.int64)
+        self.nodes = _Grid(ix, iy, ix, iy, nodes) if len(nodes) else None
+        self.segs = self._index_segments() if g.geom_offsets is not None else None
+
+    def covers(self, lon, lat, margin_m=SNAP_MARGIN_M):
+        # punto finito dentro del bbox de la red más margin_m
+        if self.bbox_m is None or not (math.isfinite(lon) and math.isfinite(lat)):
+            return False
+        px, py = self.to_m(lon, lat)
+        x0, y0, x1, y1 = self.bbox_m
+        return x0 - margin_m <= px <= x1 + margin_m and y0 - margin_m <= py <= y1 + margin_m
+
+    def to_arrays(self):
+        # -> (arreglos, escalares) para graph_file.save_part
+        a = {"nx": self.nx, "ny": self.ny}
+        if self.nodes is not None:
+            a.update(self.nodes.to_arrays("nodes"))
+        if self.segs is not None:
+            a.update(self.segs.to_arrays("segs"))
+            a.update({k: getattr(self, k) for k in SEG_ARRAYS})
+        return a, {"cell": self.cell, "lon0": self.lon0, "lat0": self.lat0,
+                   "kx": self.kx, "ky": self.ky, "bbox_m": self.bbox_m}
+
+    @classmethod
+    def from_arrays(cls, g, a, meta):
+        # índice ya armado (graph_file.load_part): sólo se rehace el dict de celdas
+        ix = cls.__new__(cls)
+        ix.g = g
+        ix.cell, ix.lon0, ix.lat0, ix.kx, ix.ky = (meta[k] for k in ("cell", "lon0", "lat0", "kx", "ky"))
+        ix.bbox_m = tuple(meta["bbox_m"]) if meta["bbox_m"] is not None else None
+        ix.nx, ix.ny = a["nx"], a["ny"]
+        ix.nodes = _Grid.from_arrays(a, "nodes") if "nodes.keys" in a else None
+        ix.segs = _Grid.from_arrays(a, "segs") if "segs.keys" in a else None
+        if ix.segs is not None:
+            for k in SEG_ARRAYS:
+                setattr(ix, k, a[k])
+        return ix
+
+    def to_m(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    def _index_segments(self):
+        g = self.g
+        off = g.geom_offsets
+        x, y = self.to_m(g.geom_xy[:, 0], g.geom_xy[:, 1])
+        # segmento i = vértices (i, i+1) siempre que ambos sean de la misma arista
+        last = np.zeros(len(x), dtype=bool)
+        last[off[1:][off[1:] > off[:-1]] - 1] = True
+        seg = np.flatnonzero(~last[:-1]) if len(x) > 1 else np.zeros(0, dtype=np.int64)
+        self.sx0, self.sy0 = x[seg], y[seg]
+        self.sx1, self.sy1 = x[seg + 1], y[seg + 1]
+        self.seg_edge = (np.searchsorted(off, seg, side="right") - 1).astype(np.int32)
+        # largo acumulado (m y grados planos) al inicio de cada segmento dentro de su arista
+        lm = np.hypot(self.sx1 - self.sx0, self.sy1 - self.sy0)
+        ld = np.hypot(g.geom_xy[seg + 1, 0] - g.geom_xy[seg, 0], g.geom_xy[seg + 1, 1] - g.geom_xy[seg, 1])
+        self.seg_len_m, self.seg_len_d = lm, ld
+        self.seg_cum_m = self._cum_by_edge(lm)
+        self.seg_cum_d = self._cum_by_edge(ld)
+        self.edge_len_m = np.bincount(self.seg_edge, weights=lm, minlength=g.n_edges)
+        self.edge_len_d = np.bincount(self.seg_edge, weights=ld, minlength=g.n_edges)
+        c = self.cell
+        ix0 = np.floor(np.minimum(self.sx0, self.sx1) / c).astype(np.int64)
+        ix1 = np.floor(np.maximum(self.sx0, self.sx1) / c).astype(np.int64)
+        iy0 = np.floor(np.minimum(self.sy0, self.sy1) / c).astype(np.int64)
+        iy1 = np.floor(np.maximum(self.sy0, self.sy1) / c).astype(np.int64)
+        return _Grid(ix0, iy0, ix1, iy1, np.arange(len(seg))) if len(seg) else None
+
+    def _cum_by_edge(self, seglen):
+        cum = np.cumsum(seglen) - seglen
+        first = np.r_[True, self.seg_edge[1:] != self.seg_edge[:-1]]
+        base = np.maximum.accumulate(np.where(first, cum, 0.0))
+        return cum - base
+
+    def _search(self, grid, px, py, dist_fn):
+        cx, cy = int(math.floor(px / self.cell)), int(math.floor(py / self.cell))
+        best_d, best = math.inf, None
+        rmax = grid.max_ring(cx, cy)
+        r = grid.min_ring(cx, cy)   # los anillos anteriores no tocan la grilla
+        while r <= rmax:
+            cand = grid.ring(cx, cy, r)
+            if cand is not None:
+                d, extra = dist_fn(cand, px, py)
+                j = int(np.argmin(d))
+                if d[j] < best_d:
+                    best_d, best = float(d[j]), (int(cand[j]), extra, j)
+            # lo no visitado está al menos a r celdas completas del punto
+            if best_d <= r * self.cell:
+                break
+            r += 1
+        return best_d, best
+
+    def _node_dist(self, cand, px, py):
+        return np.hypot(self.nx[cand] - px, self.ny[cand] - py), None
+
+    def _seg_dist(self, cand, px, py):
+        x0, y0, x1, y1 = self.sx0[cand], self.sy0[cand], self.sx1[cand], self.sy1[cand]
+        dx, dy = x1 - x0, y1 - y0
+        l2 = dx * dx + dy * dy
+        t = np.clip(((px - x0) * dx + (py - y0) * dy) / np.where(l2 > 0, l2, 1.0), 0.0, 1.0)
+        return np.hypot(x0 + t * dx - px, y0 + t * dy - py), t
+
+    def nearest_node(self, lon, lat):
+        # -> (índice denso del nodo, distancia en m) o (None, inf)
+        if self.nodes is None:
+            return None, math.inf
+        px, py = self.to_m(lon, lat)
+        d, best = self._search(self.nodes, float(px), float(py), self._node_dist)
+        return (best[0], d) if best else (None, math.inf)
+
+    def nearest_edge(self, lon, lat):
+        # -> dict con la arista más cercana y la posición del punto proyectado, o None.
+        # frac_m: fracción a lo largo de la arista en metros (para el costo);
+        # frac: fracción en grados planos (la que usa ST_LineSubstring).
+        if self.segs is None:
+            return None
+        px, py = self.to_m(lon, lat)
+        d, best = self._search(self.segs, float(px), float(py), self._seg_dist)
+        if not best:
+            return None
+        s, t_all, j = best
+        t = float(t_all[j])
+        e = int(self.seg_edge[s])
+        lm, ld = self.edge_len_m[e], self.edge_len_d[e]
+        frac_m = min(1.0, (self.seg_cum_m[s] + t * self.seg_len_m[s]) / lm) if lm > 0 else 0.0
+        frac = min(1.0, (self.seg_cum_d[s] + t * self.seg_len_d[s]) / ld) if ld > 0 else 0.0
+        x = self.sx0[s] + t * (self.sx1[s] - self.sx0[s])
+        y = self.sy0[s] + t * (self.sy1[s] - self.sy0[s])
+        return {"edge": e, "frac_m": float(frac_m), "frac": float(frac), "dist_m": d,
+                "lon": float(x / self.kx + self.lon0), "lat": float(y / self.ky + self.lat0)}
+
+    def seeds(self, lon, lat, w, mode="node"):
+        # semillas (nodo, costo inicial, largo inicial en m, arista partida o -1) para
+        # un punto, y el snap sobre arista si mode == "edge"; w = costos del perfil
+        g = self.g
+        if mode == "edge":
+            hit = self.nearest_edge(lon, lat)
+            if hit is not None:
+                e, f = hit["edge"], hit["frac_m"]
+                c, l = float(w[e]), float(g.length[e])
+                return [(int(g.edge_src[e]), f * c, f * l, e),
+                        (int(g.edge_dst[e]), (1.0 - f) * c, (1.0 - f) * l, e)], hit
+        n, _ = self.nearest_node(lon, lat)
+        return ([(n, 0.0, 0.0, -1)] if n is not None else []), None
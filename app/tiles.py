@@ -0,0 +1,164 @@
+import os, shutil, threading
+from pathlib import Path
+
+# Teselas vectoriales (Mapbox Vector Tiles) de las capas del mapa, armadas en
+# PostGIS con ST_AsMVT: el filtro geom && envolvente usa los índices GiST y las
+# líneas/polígonos se simplifican a ~1 píxel del zoom pedido antes de proyectar.
+# Caché en disco por capa y versión de su tabla (root/capa/v<clave>/z/x/y.mvt),
+# acotada en tamaño. La clave es "<oid>.<capa_version>": cambia con cualquier
+# escritura en la tabla (triggers de capa_version) o si se recrea (ogr2ogr
+# -overwrite), así que las teselas vigentes sobreviven a reinicios de la API.
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_SIMPLIFY_PX = float(os.getenv("TILE_SIMPLIFY_PX", "1.0"))
+
+# capa -> (tabla, columnas de atributos, simplificar, zoom mínimo)
+LAYERS = {
+    "vias":       ("via_arista", "t.id, t.highway, t.oneway, t.length_m", True, 12),
+    "sombreadas": ("via_sombreada", "", True, 13),
+    "sombras":    ("sombra_poligono", "", True, 14),
+    "bebederos":  ("bebedero", "t.id", False, 12),
+    "temp":       ("amenaza_calor_grid", "t.temp_c", False, 10),
+    "uv":         ("amenaza_uv_grid", "t.uv_index", False, 10),
+}
+
+TILE_SQL = """
+WITH b AS (
+  SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS env,
+         ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326) AS env4326
+)
+SELECT ST_AsMVT(q, %(layer)s, {extent}, 'geom') FROM (
+  SELECT {cols}ST_AsMVTGeom(ST_Transform({geom}, 3857), b.env, {extent}, {buffer}, true) AS geom
+  FROM {table} t, b
+  WHERE t.geom && b.env4326
+) q
+WHERE q.geom IS NOT NULL
+"""
+
+
+# -> (tabla, oid, versión) de cada tabla de capa; oid NULL si la tabla no existe
+LAYER_VERSION_SQL = """
+SELECT t.tabla, c.oid::bigint, {version}
+FROM unnest(%s::text[]) AS t(tabla)
+LEFT JOIN pg_class c ON c.oid = to_regclass(t.tabla)
+{join}
+"""
+
+
+def layer_versions(cur):
+    # -> {capa: clave de caché o None si su tabla no existe}
+    tables = sorted({v[0] for v in LAYERS.values()})
+    cur.execute("SELECT to_regclass('capa_version') IS NOT NULL")
+    has_version = cur.fetchone()[0]
+    cur.execute(LAYER_VERSION_SQL.format(
+        version="coalesce(v.version, 0)" if has_version else "0",
+        join="LEFT JOIN capa_version v ON v.tabla = t.tabla" if has_version else ""), (tables,))
+    keys = {t: f"{oid}.{ver}" if oid is not None else None for t, oid, ver in cur.fetchall()}
+    return {layer: keys.get(v[0]) for layer, v in LAYERS.items()}
+
+
+def tile_sql(layer):
+    table, cols, simplify, _ = LAYERS[layer]
+    geom = "ST_Simplify(t.geom, %(tol)s, true)" if simplify else "t.geom"
+    return TILE_SQL.format(cols=f"{cols}, " if cols else "", geom=geom, table=table,
+                           extent=TILE_EXTENT, buffer=TILE_BUFFER)
+
+
+def render(cur, layer, z, x, y):
+    # -> bytes MVT (vacío si la tabla no existe o el zoom es menor al mínimo de la capa)
+    table, _, _, min_zoom = LAYERS[layer]
+    if z < min_zoom:
+        return b""
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    if not cur.fetchone()[0]:
+        return b""
+    cur.execute(tile_sql(layer), {"z": z, "x": x, "y": y, "layer": layer,
+                                  "margin": TILE_BUFFER / TILE_EXTENT,
+                                  "tol": TILE_SIMPLIFY_PX * 360.0 / (TILE_EXTENT * 2 ** z)})
+    row = cur.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b""
+
+
+class TileCache:
+    def __init__(self, root, max_mb=256):
+        self.root = Path(root)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = self.misses = self.evicted = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, version, layer, z, x, y):
+        return self.root / layer / f"v{version}" / str(z) / str(x) / f"{y}.mvt"
+
+    def get(self, version, layer, z, x, y):
+        p = self._path(version, layer, z, x, y)
+        try:
+            data = p.read_bytes()
+            os.utime(p)  # marca de uso para el desalojo
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, version, layer, z, x, y, data):
+        if self.max_bytes <= 0:
+            return
+        p = self._path(version, layer, z, x, y)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, p)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan_size(self):
+        return sum(f.stat().st_size for f in self.root.rglob("*.mvt"))
+
+    def evict(self):
+        # las menos usadas (mtime) primero, hasta quedar bajo el 90% del tope
+        files = []
+        for f in self.root.rglob("*.mvt"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        total = sum(s for _, s, _ in files)
+        for _, s, f in files:
+            if total <= 0.9 * self.max_bytes:
+                break
+            f.unlink(missing_ok=True)
+            total -= s
+            with self._lock:
+                self.evicted += 1
+        with self._lock:
+            self._size = total
+
+    def clear(self, keep=None):
+        # borra todas las versiones salvo keep ({capa: versión}); los workers comparten el directorio
+        keep = keep or {}
+        if self.root.is_dir():
+            for d in self.root.iterdir():
+                if d.name not in LAYERS:
+                    shutil.rmtree(d, ignore_errors=True)
+                    continue
+                for v in d.iterdir():
+                    if keep.get(d.name) is None or v.name != f"v{keep[d.name]}":
+                        shutil.rmtree(v, ignore_errors=True)
+        with self._lock:
+            self._size = None
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted,
+                    "max_mb": round(self.max_bytes / 1048576, 1)}
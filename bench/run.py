@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# Benchmarks sobre una ciudad sintética (bench/synth.py), sin red ni datos reales.
+# Cada suite corre en un proceso propio (fork) para medir su pico de memoria:
+#   route      latencia de snap + ruta en memoria (Graph.route; --ch agrega la jerarquía)
+#   shadow     sombras + intersección con vías (build_shadow_roads: hulls + tiled_shade)
+#   transform  Overpass JSON -> GeoJSON (transform_osm, con y sin --split)
+#   load       lectura + dedup por geom_hash + COPY binario (load_infra); con --db
+#              además carga en la BD local (docker compose) y deshace la transacción
+# Los resultados quedan en un JSON por corrida; --compare lo contrasta con otra.
+#   python3 -m bench.run --scale sector            # desde la raíz del repo
+#   python3 -m bench.run --scale comuna --suites route,shadow --compare bench/results/<anterior>.json
+import argparse, json, os, platform, resource, subprocess, sys, tempfile, time, traceback
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]  # raíz del repo
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "app"))          # graph, snap, ch
+sys.path.insert(0, str(ROOT / "etl" / "sombra"))  # shadow_cache, que build_shadow_roads importa plano
+from bench.synth import City, SCALES, area_km2
+
+SUITES = ("route", "shadow", "transform", "load")
+RESULTS_DIR = ROOT / "bench" / "results"
+
+
+def pct(ms):
+    a = np.asarray(ms, dtype=np.float64)
+    if not len(a):
+        return {}
+    p50, p90, p99 = np.percentile(a, (50, 90, 99))
+    return {"n": int(len(a)), "p50_ms": round(float(p50), 3), "p90_ms": round(float(p90), 3),
+            "p99_ms": round(float(p99), 3), "max_ms": round(float(a.max()), 3),
+            "mean_ms": round(float(a.mean()), 3)}
+
+
+def rss_mb():
+    # residente actual (Linux); ru_maxrss sólo da el máximo
+    try:
+        return int(Path("/proc/self/statm").read_text().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def isolated(fn, *args):
+    # -> resultado de fn(*args) corrido en un hijo (fork), con pico de memoria del hijo
+    # y de sus propios procesos (el pool de sombras); el hijo no es daemon y puede tener hijos
+    ctx = mp.get_context("fork")
+    rd, wr = ctx.Pipe(duplex=False)
+
+    def target():
+        base = rss_mb()
+        try:
+            res, err = fn(*args), None
+        except Exception:
+            res, err = None, traceback.format_exc()
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        wr.send((res, err, {"base_mb": round(base, 1), "peak_mb": round(own, 1),
+                            "peak_worker_mb": round(kids, 1)}))
+
+    p = ctx.Process(target=target)
+    p.start()
+    try:
+        res, err, mem = rd.recv()
+    except EOFError:
+        res, err, mem = None, f"el proceso terminó con código {p.exitcode}", {}
+    p.join()
+    if err:
+        raise RuntimeError(err)
+    res.update(mem)
+    return res
+
+
+# --- suites ----------------------------------------------------------------------
+
+def edges_from_osm(osm):
+    # -> (edge_rows, node_rows, wkb) como Graph.from_db, desde transform_osm --split
+    import shapely
+    from etl.infraestructura.transform_osm import features
+    edges, nodes, wkb = [], {}, []
+    for f in features(osm, split=True):
+        p, c = f["properties"], f["geometry"]["coordinates"]
+        edges.append((p["id"], p["source"], p["target"], p["length_m"]))
+        nodes[p["source"]], nodes[p["target"]] = c[0], c[-1]
+        wkb.append(shapely.to_wkb(shapely.linestrings(c), byte_order=1))
+    return edges, [(k, x, y) for k, (x, y) in nodes.items()], wkb
+
+
+def bench_route(city, files, args):
+    from graph import Graph
+    from snap import SnapIndex
+    rng = np.random.default_rng(args.seed)
+    t0 = time.perf_counter()
+    edges, nodes, wkb = edges_from_osm(files["osm"])
+    # exposición sintética, para que los perfiles no sean todos iguales a shortest
+    expo = [(e[0], float(s), float(t), float(u)) for e, s, t, u in
+            zip(edges, rng.random(len(edges)), rng.uniform(24, 34, len(edges)), rng.uniform(0, 11, len(edges)))]
+    g = Graph.from_rows(edges, nodes, expo, wkb)
+    t_graph = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    snap = SnapIndex(g)
+    t_snap_idx = time.perf_counter() - t0
+    s, w, n, e = city.bbox
+    pts = np.column_stack((rng.uniform(w, e, (args.queries, 2)), rng.uniform(s, n, (args.queries, 2))))
+    out = {"nodes": g.n_nodes, "edges": g.n_edges, "graph_build_s": round(t_graph, 3),
+           "snap_index_s": round(t_snap_idx, 3), "profiles": {}}
+
+    def run(engine, profile):
+        wc = g.cost(profile)
+        lat_snap, lat_route, lat_total, found = [], [], [], 0
+        for k, (lo0, lo1, la0, la1) in enumerate(pts):
+            t0 = time.perf_counter()
+            S, _ = snap.seeds(lo0, la0, wc, args.snap)
+            T, _ = snap.seeds(lo1, la1, wc, args.snap)
+            t1 = time.perf_counter()
+            cost, path, _, _ = engine.route(S, T, profile)
+            t2 = time.perf_counter()
+            if k < args.warmup:
+                continue
+            found += path is not None
+            lat_snap.append((t1 - t0) * 1000)
+            lat_route.append((t2 - t1) * 1000)
+            lat_total.append((t2 - t0) * 1000)
+        return {"total": pct(lat_total), "snap": pct(lat_snap), "route": pct(lat_route),
+                "found": found}
+
+    for profile in args.profiles:
+        out["profiles"][profile] = run(g, profile)
+    if args.ch:
+        import ch
+        t0 = time.perf_counter()
+        h = ch.build(g, "shortest", log=lambda *a, **k: None)
+        out["ch_build_s"] = round(time.perf_counter() - t0, 3)
+        out["ch_shortcuts"] = int(h.n_shortcuts)
+        out["profiles"]["shortest_ch"] = run(h, "shortest")
+    return out
+
+
+def bench_shadow(city, files, args):
+    import shapely
+    from shapely.geometry import shape
+    from astral import Observer
+    from astral.sun import azimuth, elevation
+    import build_shadow_roads as bsr
+    from etl.utils.jsonstream import iter_array
+    from etl.utils.proj import reproject, transformer
+    t0 = time.perf_counter()
+    fwd = transformer(4326, bsr.EPSG)
+    feats = list(iter_array(files["buildings"], "features"))
+    b = reproject([shape(f["geometry"]) for f in feats], fwd)
+    polys, heights = bsr.building_arrays(list(zip(b, (f["properties"]["height_m"] for f in feats))))
+    roads = reproject([shapely.linestrings(f["geometry"]["coordinates"]) for f in iter_array(files["ways"], "features")], fwd)
+    t_read = time.perf_counter() - t0
+    obs = Observer(latitude=bsr.LAT, longitude=bsr.LON)
+    elev, azim = elevation(obs, bsr.DT), azimuth(obs, bsr.DT) % 360.0
+    t0 = time.perf_counter()
+    hulls = bsr.shadow_hulls(polys, heights, elev, azim)
+    t_hulls = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    union, shaded, errors = bsr.tiled_shade(hulls, roads, args.tile_m, args.workers)
+    t_shade = time.perf_counter() - t0
+    return {"buildings": int(len(polys)), "roads": int(len(roads)), "read_s": round(t_read, 3),
+            "hulls_s": round(t_hulls, 3), "shade_s": round(t_shade, 3),
+            "total_s": round(t_hulls + t_shade, 3), "tile_m": args.tile_m, "workers": args.workers,
+            "shadow_parts": int(shapely.get_num_geometries(union)), "roads_shaded": len(shaded),
+            "errors": errors}
+
+
+def bench_transform(city, files, args):
+    from etl.infraestructura.transform_osm import features, write_fc
+    size = Path(files["osm"]).stat().st_size
+    out = {"ways": files["ways_n"], "input_mb": round(size / 2**20, 2)}
+    with tempfile.TemporaryDirectory() as tmp:
+        for split in (False, True):
+            t0 = time.perf_counter()
+            n = write_fc(features(files["osm"], split), Path(tmp) / "out.geojson")
+            dt = time.perf_counter() - t0
+            out["split" if split else "ways_only"] = {
+                "features": n, "s": round(dt, 3), "features_per_s": round(n / dt, 1),
+                "ways_per_s": round(files["ways_n"] / dt, 1), "mb_per_s": round(size / 2**20 / dt, 2)}
+    return out
+
+
+def sector_files(ways, out_dir, k=4, overlap=0.1):
+    # reparte las vías en k franjas norte-sur que se solapan (como los sectores de
+    # infra_sector*.yaml), así la carga tiene repetidos que deduplicar
+    fc = json.loads(Path(ways).read_text())
+    feats = fc["features"]
+    lon = np.array([np.mean([c[0] for c in f["geometry"]["coordinates"]]) for f in feats])
+    lo, hi = lon.min(), lon.max() + 1e-9
+    step = (hi - lo) / k
+    paths = []
+    for i in range(k):
+        a, b = lo + (i - overlap) * step, lo + (i + 1 + overlap) * step
+        sel = [f for f, x in zip(feats, lon) if a <= x < b]
+        p = Path(out_dir) / f"sector_{i}.geojson"
+        p.write_text(json.dumps({**fc, "features": sel}))
+        paths.append(str(p))
+    return paths
+
+
+def bench_load(city, files, args):
+    from etl.infraestructura import load_infra as li
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = sector_files(files["ways"], tmp)
+        stats = {"read": 0, "dup_input": 0, "invalid": 0, "with_nodes": 0}
+        t0 = time.perf_counter()
+        nbytes = sum(len(c) for c in li.copy_chunks(li.read_rows(paths, set(), stats)))
+        dt = time.perf_counter() - t0
+        out = {"files": len(paths), "read": stats["read"], "dup_input": stats["dup_input"],
+               "dedup_copy_s": round(dt, 3), "rows_per_s": round(stats["read"] / dt, 1),
+               "copy_mb": round(nbytes / 2**20, 2)}
+        if not args.db:
+            return out
+        import psycopg2
+        conn = psycopg2.connect(host=li.DB_HOST, port=li.DB_PORT, dbname=li.DB_NAME,
+                                user=li.DB_USER, password=li.DB_PASS)
+        try:
+            # primera carga (inserta) y recarga de lo mismo (todo sin cambios), en una
+            # transacción que se deshace: via_arista queda como estaba
+            for name in ("db_load", "db_reload"):
+                stats = {"read": 0, "dup_input": 0, "invalid": 0, "with_nodes": 0}
+                t0 = time.perf_counter()
+                li.load(conn, paths, stats)
+                out[name] = {"s": round(time.perf_counter() - t0, 3), "inserted": stats["inserted"],
+                             "updated": stats["updated"], "unchanged": stats["unchanged"]}
+        finally:
+            conn.rollback()
+            conn.close()
+    return out
+
+
+# --- resultados --------------------------------------------------------------------
+
+def git_rev():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(d, prefix=""):
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            yield from flatten(v, key)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            yield key, v
+
+
+def compare(old, new):
+    # métricas presentes en ambas corridas: tiempo/memoria (menos es mejor) y
+    # rendimiento *_per_s (más es mejor); se marcan las que cambian más de 10%
+    a, b = dict(flatten(old["results"])), dict(flatten(new["results"]))
+    print(f"[compare] {old['meta'].get('git')} ({old['meta'].get('date')}) -> {new['meta'].get('git')}")
+    for k in b:
+        if k not in a or not (k.endswith(("_ms", "_s")) or "peak" in k):
+            continue
+        if a[k] == 0:
+            continue
+        d = (b[k] - a[k]) / a[k] * 100
+        worse = -d if k.endswith("_per_s") else d
+        flag = "  <-- peor" if worse > 10 else "  mejor" if worse < -10 else ""
+        print(f"  {k:48s} {a[k]:>12g} -> {b[k]:>12g}  {d:+6.1f}%{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", default="sector", help=f"{'|'.join(SCALES)} o km²")
+    ap.add_argument("--block-m", type=float, default=110.0, help="largo de cuadra (m)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--suites", default=",".join(SUITES))
+    ap.add_argument("--queries", type=int, default=500, help="rutas por perfil")
+    ap.add_argument("--warmup", type=int, default=20, help="consultas iniciales que no se miden")
+    ap.add_argument("--profiles", default="shortest,shadiest")
+    ap.add_argument("--snap", choices=["node", "edge"], default="edge")
+    ap.add_argument("--ch", action="store_true", help="construir y medir la jerarquía (lento en ciudad)")
+    ap.add_argument("--tile-m", type=float, default=1000.0)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--db", action="store_true", help="load contra la BD local (DB_HOST/DB_PORT/...)")
+    ap.add_argument("--data-dir", default="data/bench", help="ciudad sintética (se reutiliza si existe)")
+    ap.add_argument("--out", help="JSON de resultados (default: bench/results/<fecha>-<escala>.json)")
+    ap.add_argument("--compare", help="JSON de una corrida anterior")
+    args = ap.parse_args()
+    args.profiles = [p for p in args.profiles.split(",") if p]
+    suites = [s for s in args.suites.split(",") if s]
+    bad = [s for s in suites if s not in SUITES]
+    if bad:
+        ap.error(f"suites desconocidas: {bad}")
+
+    city = City(area_km2(args.scale), args.block_m, args.seed)
+    data = Path(args.data_dir) / f"{city.km2:g}km2_b{city.block_m:g}_s{args.seed}"
+    t0 = time.perf_counter()
+    if (data / "osm.json").is_file() and (data / "edificios.geojson").is_file():
+        files = {"osm": data / "osm.json", "buildings": data / "edificios.geojson"}
+        files["ways_n"] = sum(1 for _ in json.loads(files["osm"].read_text())["elements"])
+    else:
+        w = city.write(data)
+        files = {"osm": w["osm"], "buildings": w["buildings"], "ways_n": w["ways"]}
+    files["ways"] = data / "vias.geojson"
+    if not files["ways"].is_file():
+        from etl.infraestructura.transform_osm import features, write_fc
+        write_fc(features(files["osm"]), files["ways"])
+    print(f"[bench] ciudad {city.km2:g} km² ({data}) lista en {time.perf_counter()-t0:.1f}s")
+
+    results = {}
+    for s in suites:
+        t0 = time.perf_counter()
+        try:
+            results[s] = isolated(globals()[f"bench_{s}"], city, files, args)
+        except RuntimeError as e:
+            print(f"[ERR] suite {s}:\n{e}", file=sys.stderr)
+            results[s] = {"error": str(e).strip().splitlines()[-1]}
+            continue
+        r = results[s]
+        if s == "route":
+            for p, v in r["profiles"].items():
+                t = v["total"]
+                print(f"[route] {p}: p50={t.get('p50_ms')}ms p90={t.get('p90_ms')}ms p99={t.get('p99_ms')}ms "
+                      f"(snap p50={v['snap'].get('p50_ms')}ms) encontradas={v['found']}/{t.get('n')}")
+        elif s == "shadow":
+            print(f"[shadow] edificios={r['buildings']} vías={r['roads']} hulls={r['hulls_s']}s "
+                  f"sombra={r['shade_s']}s pico={r['peak_mb']}MB pico_worker={r['peak_worker_mb']}MB")
+        elif s == "transform":
+            print(f"[transform] {r['ways_only']['features_per_s']:.0f} features/s, "
+                  f"split {r['split']['features_per_s']:.0f} features/s ({r['input_mb']}MB)")
+        elif s == "load":
+            db = f" bd={r['db_load']['s']}s recarga={r['db_reload']['s']}s" if "db_load" in r else ""
+            print(f"[load] leídas={r['read']} repetidas={r['dup_input']} dedup+copy={r['dedup_copy_s']}s{db}")
+        print(f"[bench] {s} t={time.perf_counter()-t0:.1f}s")
+
+    run = {"meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": git_rev(),
+                    "python": platform.python_version(), "machine": platform.machine(),
+                    "cpus": os.cpu_count(), "scale": args.scale, "km2": city.km2,
+                    "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")}},
+           "results": results}
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{args.scale}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(run, indent=1, ensure_ascii=False))
+    print(f"OK {out}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), run)
+    sys.exit(1 if any("error" in r for r in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
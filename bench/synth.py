@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Ciudad sintética para benchmarks, sin red: malla de calles con forma de
+# respuesta Overpass (`out geom` con nodes, como la que leen los transform) y
+# edificios con height_m (como json/metadata_edificios.geojson), a la escala
+# que se pida: desde un sector (~1 km²) hasta la ciudad completa.
+# Determinista por semilla: la misma escala y semilla dan los mismos archivos.
+#   python3 -m bench.synth --scale comuna --out data/bench/comuna
+import argparse, json, math
+from pathlib import Path
+import numpy as np
+
+CENTER = (-33.431, -70.618)   # (lat, lon) como center_lat/center_lon de sombra_config.yaml
+M_PER_DEG_LAT = 110540.0
+# km² aproximados: un sector de los YAML de infraestructura, Providencia, Gran Santiago
+SCALES = {"sector": 1.0, "comuna": 14.4, "ciudad": 641.0}
+
+
+def area_km2(scale):
+    return SCALES[scale] if scale in SCALES else float(scale)
+
+
+class City:
+    def __init__(self, km2=1.0, block_m=110.0, seed=0, way_blocks=4, lots=(3, 2), gap=0.03):
+        self.km2 = float(km2)
+        self.block_m = float(block_m)
+        self.seed = seed
+        self.way_blocks = way_blocks
+        self.lots = lots
+        self.gap = gap
+        side = math.sqrt(self.km2) * 1000.0
+        self.n = max(2, int(round(side / self.block_m)) + 1)  # nodos por lado
+        self.dlat = self.block_m / M_PER_DEG_LAT
+        self.dlon = self.block_m / (M_PER_DEG_LAT * math.cos(math.radians(CENTER[0])))
+        h = (self.n - 1) / 2
+        self.lat0, self.lon0 = CENTER[0] - h * self.dlat, CENTER[1] - h * self.dlon
+
+    @property
+    def bbox(self):
+        # (S, W, N, E) como en los YAML del ETL
+        k = self.n - 1
+        return (self.lat0, self.lon0, self.lat0 + k * self.dlat, self.lon0 + k * self.dlon)
+
+    def nodes(self):
+        # intersecciones: (lat, lon) con un desvío aleatorio de hasta 8% de la cuadra
+        rng = np.random.default_rng(self.seed)
+        i, j = np.meshgrid(np.arange(self.n), np.arange(self.n), indexing="ij")
+        lat = self.lat0 + (i + rng.uniform(-0.08, 0.08, i.shape)) * self.dlat
+        lon = self.lon0 + (j + rng.uniform(-0.08, 0.08, j.shape)) * self.dlon
+        return lat, lon
+
+    def overpass(self):
+        # -> {"elements": [...]} con ways de calles (tags highway/oneway/name)
+        rng = np.random.default_rng(self.seed + 1)
+        lat, lon = self.nodes()
+        n = self.n
+        nid = lambda i, j: 1 + i * n + j
+        extra = [n * n + 1]  # ids de los vértices intermedios (no son intersecciones)
+        elements = []
+
+        def highway(k):
+            return "primary" if k % 8 == 0 else "secondary" if k % 4 == 0 else "residential"
+
+        def street(cells, k, vertical):
+            # cells: [(i, j)] de intersecciones consecutivas; un way cada way_blocks cuadras
+            hw = highway(k)
+            tags = {"highway": hw, "name": f"{'Calle' if vertical else 'Avenida'} {k}"}
+            if hw == "residential" and k % 2:
+                tags["oneway"] = "yes"
+            nodes, geom = [nid(*cells[0])], [(lat[cells[0]], lon[cells[0]])]
+            for a, b in zip(cells[:-1], cells[1:]):
+                # un vértice de forma a mitad de cuadra, con algo de curvatura
+                t = rng.uniform(0.3, 0.7)
+                off = rng.uniform(-0.03, 0.03)
+                mlat = lat[a] + t * (lat[b] - lat[a]) + (off * self.dlat if not vertical else 0.0)
+                mlon = lon[a] + t * (lon[b] - lon[a]) + (off * self.dlon if vertical else 0.0)
+                nodes += [extra[0], nid(*b)]
+                geom += [(mlat, mlon), (lat[b], lon[b])]
+                extra[0] += 1
+            elements.append({"type": "way", "id": len(elements) + 1, "nodes": nodes,
+                             "geometry": [{"lat": round(float(a), 7), "lon": round(float(o), 7)} for a, o in geom],
+                             "tags": tags})
+
+        for vertical in (False, True):
+            for k in range(n):
+                run = [(k, 0) if not vertical else (0, k)]
+                for m in range(1, n):
+                    cell = (k, m) if not vertical else (m, k)
+                    if rng.random() < self.gap:
+                        # cuadra faltante (pasaje, parque): corta la calle
+                        if len(run) > 1:
+                            street(run, k, vertical)
+                        run = [cell]
+                        continue
+                    if len(run) > self.way_blocks:
+                        street(run, k, vertical)
+                        run = [run[-1]]
+                    run.append(cell)
+                if len(run) > 1:
+                    street(run, k, vertical)
+        return {"version": 0.6, "generator": "bench.synth", "elements": elements}
+
+    def buildings(self):
+        # -> FeatureCollection de edificios: lotes por manzana con retiro, altura log-normal
+        rng = np.random.default_rng(self.seed + 2)
+        bx, by = self.lots
+        m = self.n - 1
+        i, j, a, b = np.meshgrid(np.arange(m), np.arange(m), np.arange(by), np.arange(bx), indexing="ij")
+        i, j, a, b = i.ravel(), j.ravel(), a.ravel(), b.ravel()
+        park = rng.random((m, m)) < 0.1
+        keep = ~park[i, j] & (rng.random(i.size) < 0.9)
+        i, j, a, b = i[keep], j[keep], a[keep], b[keep]
+        k = i.size
+        # lote dentro de la manzana (descontando 12% de calle a cada lado), edificio 50-90% del lote
+        inner = 0.76
+        lw, lh = inner / bx, inner / by
+        fw, fh = rng.uniform(0.5, 0.9, k) * lw, rng.uniform(0.5, 0.9, k) * lh
+        x0 = j + 0.12 + b * lw + rng.uniform(0, 1, k) * (lw - fw)
+        y0 = i + 0.12 + a * lh + rng.uniform(0, 1, k) * (lh - fh)
+        lon0, lat0 = self.lon0 + x0 * self.dlon, self.lat0 + y0 * self.dlat
+        lon1, lat1 = lon0 + fw * self.dlon, lat0 + fh * self.dlat
+        h = np.clip(rng.lognormal(math.log(9.0), 0.7, k), 3.0, 150.0)
+        feats = []
+        for n_, (w, s, e, nn, hh) in enumerate(zip(lon0.tolist(), lat0.tolist(), lon1.tolist(), lat1.tolist(), h.tolist())):
+            ring = [[round(w, 7), round(s, 7)], [round(e, 7), round(s, 7)], [round(e, 7), round(nn, 7)],
+                    [round(w, 7), round(nn, 7)], [round(w, 7), round(s, 7)]]
+            feats.append({"type": "Feature", "geometry": {"type": "Polygon", "coordinates": [ring]},
+                          "properties": {"osm_id": n_ + 1, "height_m": round(hh, 2), "building": "yes"}})
+        return {"type": "FeatureCollection", "features": feats,
+                "crs": {"type": "name", "properties": {"name": "EPSG:4326"}}}
+
+    def write(self, out_dir):
+        # -> {"osm": ruta, "buildings": ruta, "ways": n, "buildings_n": n}
+        out = Path(out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        osm, bld = self.overpass(), self.buildings()
+        (out / "osm.json").write_text(json.dumps(osm))
+        (out / "edificios.geojson").write_text(json.dumps(bld))
+        return {"osm": out / "osm.json", "buildings": out / "edificios.geojson",
+                "ways": len(osm["elements"]), "buildings_n": len(bld["features"])}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", default="sector", help=f"{'|'.join(SCALES)} o km²")
+    ap.add_argument("--block-m", type=float, default=110.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="data/bench/city")
+    args = ap.parse_args()
+    city = City(area_km2(args.scale), args.block_m, args.seed)
+    r = city.write(args.out)
+    print(f"OK {args.out}: {city.km2:g} km² intersecciones={city.n**2} ways={r['ways']} "
+          f"edificios={r['buildings_n']} bbox={tuple(round(v, 5) for v in city.bbox)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+-- Triggers de capa_version en las tablas de las capas de /tiles (ver tiles.LAYERS).
+-- ogr2ogr -overwrite recrea la tabla sin sus triggers: correr después de cada carga.
+-- La tabla recreada ya cambia de oid, así que sus teselas guardadas no se reutilizan;
+-- desde aquí cualquier INSERT/UPDATE/DELETE/TRUNCATE incrementa su versión.
+DO $$
+DECLARE t TEXT;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['via_arista', 'via_sombreada', 'sombra_poligono', 'bebedero',
+                           'amenaza_calor_grid', 'amenaza_uv_grid'] LOOP
+    IF to_regclass(t) IS NOT NULL THEN
+      EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', 'trg_' || t || '_capa_version', t);
+      EXECUTE format('CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                     'FOR EACH STATEMENT EXECUTE FUNCTION capa_version_bump()',
+                     'trg_' || t || '_capa_version', t);
+    END IF;
+  END LOOP;
+END $$;
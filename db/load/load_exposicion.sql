@@ -0,0 +1,67 @@
+-- Atributos de exposición por arista (sombra, temperatura, UV), calculados en bloque
+-- para que /route?profile=... no haga joins espaciales en tiempo de consulta.
+-- Ejecutar después de cargar via_arista, sombra_poligono y las grillas de amenaza;
+-- repetir cuando cualquiera de ellas se recargue.
+CREATE TABLE IF NOT EXISTS via_arista_exposicion (
+  arista_id BIGINT PRIMARY KEY REFERENCES via_arista(id) ON DELETE CASCADE,
+  frac_sombra REAL NOT NULL DEFAULT 0,   -- fracción del largo bajo sombra_poligono [0,1]
+  temp_c REAL,                           -- temperatura ponderada por área en cada celda
+  uv_index REAL                          -- UV ponderado por área en cada celda
+);
+
+-- los costos por perfil dependen de esta tabla: también invalida la caché de rutas
+DROP TRIGGER IF EXISTS trg_via_arista_exposicion_version ON via_arista_exposicion;
+CREATE TRIGGER trg_via_arista_exposicion_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON via_arista_exposicion
+  FOR EACH STATEMENT EXECUTE FUNCTION grafo_version_bump();
+
+TRUNCATE via_arista_exposicion;
+
+-- Temperatura y UV ponderados por área: cada arista se lleva a un corredor de 10 m
+-- a cada lado (calzada + veredas) y cada celda pesa por el área del corredor que
+-- cubre (m²). Una arista en el borde entre celdas toma de ambas aunque la línea
+-- caiga en una sola; la sombra sigue midiéndose sobre el largo de la línea.
+WITH largo AS (
+  SELECT id, geom, NULLIF(ST_Length(geom::geography), 0) AS l
+  FROM via_arista
+), corredor AS (
+  SELECT id, ST_Buffer(geom::geography, 10)::geometry AS geom
+  FROM via_arista
+), sombra AS (
+  SELECT a.id,
+         SUM(ST_Length(ST_CollectionExtract(ST_Intersection(a.geom, s.geom), 2)::geography)) AS l_sombra
+  FROM via_arista a
+  JOIN sombra_poligono s ON ST_Intersects(a.geom, s.geom)
+  GROUP BY a.id
+), calor AS (
+  SELECT id, SUM(m2 * v) / NULLIF(SUM(m2), 0) AS temp_c
+  FROM (
+    SELECT a.id, c.temp_c AS v,
+           ST_Area(ST_CollectionExtract(ST_Intersection(a.geom, c.geom), 3)::geography) AS m2
+    FROM corredor a
+    JOIN amenaza_calor_grid c ON ST_Intersects(a.geom, c.geom)
+    WHERE c.temp_c IS NOT NULL
+  ) x
+  GROUP BY id
+), uv AS (
+  SELECT id, SUM(m2 * v) / NULLIF(SUM(m2), 0) AS uv_index
+  FROM (
+    SELECT a.id, u.uv_index AS v,
+           ST_Area(ST_CollectionExtract(ST_Intersection(a.geom, u.geom), 3)::geography) AS m2
+    FROM corredor a
+    JOIN amenaza_uv_grid u ON ST_Intersects(a.geom, u.geom)
+    WHERE u.uv_index IS NOT NULL
+  ) x
+  GROUP BY id
+)
+INSERT INTO via_arista_exposicion (arista_id, frac_sombra, temp_c, uv_index)
+SELECT l.id,
+       LEAST(1.0, COALESCE(s.l_sombra / l.l, 0)),
+       c.temp_c, u.uv_index
+FROM largo l
+LEFT JOIN sombra s USING (id)
+LEFT JOIN calor  c USING (id)
+LEFT JOIN uv     u USING (id);
+
+ANALYZE via_arista_exposicion;
+
@@ -1,4 +1,6 @@
--- importa a via_arista_stg con ogr2ogr antes de ejecutar esto
+-- camino antiguo: importa a via_arista_stg con ogr2ogr antes de ejecutar esto.
+-- main.sh usa etl/infraestructura/load_infra.py (COPY + upsert por geom_hash)
+-- y después topology_infra.sql.
 INSERT INTO via_arista (geom,length_m,osm_id,oneway,highway)
 SELECT s.geom, s.length_m, s.osm_id, s.oneway, s.highway
 FROM (
@@ -10,13 +12,4 @@ WHERE v.id IS NULL;
 
 TRUNCATE via_arista_stg;
 
-CREATE EXTENSION IF NOT EXISTS pgrouting;
-SELECT pgr_createTopology('via_arista', 0.00001, 'geom', 'id', 'source', 'target');
-SELECT pgr_analyzeGraph('via_arista', 0.00001, 'geom', 'id');
-
-DROP TABLE IF EXISTS via_nodo;
-CREATE TABLE via_nodo AS
-  SELECT id::bigint, the_geom::geometry(Point,4326) AS geom,
-         NULL::real AS elev_m, NULL::bigint AS osm_id
-  FROM via_arista_vertices_pgr;
-CREATE INDEX IF NOT EXISTS idx_via_nodo_geom ON via_nodo USING GIST (geom);
+\ir topology_infra.sql
@@ -0,0 +1,13 @@
+-- topología pgRouting y via_nodo sobre via_arista, reconstruidas desde cero.
+-- Para agregar un sector basta topology_infra_incremental.sql; este archivo
+-- queda para reconstruir (p.ej. después de borrar aristas).
+CREATE EXTENSION IF NOT EXISTS pgrouting;
+SELECT pgr_createTopology('via_arista', 0.00001, 'geom', 'id', 'source', 'target', clean := true);
+SELECT pgr_analyzeGraph('via_arista', 0.00001, 'geom', 'id');
+
+DROP TABLE IF EXISTS via_nodo;
+CREATE TABLE via_nodo AS
+  SELECT id::bigint, the_geom::geometry(Point,4326) AS geom,
+         NULL::real AS elev_m, NULL::bigint AS osm_id
+  FROM via_arista_vertices_pgr;
+CREATE INDEX IF NOT EXISTS idx_via_nodo_geom ON via_nodo USING GIST (geom);
@@ -0,0 +1,32 @@
+-- Compara la topología actual de via_arista (p.ej. tras cargas incrementales)
+-- con una reconstrucción completa en una copia (via_arista_chk). Los ids de
+-- vértice pueden diferir; se exige que ambas particiones de extremos coincidan:
+-- cada vértice actual corresponde a exactamente un vértice de la copia y viceversa.
+DROP TABLE IF EXISTS via_arista_chk;
+DROP TABLE IF EXISTS via_arista_chk_vertices_pgr;
+CREATE TABLE via_arista_chk AS
+  SELECT id, geom, NULL::bigint AS source, NULL::bigint AS target FROM via_arista;
+ALTER TABLE via_arista_chk ADD PRIMARY KEY (id);
+CREATE INDEX ON via_arista_chk USING GIST (geom);
+SELECT pgr_createTopology('via_arista_chk', 0.00001, 'geom', 'id', 'source', 'target', clean := true);
+
+WITH ends AS (
+  SELECT a.source AS cur, c.source AS ref FROM via_arista a JOIN via_arista_chk c USING (id)
+  UNION ALL
+  SELECT a.target, c.target FROM via_arista a JOIN via_arista_chk c USING (id)
+), pairs AS (
+  SELECT DISTINCT cur, ref FROM ends
+)
+SELECT (SELECT count(*) FROM via_arista) AS aristas,
+       (SELECT count(*) FROM ends WHERE cur IS NULL OR ref IS NULL) AS extremos_sin_vertice,
+       (SELECT count(DISTINCT cur) FROM pairs) AS vertices_actual,
+       (SELECT count(DISTINCT ref) FROM pairs) AS vertices_completa,
+       (SELECT count(*) FROM pairs) AS pares,
+       (SELECT count(*) FROM via_arista a WHERE NOT EXISTS (SELECT 1 FROM via_nodo n WHERE n.id = a.source)
+                                             OR NOT EXISTS (SELECT 1 FROM via_nodo n WHERE n.id = a.target)) AS aristas_sin_nodo,
+       (SELECT count(*) FROM ends WHERE cur IS NULL OR ref IS NULL) = 0
+         AND (SELECT count(DISTINCT cur) FROM pairs) = (SELECT count(*) FROM pairs)
+         AND (SELECT count(DISTINCT ref) FROM pairs) = (SELECT count(*) FROM pairs) AS coincide;
+
+DROP TABLE via_arista_chk;
+DROP TABLE via_arista_chk_vertices_pgr;
@@ -0,0 +1,23 @@
+-- topología incremental: sólo las aristas con source/target NULL (recién cargadas).
+-- pgr_createTopology sin clean reutiliza via_arista_vertices_pgr: cada extremo
+-- se une al vértice existente más cercano dentro de la tolerancia y si no hay
+-- ninguno se agrega uno nuevo. via_nodo recibe sólo los vértices nuevos.
+-- Las aristas nuevas tienen ids mayores que las existentes, así que el resultado
+-- coincide con una reconstrucción completa (ver topology_infra_check.sql).
+-- pgr_analyzeGraph (sólo diagnóstico) queda para la reconstrucción completa.
+CREATE EXTENSION IF NOT EXISTS pgrouting;
+SELECT pgr_createTopology('via_arista', 0.00001, 'geom', 'id', 'source', 'target',
+                          rows_where := 'source IS NULL OR target IS NULL', clean := false);
+
+CREATE TABLE IF NOT EXISTS via_nodo (
+  id BIGINT, geom geometry(Point,4326), elev_m REAL, osm_id BIGINT
+);
+INSERT INTO via_nodo (id, geom, elev_m, osm_id)
+SELECT v.id, v.the_geom::geometry(Point,4326), NULL, NULL
+FROM via_arista_vertices_pgr v
+WHERE NOT EXISTS (SELECT 1 FROM via_nodo n WHERE n.id = v.id);
+CREATE INDEX IF NOT EXISTS idx_via_nodo_geom ON via_nodo USING GIST (geom);
+
+SELECT count(*) FILTER (WHERE source IS NULL OR target IS NULL) AS aristas_sin_topologia,
+       (SELECT count(*) FROM via_nodo) AS nodos
+FROM via_arista;
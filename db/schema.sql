@@ -15,6 +15,9 @@ CREATE TABLE IF NOT EXISTS via_arista (
 );
 CREATE INDEX IF NOT EXISTS idx_via_arista_geom   ON via_arista USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_via_arista_osm    ON via_arista(osm_id);
+-- hash de la geometría (etl/infraestructura/load_infra.py): clave del upsert
+ALTER TABLE via_arista ADD COLUMN IF NOT EXISTS geom_hash BYTEA;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_via_arista_geom_hash ON via_arista(geom_hash);
 
 -- staging para cargas por tesela
 CREATE TABLE IF NOT EXISTS via_arista_stg (
@@ -26,3 +29,44 @@ CREATE TABLE IF NOT EXISTS via_arista_stg (
 );
 CREATE INDEX IF NOT EXISTS idx_via_arista_stg_geom ON via_arista_stg USING GIST (geom);
 CREATE INDEX IF NOT EXISTS idx_via_arista_stg_osm  ON via_arista_stg(osm_id);
+
+-- Versión de los datos del grafo: cualquier cambio en via_arista la incrementa.
+-- La API la consulta para invalidar su caché de rutas y recargar el grafo.
+CREATE TABLE IF NOT EXISTS grafo_version (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  version BIGINT NOT NULL DEFAULT 0,
+  actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+INSERT INTO grafo_version (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION grafo_version_bump() RETURNS trigger AS $$
+BEGIN
+  UPDATE grafo_version SET version = version + 1, actualizado = now() WHERE id = 1;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_via_arista_version ON via_arista;
+CREATE TRIGGER trg_via_arista_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON via_arista
+  FOR EACH STATEMENT EXECUTE FUNCTION grafo_version_bump();
+
+-- Versión por capa de /tiles (app/tiles.py): la caché de teselas se indexa con
+-- (oid de la tabla, versión). Los triggers de las capas que carga ogr2ogr
+-- (que recrea la tabla) los agrega db/load/capas_version.sql.
+CREATE TABLE IF NOT EXISTS capa_version (
+  tabla TEXT PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  actualizado TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE OR REPLACE FUNCTION capa_version_bump() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO capa_version AS c (tabla, version) VALUES (TG_TABLE_NAME, 1)
+  ON CONFLICT (tabla) DO UPDATE SET version = c.version + 1, actualizado = now();
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_via_arista_capa_version ON via_arista;
+CREATE TRIGGER trg_via_arista_capa_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON via_arista
+  FOR EACH STATEMENT EXECUTE FUNCTION capa_version_bump();
@@ -1,25 +1,39 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.responses import JSONResponse
-import psycopg2, json, os
+import json, sys
+from pathlib import Path
 
-app = FastAPI()
-conn = psycopg2.connect(host=os.getenv("DB_HOST","db"),
-                        dbname=os.getenv("DB_NAME","gis"),
-                        user=os.getenv("DB_USER","postgres"),
-                        password=os.getenv("DB_PASS","postgres"))
+# capa de BD compartida con app/server.py (app/db.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "app"))
+from db import DBPool, PoolTimeout
+
+POOL = DBPool()
+
+@asynccontextmanager
+async def lifespan(app):
+    POOL.open()
+    yield
+    POOL.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=503)
 
 @app.get("/health")
 def health():
-    with conn, conn.cursor() as cur:
+    with POOL.cursor() as cur:
         cur.execute("SELECT 1")
-        return {"ok": True}
+    return {"ok": True, "pool": POOL.stats()}
 
 @app.get("/route")
 def route(src: str, dst: str):
     # src/dst = "lat,lon"
     slat,slon = map(float, src.split(','))
     dlat,dlon = map(float, dst.split(','))
-    with conn, conn.cursor() as cur:
+    with POOL.cursor() as cur:
         cur.execute("""
         WITH s AS (
           SELECT id FROM via_nodo ORDER BY geom <-> ST_SetSRID(ST_Point(%s,%s),4326) LIMIT 1
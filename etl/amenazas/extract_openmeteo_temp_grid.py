@@ -1,79 +1,82 @@
 #!/usr/bin/env python3
-import json, time, math
+import argparse, sys, time
 from pathlib import Path
-import requests, yaml
+from urllib.parse import parse_qsl
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.fetch import Fetcher
+from etl.utils.grid import Grid
 
 CFG = yaml.safe_load(Path("etl/amenazas/temp_grid_config.yaml").read_text())
 S,W,N,E = CFG["bbox"]
 NY, NX = int(CFG["cells_y"]), int(CFG["cells_x"])
 API = CFG["api_base"]; Q = CFG["query"]
-SLEEP = float(CFG.get("sleep_s", 0.15))
-
-def linspace(a,b,n):
-    if n==1: return [a]
-    step=(b-a)/n
-    return [a+i*step for i in range(n+1)]
+# Salidas: la grilla (npz) es el registro; el GeoJSON por celda es una exportación
+# para cargar en PostGIS (null = no exportar)
+OUT_NPZ = Path(CFG.get("grid_npz", "data/amenaza_temp_grid.npz"))
+OUT_GJ = CFG.get("geojson_export", "json/amenaza_temp_grid.geojson")
+# Open-Meteo acepta listas de coordenadas separadas por coma: batch_size celdas por request
+BATCH = int(CFG.get("batch_size", 50))
 
-def mk_grid(bbox, ny, nx):
-    S,W,N,E = bbox
-    ys = linspace(N, S, ny)   # de norte a sur
-    xs = linspace(W, E, nx)   # de oeste a este
-    cells=[]
-    for iy in range(ny):
-        for ix in range(nx):
-            y1, y0 = ys[iy], ys[iy+1]
-            x0, x1 = xs[ix], xs[ix+1]
-            poly = [[x0,y1],[x1,y1],[x1,y0],[x0,y0],[x0,y1]]
-            cy = (y0+y1)/2.0
-            cx = (x0+x1)/2.0
-            cells.append({"poly":poly, "centroid":[cx,cy], "row":iy, "col":ix})
-    return cells
+def batch_calls(cells, api):
+    # un request por lote de centroides
+    q = dict(parse_qsl(Q))
+    calls = []
+    for i in range(0, len(cells), BATCH):
+        chunk = cells[i:i+BATCH]
+        calls.append((api, {**q,
+                            "latitude": ",".join(f"{c['centroid'][1]:.6f}" for c in chunk),
+                            "longitude": ",".join(f"{c['centroid'][0]:.6f}" for c in chunk)}))
+    return calls
 
-def fetch_temp(lat, lon):
+def fetch_temps(cells, fetcher, api):
     # Open-Meteo: temperatura actual (°C) en current_weather.temperature
-    url = f"{API}?latitude={lat:.6f}&longitude={lon:.6f}&{Q}"
-    r = requests.get(url, timeout=30)
-    r.raise_for_status()
-    j = r.json()
-    cw = j.get("current_weather") or {}
-    t  = cw.get("temperature")
-    tm = cw.get("time")
-    return t, tm, j
+    # -> [(temp, time)] por celda; (None, None) si su lote falló
+    calls = batch_calls(cells, api)
+    out = []
+    for (_, params), j in zip(calls, fetcher.map_json(calls)):
+        n = params["latitude"].count(",") + 1
+        locs = j if isinstance(j, list) else [j]
+        if isinstance(j, Exception) or len(locs) != n:
+            print(f"[WARN] lote de {n} celdas falló: {j if isinstance(j, Exception) else 'respuesta incompleta'}",
+                  file=sys.stderr)
+            out += [(None, None)] * n
+            continue
+        for loc in locs:
+            cw = loc.get("current_weather") or {}
+            out.append((cw.get("temperature"), cw.get("time")))
+    return out
 
 def main():
-    Path("json").mkdir(parents=True, exist_ok=True)
-    cells = mk_grid((S,W,N,E), NY, NX)
-    feats=[]
-    meta_time=None
-    for c in cells:
-        lat = c["centroid"][1]
-        lon = c["centroid"][0]
-        try:
-            t, tm, raw = fetch_temp(lat, lon)
-            if meta_time is None: meta_time = tm
-        except Exception as e:
-            t, raw = None, {"error": str(e)}
-        props = {
-            "temp_c": t,
-            "row": c["row"],
-            "col": c["col"],
-            "centroid": {"lon": lon, "lat": lat}
-        }
-        feats.append({
-            "type":"Feature",
-            "geometry":{"type":"Polygon","coordinates":[c["poly"]]},
-            "properties": props
-        })
-        time.sleep(SLEEP)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--api-base", default=API, help="p.ej. el stub: http://127.0.0.1:8765/v1/forecast")
+    ap.add_argument("--no-cache", action="store_true", help="ignorar la caché en disco")
+    ap.add_argument("--no-geojson", action="store_true", help="sólo escribir la grilla npz")
+    args = ap.parse_args()
 
-    gj = {
-        "type":"FeatureCollection",
-        "features":feats,
-        "crs":{"type":"name","properties":{"name":"EPSG:4326"}},
-        "properties":{"source":"open-meteo","time":meta_time}
-    }
-    Path("json/amenaza_temp_grid.geojson").write_text(json.dumps(gj, ensure_ascii=False))
-    print(f"OK json/amenaza_temp_grid.geojson cells={len(feats)} time={meta_time}")
+    grid = Grid.empty((S,W,N,E), NY, NX, "temp_c")
+    cells = grid.cells()
+    fetcher = Fetcher(rate_per_s=CFG.get("rate_per_s", 5), burst=CFG.get("burst", 5),
+                      workers=CFG.get("workers", 8), retries=CFG.get("retries", 4),
+                      cache_dir=CFG.get("cache_dir"), cache_ttl_s=CFG.get("cache_ttl_s", 900),
+                      no_cache=args.no_cache)
+    t0 = time.perf_counter()
+    temps = fetch_temps(cells, fetcher, args.api_base)
+    meta_time=None
+    for c, (t, tm) in zip(cells, temps):
+        if t is not None:
+            grid.values[c["row"], c["col"]] = t
+        if meta_time is None: meta_time = tm
+    grid.meta = {"source":"open-meteo","time":meta_time}
+    grid.save(OUT_NPZ)
+    out = [str(OUT_NPZ)]
+    if OUT_GJ and not args.no_geojson:
+        grid.to_geojson(OUT_GJ)
+        out.append(OUT_GJ)
+    print(f"OK {' + '.join(out)} cells={grid.ny*grid.nx} con_dato={int((~np.isnan(grid.values)).sum())} "
+          f"time={meta_time} {fetcher.summary()} t={time.perf_counter()-t0:.1f}s")
 
 if __name__=="__main__":
     main()
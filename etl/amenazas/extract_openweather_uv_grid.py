@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
-import json, time
+import argparse, sys, time
 from pathlib import Path
-import requests, yaml
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.fetch import Fetcher
+from etl.utils.grid import Grid
 
 CFG = yaml.safe_load(Path("etl/amenazas/uv_grid_config.yaml").read_text())
 S,W,N,E = CFG["bbox"]
@@ -10,74 +15,68 @@ API     = CFG["api_base"]
 KEY     = CFG["api_key"]
 EXC     = CFG.get("exclude","minutely,hourly,daily,alerts")
 UNITS   = CFG.get("units","metric")
-SLEEP   = float(CFG.get("sleep_s",0.2))
-
-def linspace(a,b,n):
-    if n==1: return [a]
-    step = (b-a)/n
-    return [a+i*step for i in range(n+1)]
-
-def make_grid(bbox, ny, nx):
-    S,W,N,E = bbox
-    ys = linspace(N,S,ny)  # N→S
-    xs = linspace(W,E,nx)  # W→E
-    cells=[]
-    for iy in range(ny):
-        for ix in range(nx):
-            yN, yS = ys[iy], ys[iy+1]
-            xW, xE = xs[ix], xs[ix+1]
-            poly = [[xW,yN],[xE,yN],[xE,yS],[xW,yS],[xW,yN]]
-            cy = (yN+yS)/2.0; cx = (xW+xE)/2.0
-            cells.append({"poly":poly, "centroid":[cx,cy], "row":iy, "col":ix})
-    return cells
+# Salidas: la grilla (npz) es el registro; el GeoJSON por celda es una exportación
+# para cargar en PostGIS (null = no exportar)
+OUT_NPZ = Path(CFG.get("grid_npz", "data/amenaza_uv_grid.npz"))
+OUT_GJ  = CFG.get("geojson_export", "json/amenaza_uv_grid.geojson")
 
-def fetch_uv(lat, lon):
-    params = {
+def uv_params(lat, lon):
+    return {
         "lat": f"{lat:.6f}",
         "lon": f"{lon:.6f}",
         "exclude": EXC,
         "appid": KEY,
         "units": UNITS
     }
-    r = requests.get(API, params=params, timeout=30)
-    r.raise_for_status()
-    j = r.json()
-    uvi = (j.get("current") or {}).get("uvi")
-    t   = (j.get("current") or {}).get("dt")
-    return uvi, t, j
+
+def fetch_uvs(cells, fetcher, api):
+    # One Call no acepta varias coordenadas: un request por celda, concurrentes
+    # -> [(uvi, dt)] por celda; (None, None) si falló
+    calls = [(api, uv_params(c["centroid"][1], c["centroid"][0])) for c in cells]
+    out = []
+    for j in fetcher.map_json(calls):
+        if isinstance(j, Exception):
+            out.append((None, None))
+            continue
+        cur = j.get("current") or {}
+        out.append((cur.get("uvi"), cur.get("dt")))
+    return out
 
 def main():
-    Path("json").mkdir(parents=True, exist_ok=True)
-    feats=[]
-    cells = make_grid((S,W,N,E), NY, NX)
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--api-base", default=API, help="p.ej. el stub: http://127.0.0.1:8765/data/3.0/onecall")
+    ap.add_argument("--no-cache", action="store_true", help="ignorar la caché en disco")
+    ap.add_argument("--no-geojson", action="store_true", help="sólo escribir la grilla npz")
+    args = ap.parse_args()
+
+    grid = Grid.empty((S,W,N,E), NY, NX, "uv_index")
+    cells = grid.cells()
+    fetcher = Fetcher(rate_per_s=CFG.get("rate_per_s", 8), burst=CFG.get("burst", 8),
+                      workers=CFG.get("workers", 8), retries=CFG.get("retries", 4),
+                      cache_dir=CFG.get("cache_dir"), cache_ttl_s=CFG.get("cache_ttl_s", 900),
+                      no_cache=args.no_cache)
+    t0 = time.perf_counter()
+    uvs = fetch_uvs(cells, fetcher, args.api_base)
+    errors = sum(u is None for u, _ in uvs)
+    if errors:
+        print(f"[WARN] {errors}/{len(cells)} celdas sin UV", file=sys.stderr)
+    ts = np.full(grid.values.shape, np.nan)  # dt (unix) por celda
     meta_time=None
-    for c in cells:
-        lat = c["centroid"][1]; lon = c["centroid"][0]
-        try:
-            uvi, ts, _raw = fetch_uv(lat, lon)
-            if meta_time is None: meta_time = ts
-        except Exception as e:
-            uvi, ts = None, None
-        props = {
-            "uv_index": uvi,
-            "row": c["row"], "col": c["col"],
-            "centroid": {"lon": lon, "lat": lat},
-            "timestamp": ts
-        }
-        feats.append({
-            "type":"Feature",
-            "geometry":{"type":"Polygon","coordinates":[c["poly"]]},
-            "properties": props
-        })
-        time.sleep(SLEEP)
-    gj = {
-        "type":"FeatureCollection",
-        "features":feats,
-        "crs":{"type":"name","properties":{"name":"EPSG:4326"}},
-        "properties":{"source":"openweather","time_unix":meta_time}
-    }
-    Path("json/amenaza_uv_grid.geojson").write_text(json.dumps(gj, ensure_ascii=False))
-    print(f"OK json/amenaza_uv_grid.geojson cells={len(feats)} time_unix={meta_time}")
+    for c, (uvi, t) in zip(cells, uvs):
+        if uvi is not None:
+            grid.values[c["row"], c["col"]] = uvi
+        if t is not None:
+            ts[c["row"], c["col"]] = t
+        if meta_time is None: meta_time = t
+    grid.layers["timestamp"] = ts
+    grid.meta = {"source":"openweather","time_unix":meta_time}
+    grid.save(OUT_NPZ)
+    out = [str(OUT_NPZ)]
+    if OUT_GJ and not args.no_geojson:
+        grid.to_geojson(OUT_GJ)
+        out.append(OUT_GJ)
+    print(f"OK {' + '.join(out)} cells={len(cells)} time_unix={meta_time} "
+          f"{fetcher.summary()} t={time.perf_counter()-t0:.1f}s")
 
 if __name__=="__main__":
     main()
@@ -1,33 +1,35 @@
 #!/usr/bin/env python3
-import json, sys, time, argparse
+import json, sys, argparse
 from pathlib import Path
-import requests, yaml
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.overpass import from_config, add_cli_args
 
 ap = argparse.ArgumentParser()
 ap.add_argument("--cfg", default="etl/infraestructura/infra_sector.yaml")
+add_cli_args(ap)
 args = ap.parse_args()
 
 cfg = yaml.safe_load(Path(args.cfg).read_text())
-UA = cfg.get("user_agent","Mozilla/5.0 (compatible; fase2/1.0)")
-TIMEOUT = int(cfg.get("timeout_s",120))
-URL = cfg.get("overpass_url","https://z.overpass-api.de/api/interpreter")
+cfg.setdefault("user_agent", "Mozilla/5.0 (compatible; fase2/1.0)")
+cfg.setdefault("overpass_url", "https://z.overpass-api.de/api/interpreter")
 S,W,N,E = cfg["bbox"]
 
-QUERY = f"""[bbox:{S},{W},{N},{E}][out:json][timeout:{TIMEOUT}];
-way["highway"]; out geom;"""
-
-def fetch(url):
-    r = requests.get(url, params={"data": QUERY}, headers={"User-Agent": UA, "Accept":"application/json"}, timeout=TIMEOUT+15)
-    if r.status_code != 200:
-        r = requests.post(url, data={"data": QUERY}, headers={"User-Agent": UA, "Accept":"application/json","Content-Type":"application/x-www-form-urlencoded"}, timeout=TIMEOUT+15)
-    r.raise_for_status()
-    return r.json()
+QUERY = """[out:json][timeout:{timeout}];
+way["highway"]({bbox}); out geom;"""
 
 def main():
     Path("data").mkdir(parents=True, exist_ok=True)
-    j = fetch(URL)
-    Path("data/osm_sector.json").write_text(json.dumps({"bbox":[S,W,N,E],"elements":j.get("elements",[])}, ensure_ascii=False))
-    ways = sum(1 for e in j.get("elements",[]) if e.get("type")=="way")
+    client = from_config(cfg, args)
+    # un sector suele caber en una consulta; si no, el cliente lo parte solo
+    elements, failed = client.fetch(QUERY, [S,W,N,E], tuple(cfg.get("tiles", [1, 1])))
+    print(f"[overpass] {client.summary()}")
+    if failed:
+        print(f"[ERR] {len(failed)} teselas sin datos; vuelve a ejecutar para reanudar", file=sys.stderr)
+        sys.exit(2)
+    Path("data/osm_sector.json").write_text(json.dumps({"bbox":[S,W,N,E],"elements":elements}, ensure_ascii=False))
+    ways = sum(1 for e in elements if e.get("type")=="way")
     print(f"OK:data/osm_sector.json ways={ways} bbox=[{S},{W},{N},{E}]")
 
 if __name__=="__main__":
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Carga de GeoJSON de vías (salida de transform_osm.py) a via_arista con COPY
+# binario y upsert por hash de geometría, en vez de ogr2ogr + load_infra.sql
+# (DISTINCT ON ST_AsBinary + ST_Equals par a par).
+# - geom_hash: md5 de las coordenadas redondeadas a 1e-7° en sentido canónico
+#   (la misma calle digitalizada al revés es la misma arista).
+# - Las features repetidas entre archivos (sectores que se solapan) se saltan
+#   antes de enviarlas; las que ya están en la tabla se actualizan sólo si
+#   cambió algún atributo.
+# - Si las features traen source/target (transform_osm.py --split: id de nodo OSM)
+#   la topología sale de ahí: cada nodo reutiliza el de via_nodo con ese osm_id o un
+#   vértice existente dentro de la tolerancia (sectores cargados sin --split); los
+#   demás se agregan a via_nodo y via_arista_vertices_pgr, y las aristas quedan con
+#   source/target sin pasar por pgr_createTopology.
+#   Sin esas columnas quedan NULL y main.sh corre topology_infra_incremental.sql.
+#   python3 etl/infraestructura/load_infra.py json/infra_provi_sector*.geojson
+#   python3 etl/infraestructura/load_infra.py --dry-run json/*.geojson   # sin BD
+import argparse, hashlib, io, os, struct, sys, time
+from pathlib import Path
+import numpy as np
+import shapely
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.jsonstream import iter_array
+
+# desde el host: la BD de docker compose publica 5432 en localhost
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+DB_NAME = os.getenv("DB_NAME", "gis")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "postgres")
+
+COLUMNS = ("geom", "length_m", "osm_id", "oneway", "highway", "geom_hash", "src_node", "dst_node")
+
+LOAD_SQL = """
+CREATE TEMP TABLE via_arista_load (
+  geom geometry(LineString,4326), length_m REAL, osm_id BIGINT,
+  oneway BOOLEAN, highway TEXT, geom_hash BYTEA, src_node BIGINT, dst_node BIGINT
+) ON COMMIT DROP;
+-- nodo OSM (source/target de --split) -> id en via_nodo
+CREATE TEMP TABLE via_nodo_map (osm_id BIGINT PRIMARY KEY, id BIGINT NOT NULL) ON COMMIT DROP;
+"""
+
+# misma tolerancia (grados) que pgr_createTopology en db/load/topology_infra*.sql
+TOLERANCE = 0.00001
+
+# Nodos OSM de las aristas partidas -> via_nodo, con la regla de la topología
+# incremental: se reutiliza el nodo con ese osm_id o, si no hay, el vértice existente
+# más cercano dentro de la tolerancia (los de pgr_createTopology no traen osm_id);
+# sólo lo que queda se agrega, con ids a continuación del máximo.
+NODES_SQL = """
+CREATE TABLE IF NOT EXISTS via_nodo (
+  id BIGINT, geom geometry(Point,4326), elev_m REAL, osm_id BIGINT
+);
+CREATE INDEX IF NOT EXISTS idx_via_nodo_geom ON via_nodo USING GIST (geom);
+CREATE INDEX IF NOT EXISTS idx_via_nodo_osm ON via_nodo (osm_id);
+CREATE TEMP TABLE via_nodo_osm ON COMMIT DROP AS
+SELECT DISTINCT ON (osm_id) osm_id, geom FROM (
+  SELECT src_node AS osm_id, ST_StartPoint(geom) AS geom FROM via_arista_load WHERE src_node IS NOT NULL
+  UNION ALL
+  SELECT dst_node, ST_EndPoint(geom) FROM via_arista_load WHERE dst_node IS NOT NULL
+) x ORDER BY osm_id;
+INSERT INTO via_nodo_map (osm_id, id)
+SELECT p.osm_id, n.id
+FROM via_nodo_osm p
+CROSS JOIN LATERAL (
+  SELECT n.id FROM via_nodo n
+  WHERE n.osm_id = p.osm_id OR ST_DWithin(n.geom, p.geom, %(tol)s)
+  ORDER BY n.osm_id = p.osm_id DESC NULLS LAST, n.geom <-> p.geom, n.id
+  LIMIT 1
+) n;
+UPDATE via_nodo n SET osm_id = m.osm_id
+FROM via_nodo_map m WHERE n.id = m.id AND n.osm_id IS NULL;
+"""
+
+NEW_NODES_SQL = """
+WITH nuevos AS (
+  INSERT INTO via_nodo (id, geom, elev_m, osm_id)
+  SELECT %(base)s + row_number() OVER (ORDER BY p.osm_id), p.geom, NULL, p.osm_id
+  FROM via_nodo_osm p
+  WHERE NOT EXISTS (SELECT 1 FROM via_nodo_map m WHERE m.osm_id = p.osm_id)
+  RETURNING id, osm_id
+)
+INSERT INTO via_nodo_map (osm_id, id) SELECT osm_id, id FROM nuevos;
+"""
+
+# la topología incremental (pgr_createTopology sin clean) une extremos a
+# via_arista_vertices_pgr: todos los nodos van ahí (la tabla se crea con el esquema
+# de pgRouting si aún no existe) y su secuencia se adelanta a los ids insertados,
+# para que los vértices que agregue pgr después no choquen con ellos.
+VERTICES_SQL = """
+CREATE TABLE IF NOT EXISTS via_arista_vertices_pgr (
+  id BIGSERIAL PRIMARY KEY, cnt INTEGER, chk INTEGER, ein INTEGER, eout INTEGER,
+  the_geom geometry(Point,4326)
+);
+CREATE INDEX IF NOT EXISTS via_arista_vertices_pgr_the_geom_idx ON via_arista_vertices_pgr USING GIST (the_geom);
+INSERT INTO via_arista_vertices_pgr (id, the_geom)
+SELECT n.id, n.geom FROM via_nodo n
+WHERE NOT EXISTS (SELECT 1 FROM via_arista_vertices_pgr v WHERE v.id = n.id);
+SELECT setval(pg_get_serial_sequence('via_arista_vertices_pgr', 'id'),
+              (SELECT max(id) FROM via_arista_vertices_pgr));
+"""
+
+UPSERT_SQL = """
+INSERT INTO via_arista AS v (geom, length_m, osm_id, oneway, highway, geom_hash, source, target)
+SELECT l.geom, l.length_m, l.osm_id, l.oneway, l.highway, l.geom_hash, s.id, t.id
+FROM via_arista_load l
+LEFT JOIN via_nodo_map s ON s.osm_id = l.src_node
+LEFT JOIN via_nodo_map t ON t.osm_id = l.dst_node
+ON CONFLICT (geom_hash) DO UPDATE
+  SET length_m = EXCLUDED.length_m, osm_id = EXCLUDED.osm_id,
+      oneway = EXCLUDED.oneway, highway = EXCLUDED.highway,
+      source = coalesce(EXCLUDED.source, v.source), target = coalesce(EXCLUDED.target, v.target)
+  WHERE (v.length_m, v.osm_id, v.oneway, v.highway, v.source, v.target)
+        IS DISTINCT FROM (EXCLUDED.length_m, EXCLUDED.osm_id, EXCLUDED.oneway, EXCLUDED.highway,
+                          coalesce(EXCLUDED.source, v.source), coalesce(EXCLUDED.target, v.target))
+RETURNING (xmax = 0) AS inserted;
+"""
+
+
+def geom_hash(coords):
+    a = np.round(np.asarray(coords, dtype=np.float64)[:, :2], 7)
+    if tuple(a[-1]) < tuple(a[0]):
+        a = a[::-1]
+    return hashlib.md5(np.ascontiguousarray(a).tobytes()).digest()
+
+
+def read_rows(paths, seen, stats):
+    # -> filas (wkb, length_m, osm_id, oneway, highway, hash, nodo inicial, nodo final) sin repetidos
+    for p in paths:
+        for ft in iter_array(p, "features"):
+            g = ft.get("geometry") or {}
+            coords = g.get("coordinates") or []
+            if g.get("type") != "LineString" or len(coords) < 2:
+                stats["invalid"] += 1
+                continue
+            stats["read"] += 1
+            h = geom_hash(coords)
+            if h in seen:
+                stats["dup_input"] += 1
+                continue
+            seen.add(h)
+            pr = ft.get("properties") or {}
+            wkb = shapely.to_wkb(shapely.set_srid(shapely.linestrings(coords), 4326), include_srid=True)
+            if pr.get("source") is not None and pr.get("target") is not None:
+                stats["with_nodes"] += 1
+            yield (wkb, pr.get("length_m"), pr.get("osm_id"), pr.get("oneway"), pr.get("highway"), h,
+                   pr.get("source"), pr.get("target"))
+
+
+# --- COPY binario -------------------------------------------------------------
+
+def _field(v, kind):
+    if v is None:
+        return b"\xff\xff\xff\xff"
+    if kind == "bytes":
+        b = v
+    elif kind == "float4":
+        b = struct.pack(">f", float(v))
+    elif kind == "int8":
+        b = struct.pack(">q", int(v))
+    elif kind == "bool":
+        b = b"\x01" if v else b"\x00"
+    else:
+        b = str(v).encode("utf-8")
+    return struct.pack(">i", len(b)) + b
+
+
+KINDS = ("bytes", "float4", "int8", "bool", "text", "bytes", "int8", "int8")  # geometry viaja como EWKB
+
+
+def copy_chunks(rows, batch=5000):
+    yield b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    buf, n = [], 0
+    for row in rows:
+        buf.append(struct.pack(">h", len(row)) + b"".join(_field(v, k) for v, k in zip(row, KINDS)))
+        n += 1
+        if n == batch:
+            yield b"".join(buf)
+            buf, n = [], 0
+    buf.append(struct.pack(">h", -1))
+    yield b"".join(buf)
+
+
+class ChunkReader(io.RawIOBase):
+    # archivo de sólo lectura sobre un iterador de bytes, para copy_expert; el bloque
+    # en curso se recorre con un offset (memoryview) en vez de recortar el resto
+    def __init__(self, chunks):
+        self.chunks, self.cur, self.off = iter(chunks), memoryview(b""), 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        out = []
+        while size != 0:
+            if self.off >= len(self.cur):
+                nxt = next(self.chunks, None)
+                if nxt is None:
+                    break
+                self.cur, self.off = memoryview(nxt), 0
+            end = len(self.cur) if size < 0 else min(len(self.cur), self.off + size)
+            out.append(self.cur[self.off:end])
+            if size > 0:
+                size -= end - self.off
+            self.off = end
+        return b"".join(out)
+
+
+# --- BD -------------------------------------------------------------------------
+
+def backfill_hashes(cur):
+    # filas cargadas por el camino antiguo (ogr2ogr + load_infra.sql) sin geom_hash;
+    # si dos comparten geometría, la de menor id se queda con el hash
+    cur.execute("SELECT id, ST_AsBinary(geom) FROM via_arista WHERE geom_hash IS NULL ORDER BY id")
+    rows = cur.fetchall()
+    if not rows:
+        return 0
+    cur.execute("SELECT geom_hash FROM via_arista WHERE geom_hash IS NOT NULL")
+    taken = {bytes(h) for (h,) in cur.fetchall()}
+    geoms = shapely.from_wkb([bytes(w) for _, w in rows])
+    upd = []
+    for (i, _), g in zip(rows, geoms):
+        h = geom_hash(shapely.get_coordinates(g))
+        if h not in taken:
+            taken.add(h)
+            upd.append((i, h))
+    cur.execute("CREATE TEMP TABLE via_arista_hash (id BIGINT, geom_hash BYTEA) ON COMMIT DROP")
+    buf = io.StringIO("".join(f"{i}\t\\\\x{h.hex()}\n" for i, h in upd))
+    cur.copy_from(buf, "via_arista_hash", columns=("id", "geom_hash"))
+    cur.execute("UPDATE via_arista v SET geom_hash = t.geom_hash FROM via_arista_hash t WHERE v.id = t.id")
+    return len(upd)
+
+
+def load_nodes(cur):
+    # -> nodos agregados a via_nodo (los demás extremos reutilizan uno existente)
+    cur.execute(NODES_SQL, {"tol": TOLERANCE})
+    base = 0
+    for table in ("via_nodo", "via_arista_vertices_pgr"):
+        cur.execute(f"SELECT to_regclass('{table}') IS NOT NULL")
+        if cur.fetchone()[0]:
+            cur.execute(f"SELECT coalesce(max(id), 0) FROM {table}")
+            base = max(base, cur.fetchone()[0])
+    cur.execute(NEW_NODES_SQL, {"base": base})
+    added = cur.rowcount
+    cur.execute(VERTICES_SQL)
+    return added
+
+
+def load(conn, paths, stats):
+    with conn.cursor() as cur:
+        backfilled = backfill_hashes(cur)
+        cur.execute(LOAD_SQL)
+        rows = read_rows(paths, set(), stats)
+        cur.copy_expert(f"COPY via_arista_load ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT binary)",
+                        ChunkReader(copy_chunks(rows)))
+        stats["nodes"] = load_nodes(cur) if stats["with_nodes"] else 0
+        cur.execute(UPSERT_SQL)
+        res = [r[0] for r in cur.fetchall()]
+        cur.execute("SELECT count(*) FROM via_arista WHERE source IS NULL OR target IS NULL")
+        stats["no_topology"] = cur.fetchone()[0]
+    stats["inserted"] = sum(res)
+    stats["updated"] = len(res) - stats["inserted"]
+    stats["unchanged"] = stats["read"] - stats["dup_input"] - len(res)
+    stats["backfilled"] = backfilled
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paths", nargs="+", help="GeoJSON de vías (LineString)")
+    ap.add_argument("--dry-run", action="store_true", help="sólo leer y deduplicar, sin BD")
+    args = ap.parse_args()
+    paths = [p for p in args.paths if Path(p).is_file() and Path(p).stat().st_size > 0]
+    stats = {"read": 0, "dup_input": 0, "invalid": 0, "with_nodes": 0}
+    t0 = time.perf_counter()
+    if args.dry_run:
+        nbytes = sum(len(c) for c in copy_chunks(read_rows(paths, set(), stats)))
+        print(f"[dry-run] archivos={len(paths)} leídas={stats['read']} repetidas={stats['dup_input']} "
+              f"inválidas={stats['invalid']} con_source_target={stats['with_nodes']} copy={nbytes/1e6:.1f}MB t={time.perf_counter()-t0:.1f}s")
+        return
+    import psycopg2
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+    try:
+        with conn:
+            load(conn, paths, stats)
+    finally:
+        conn.close()
+    print(f"[infra] archivos={len(paths)} leídas={stats['read']} insertadas={stats['inserted']} "
+          f"actualizadas={stats['updated']} saltadas={stats['dup_input'] + stats['unchanged']} "
+          f"(repetidas_en_entrada={stats['dup_input']} sin_cambios={stats['unchanged']}) "
+          f"inválidas={stats['invalid']} hash_rellenados={stats['backfilled']} "
+          f"nodos_nuevos={stats['nodes']} sin_topologia={stats['no_topology']} t={time.perf_counter()-t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
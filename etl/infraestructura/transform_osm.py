@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Overpass JSON (ways con geometry) -> GeoJSON de vías, en streaming: los
+# elementos se leen de a uno, el largo de cada way se calcula en Python (vectorizado
+# sólo en ways largos) y cada Feature se escribe apenas se produce.
+# Con --split los ways se cortan en los nodos OSM compartidos (y en sus extremos),
+# así cada Feature ya es una arista con source/target: id del nodo OSM, o si el
+# JSON no trae "nodes", un id estable (negativo) derivado de la coordenada.
+#   python3 etl/infraestructura/transform_osm.py --src data/osm_sector.json --out json/infra_provi_sector.geojson [--split]
+import argparse, hashlib, json, struct, sys
+from collections import Counter
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.geo import haversine_cum_m, haversine_seg_m
+from etl.utils.jsonstream import iter_array
+
+ONEWAY_TRUE = ("yes", "1", "true")
+LONG_WAY = 64   # vértices desde los que conviene NumPy para el largo
+
+
+def iter_ways(src):
+    for w in iter_array(src, "elements"):
+        if w.get("type") != "way":
+            continue
+        g = w.get("geometry") or []
+        if len(g) < 2:
+            continue
+        yield w, g
+
+
+def coord_id(lat, lon):
+    # id de vértice cuando no hay id de nodo OSM: hash de la coordenada a 1e-7°
+    h = hashlib.blake2b(struct.pack("<qq", round(lat * 1e7), round(lon * 1e7)), digest_size=8).digest()
+    return -(int.from_bytes(h, "little") & ((1 << 62) - 1)) - 1
+
+
+def vertex_ids(w, g):
+    nodes = w.get("nodes")
+    if nodes and len(nodes) == len(g):
+        return nodes
+    return [coord_id(p["lat"], p["lon"]) for p in g]
+
+
+def count_nodes(src):
+    # primera pasada (sólo con --split): cuántas veces aparece cada vértice
+    c = Counter()
+    for w, g in iter_ways(src):
+        c.update(vertex_ids(w, g))
+    return c
+
+
+def features(src, split=False):
+    uses = count_nodes(src) if split else None
+    eid = 1
+    for w, g in iter_ways(src):
+        tags = w.get("tags", {})
+        lat = [p["lat"] for p in g]
+        lon = [p["lon"] for p in g]
+        if len(g) < LONG_WAY:
+            cum = haversine_cum_m(lat, lon)
+        else:
+            cum = np.concatenate(([0.0], np.cumsum(haversine_seg_m(lat, lon)))).tolist()
+        base = {"osm_id": w.get("id"), "highway": tags.get("highway"),
+                "oneway": tags.get("oneway") in ONEWAY_TRUE}
+        if not split:
+            cuts = [(0, len(g) - 1)]
+        else:
+            vids = vertex_ids(w, g)
+            at = [0] + [k for k in range(1, len(g) - 1) if uses[vids[k]] > 1] + [len(g) - 1]
+            cuts = list(zip(at[:-1], at[1:]))
+        for seq, (i, j) in enumerate(cuts):
+            props = {"id": eid, **base, "length_m": round(cum[j] - cum[i], 2)}
+            if split:
+                props.update(seq=seq, source=vids[i], target=vids[j])
+            coords = [[x, y] for x, y in zip(lon[i:j + 1], lat[i:j + 1])]
+            yield {"type": "Feature", "geometry": {"type": "LineString", "coordinates": coords},
+                   "properties": props}
+            eid += 1
+
+
+def write_fc(feats, out, name=None):
+    # FeatureCollection escrito incrementalmente ("features" al final)
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    head = {"type": "FeatureCollection"}
+    if name:
+        head["name"] = name
+    head["crs"] = {"type": "name", "properties": {"name": "EPSG:4326"}}
+    n = 0
+    with open(out, "w", encoding="utf-8") as f:
+        f.write(json.dumps(head, ensure_ascii=False)[:-1] + ', "features": [')
+        for ft in feats:
+            f.write(("," if n else "") + "\n" + json.dumps(ft, ensure_ascii=False))
+            n += 1
+        f.write("\n]}\n")
+    return n
+
+
+def transform(src, out, name=None, split=False):
+    n = write_fc(features(src, split), out, name)
+    print(f"OK:{out} features={n}{' (aristas partidas en nodos compartidos)' if split else ''}")
+    return n
+
+
+def main(src=None, out=None, name=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src", default=src or "data/osm_sector.json")
+    ap.add_argument("--out", default=out or "json/infra_provi_sector.geojson")
+    ap.add_argument("--name", default=name)
+    ap.add_argument("--split", action="store_true", help="cortar ways en nodos compartidos (lista de aristas ruteable)")
+    args = ap.parse_args()
+    transform(args.src, args.out, args.name, args.split)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,34 @@
 #!/usr/bin/env python3
-import json
+# Bebederos desde el PDF municipal: detección por color + afín con puntos de control.
+# Modo por teselas (por defecto): cada página se renderiza en rectángulos con
+# solape (clip de PyMuPDF sobre la display list), los colores se clasifican con
+# una sola consulta vectorizada a tablas por canal, los blobs se etiquetan por
+# tesela y se unen a través de las costuras; las teselas de todas las páginas se
+# reparten en un pool de procesos. El tamaño de tesela sale de max_mem_mb.
+#   python3 etl/metadata/bebederos/extract_bebederos_from_pdf.py [--full] [--debug-png] [--check]
+import argparse, json, math, os, resource, sys, time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
 from pathlib import Path
 import numpy as np
 import yaml, fitz
 from PIL import Image
+from scipy.ndimage import find_objects
 from skimage.measure import label, regionprops
-from skimage.morphology import dilation, square
+from skimage.morphology import dilation
+try:
+    from skimage.morphology import footprint_rectangle
+    def _footprint(k): return footprint_rectangle((k, k))
+except ImportError:
+    from skimage.morphology import square as _footprint
 
 CFG = yaml.safe_load(Path("etl/metadata/bebederos/bebederos_config.yaml").read_text())
 CPTS_PATH = Path("etl/metadata/bebederos/control_points.yaml")
 CPTS = yaml.safe_load(CPTS_PATH.read_text()) if CPTS_PATH.exists() else {"control_points":[]}
 
+# bytes por píxel de tesela en un worker: RGB + máscaras + etiquetas + temporales
+BYTES_PER_PX = 40
+
 def pdf_to_image(pdf_path, page_index, dpi):
     doc = fitz.open(pdf_path)
     page = doc.load_page(page_index)
@@ -43,41 +61,283 @@ def mask_by_colors(arr, ranges):
         m |= np.all((arr>=mn)&(arr<=mx),axis=2)
     return m
 
-def main():
-    # Render PDF
-    img = pdf_to_image(CFG["pdf_path"], int(CFG.get("page_index",0)), int(CFG.get("dpi",200)))
-    Path("data").mkdir(parents=True, exist_ok=True)
-    Image.fromarray(np.asarray(img)).save("data/bebederos_render.png")
+def color_tables(ranges):
+    # bit r de t[canal][valor] = el valor cae en el rango r de ese canal;
+    # un píxel es bebedero si algún bit sobrevive al AND de sus tres canales
+    assert len(ranges) <= 64, "máximo 64 rangos de color"
+    t = np.zeros((3, 256), dtype=np.uint64)
+    for r, rg in enumerate(ranges):
+        for c in range(3):
+            t[c, int(rg["min"][c]):int(rg["max"][c])+1] |= np.uint64(1 << r)
+    return t
 
-    # Affín con control points
-    pairs=[]
-    for p in CPTS.get("control_points",[]):
-        (x,y)=p["px"]; (lon,lat)=p["ll"]
-        pairs.append(((float(x),float(y)),(float(lon),float(lat))))
-    if len(pairs)<3:
-        raise SystemExit("ERROR: define >=3 puntos en etl/metadata/bebederos/control_points.yaml")
+def classify(arr, t):
+    # equivalente a mask_by_colors en una pasada
+    return (t[0][arr[...,0]] & t[1][arr[...,1]] & t[2][arr[...,2]]) != 0
 
-    M = build_affine(pairs)
+# --- detección de referencia (página completa en memoria) ----------------------
 
-    # Detección por color
+def detect_full(pdf_path, page_index, dpi, debug_png=None):
+    # -> [(area, fila, col, bbox)] como antes: máscara, dilatación y label sobre el frame entero
+    img = pdf_to_image(pdf_path, page_index, dpi)
+    if debug_png:
+        img.save(debug_png)
     arr = np.asarray(img)
     mask = mask_by_colors(arr, CFG["color_ranges"])
     if int(CFG.get("dilate_px",0))>0:
-        mask = dilation(mask, square(int(CFG["dilate_px"])))
-    lbl = label(mask)
+        mask = dilation(mask, _footprint(int(CFG["dilate_px"])))
+    return [(int(reg.area), *reg.centroid, tuple(int(v) for v in reg.bbox))
+            for reg in regionprops(label(mask))]
 
-    feats=[]
-    for reg in regionprops(lbl):
-        if reg.area < int(CFG.get("min_area_px",10)): 
+# --- modo por teselas ------------------------------------------------------------
+
+_W = {}  # estado del worker (fork): pdf, dpi, tablas, dilatación; doc/display lists abiertos
+
+def _init_worker(state):
+    _W.clear()
+    _W.update(state)
+
+def _display_list(page_index):
+    if "doc" not in _W:
+        _W["doc"], _W["dl"] = fitz.open(_W["pdf"]), {}
+    if page_index not in _W["dl"]:
+        _W["dl"][page_index] = _W["doc"].load_page(page_index).get_displaylist()
+    return _W["dl"][page_index]
+
+def page_size_px(doc, page_index, dpi):
+    s = dpi / 72
+    r = (doc.load_page(page_index).rect * fitz.Matrix(s, s)).irect
+    return r.height, r.width
+
+def tile_tasks(H, W, tile_px, margin):
+    # núcleos que particionan la página + región renderizada con solape
+    out = []
+    ny, nx = math.ceil(H / tile_px), math.ceil(W / tile_px)
+    for ty in range(ny):
+        for tx in range(nx):
+            r0, c0 = ty * tile_px, tx * tile_px
+            r1, c1 = min(H, r0 + tile_px), min(W, c0 + tile_px)
+            out.append(((ty, tx), (r0, r1, c0, c1),
+                        (max(0, r0 - margin), min(H, r1 + margin), max(0, c0 - margin), min(W, c1 + margin))))
+    return out
+
+def _tile_worker(args):
+    page_index, key, core, ext = args
+    r0, r1, c0, c1 = core
+    e0, e1, f0, f1 = ext
+    s = _W["dpi"] / 72
+    pix = _display_list(page_index).get_pixmap(matrix=fitz.Matrix(s, s), clip=fitz.Rect(f0/s, e0/s, f1/s, e1/s), alpha=False)
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    # el irect del clip puede diferir en un píxel: se recorta/rellena a la región pedida
+    buf = np.zeros((e1 - e0, f1 - f0, 3), dtype=np.uint8)
+    y0, x0 = pix.y - e0, pix.x - f0
+    h, w = min(pix.height, buf.shape[0] - y0), min(pix.width, buf.shape[1] - x0)
+    buf[max(0, y0):y0 + h, max(0, x0):x0 + w] = arr[max(0, -y0):h, max(0, -x0):w, :3]
+    del pix, arr
+    mask = classify(buf, _W["tables"])
+    del buf
+    if _W["dilate"] > 0:
+        mask = dilation(mask, _footprint(_W["dilate"]))
+    lbl = label(mask[r0 - e0:r1 - e0, c0 - f0:c1 - f0], connectivity=2).astype(np.int32)
+    del mask
+    n = int(lbl.max())
+    flat = lbl.ravel()
+    rows, cols = np.divmod(np.arange(flat.size), lbl.shape[1])
+    on = flat > 0
+    lab = flat[on]
+    area = np.bincount(lab, minlength=n + 1)[1:]
+    sum_r = np.bincount(lab, weights=rows[on] + r0, minlength=n + 1)[1:]
+    sum_c = np.bincount(lab, weights=cols[on] + c0, minlength=n + 1)[1:]
+    _, first = np.unique(lab, return_index=True)  # primer píxel en orden de barrido
+    first = np.flatnonzero(on)[first]
+    bbox = np.zeros((n, 4), dtype=np.int64)
+    for i, sl in enumerate(find_objects(lbl)):
+        bbox[i] = (sl[0].start + r0, sl[1].start + c0, sl[0].stop + r0, sl[1].stop + c0)
+    edges = (lbl[0].copy(), lbl[-1].copy(), lbl[:, 0].copy(), lbl[:, -1].copy())
+    first_rc = np.column_stack(((first // lbl.shape[1]) + r0, (first % lbl.shape[1]) + c0))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return page_index, key, (area, sum_r, sum_c, bbox, first_rc), edges, peak
+
+def merge_tiles(results):
+    # une blobs de teselas vecinas (8-conectividad, incluidas las esquinas)
+    # -> [(area, fila, col, bbox)] en el orden de regionprops (primer píxel)
+    base, off = {}, 0
+    for key, (st, _) in sorted(results.items()):
+        base[key] = off
+        off += len(st[0])
+    parent = np.arange(off)
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    def union(a, b):
+        a, b = find(a), find(b)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    def link(ka, va, kb, vb, shifts):
+        for s in shifts:
+            if s >= 0:
+                x, y = va[:len(va) - s] if s else va, vb[s:]
+            else:
+                x, y = va[-s:], vb[:len(vb) + s]
+            m = min(len(x), len(y))
+            x, y = x[:m], y[:m]
+            both = (x > 0) & (y > 0)
+            for a, b in zip(x[both].tolist(), y[both].tolist()):
+                union(base[ka] + a - 1, base[kb] + b - 1)
+
+    for (ty, tx), (_, ed) in results.items():
+        top, bottom, left, right = ed
+        if (ty, tx + 1) in results:      # costura vertical
+            link((ty, tx), right, (ty, tx + 1), results[(ty, tx + 1)][1][2], (-1, 0, 1))
+        if (ty + 1, tx) in results:      # costura horizontal
+            link((ty, tx), bottom, (ty + 1, tx), results[(ty + 1, tx)][1][0], (-1, 0, 1))
+        if (ty + 1, tx + 1) in results:  # esquina diagonal
+            d = results[(ty + 1, tx + 1)][1][0]
+            if bottom[-1] > 0 and d[0] > 0:
+                union(base[(ty, tx)] + bottom[-1] - 1, base[(ty + 1, tx + 1)] + d[0] - 1)
+        if (ty + 1, tx - 1) in results:  # esquina antidiagonal
+            d = results[(ty + 1, tx - 1)][1][0]
+            if bottom[0] > 0 and d[-1] > 0:
+                union(base[(ty, tx)] + bottom[0] - 1, base[(ty + 1, tx - 1)] + d[-1] - 1)
+
+    if not off:
+        return []
+    st = [results[k][0] for k in sorted(results)]
+    area = np.concatenate([s[0] for s in st]).astype(np.int64)
+    sum_r = np.concatenate([s[1] for s in st])
+    sum_c = np.concatenate([s[2] for s in st])
+    bbox = np.concatenate([s[3] for s in st])
+    first = np.concatenate([s[4] for s in st])
+    root = np.array([find(i) for i in range(off)])
+    blobs = {}
+    for i, rt in enumerate(root.tolist()):
+        b = blobs.get(rt)
+        if b is None:
+            blobs[rt] = [area[i], sum_r[i], sum_c[i], list(bbox[i]), tuple(first[i])]
             continue
-        y,x = reg.centroid  # (fila,col)
-        lon,lat = apply_affine(M, float(x), float(y))
-        feats.append({
-            "type":"Feature",
-            "geometry":{"type":"Point","coordinates":[lon,lat]},
-            "properties":{"fuente":"pdf_providencia_affine",
-                          "attrs":{"area_px":int(reg.area),"bbox_px":[int(v) for v in reg.bbox]}}
-        })
+        b[0] += area[i]; b[1] += sum_r[i]; b[2] += sum_c[i]
+        b[3] = [min(b[3][0], bbox[i][0]), min(b[3][1], bbox[i][1]), max(b[3][2], bbox[i][2]), max(b[3][3], bbox[i][3])]
+        b[4] = min(b[4], tuple(first[i]))
+    out = sorted(blobs.values(), key=lambda b: b[4])
+    return [(int(a), sr / a, sc / a, tuple(int(v) for v in bb)) for a, sr, sc, bb, _ in out]
+
+def detect_tiled(pdf_path, pages, dpi, workers, max_mem_mb, tile_px=None):
+    # -> ({página: [(area, fila, col, bbox)]}, info de memoria/teselas)
+    dil = int(CFG.get("dilate_px", 0))
+    margin = dil + 1
+    if not tile_px:
+        tile_px = int(math.sqrt(max_mem_mb * 2**20 / (workers * BYTES_PER_PX))) - 2 * margin
+    tile_px = max(64, tile_px)
+    doc = fitz.open(pdf_path)
+    tasks = []
+    for p in pages:
+        H, W = page_size_px(doc, p, dpi)
+        tasks += [(p, key, core, ext) for key, core, ext in tile_tasks(H, W, tile_px, margin)]
+    doc.close()
+    state = {"pdf": str(pdf_path), "dpi": dpi, "tables": color_tables(CFG["color_ranges"]), "dilate": dil}
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(workers, mp_context=mp.get_context("fork"),
+                                 initializer=_init_worker, initargs=(state,)) as ex:
+            res = list(ex.map(_tile_worker, tasks, chunksize=1))
+    else:
+        _init_worker(state)
+        res = [_tile_worker(t) for t in tasks]
+    by_page = {p: {} for p in pages}
+    peak = 0
+    for p, key, st, edges, pk in res:
+        by_page[p][key] = (st, edges)
+        peak = max(peak, pk)
+    info = {"tile_px": tile_px, "tiles": len(tasks), "peak_worker_mb": peak / 1024}
+    return {p: merge_tiles(r) for p, r in by_page.items()}, info
+
+def write_debug_png(pdf_path, page_index, dpi, path):
+    # vista previa a baja resolución (el render completo a `dpi` puede no caber en memoria)
+    pdf_to_image(pdf_path, page_index, min(dpi, int(CFG.get("debug_dpi", 72)))).save(path)
+
+def compare(ref, got, tol_px=2.0):
+    # blobs emparejados por centroide; el clip por teselas remuestrea la imagen
+    # escaneada y puede mover algún píxel de borde de color
+    used, bad = set(), 0
+    for a, r, c, _ in ref:
+        best = None
+        for j, (a2, r2, c2, _) in enumerate(got):
+            d = math.hypot(r - r2, c - c2)
+            if j not in used and d <= tol_px and (best is None or d < best[0]):
+                best = (d, j)
+        if best is None:
+            bad += 1
+        else:
+            used.add(best[1])
+    return bad, len(got) - len(used)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--full", action="store_true", help="página completa en memoria (modo anterior)")
+    ap.add_argument("--debug-png", action="store_true", help="escribir data/bebederos_render.png")
+    ap.add_argument("--check", action="store_true", help="comparar teselas contra la página completa")
+    ap.add_argument("--workers", type=int, default=int(CFG.get("workers", min(4, os.cpu_count() or 1))))
+    ap.add_argument("--tile-px", type=int, default=int(CFG.get("tile_px", 0)))
+    args = ap.parse_args()
+    pdf, dpi = CFG["pdf_path"], int(CFG.get("dpi",200))
+    pages = CFG.get("pages") or [int(CFG.get("page_index",0))]
+    max_mem_mb = float(CFG.get("max_mem_mb", 512))
+    Path("data").mkdir(parents=True, exist_ok=True)
+
+    # Affín con control points (opcionalmente por página: `page`)
+    affines = {}
+    for pg in pages:
+        pairs=[]
+        for p in CPTS.get("control_points",[]):
+            if int(p.get("page", pages[0])) != pg:
+                continue
+            (x,y)=p["px"]; (lon,lat)=p["ll"]
+            pairs.append(((float(x),float(y)),(float(lon),float(lat))))
+        if len(pairs)<3:
+            raise SystemExit(f"ERROR: define >=3 puntos (página {pg}) en etl/metadata/bebederos/control_points.yaml")
+        affines[pg] = (build_affine(pairs), pairs)
+
+    # Detección por color
+    t0 = time.perf_counter()
+    if args.full:
+        blobs = {pg: detect_full(pdf, pg, dpi, "data/bebederos_render.png" if args.debug_png and pg == pages[0] else None)
+                 for pg in pages}
+        info = None
+    else:
+        blobs, info = detect_tiled(pdf, pages, dpi, args.workers, max_mem_mb, args.tile_px)
+        if args.debug_png:
+            write_debug_png(pdf, pages[0], dpi, "data/bebederos_render.png")
+    t_det = time.perf_counter() - t0
+
+    if args.check:
+        bad = 0
+        for pg in pages:
+            ref = detect_full(pdf, pg, dpi) if not args.full else blobs[pg]
+            got = detect_tiled(pdf, [pg], dpi, args.workers, max_mem_mb, args.tile_px)[0][pg]
+            miss, extra = compare(ref, got)
+            print(f"[check] página={pg} blobs_ref={len(ref)} blobs_teselas={len(got)} sin_par={miss} sobrantes={extra}")
+            bad += miss + extra
+        sys.exit(1 if bad else 0)
+
+    feats=[]
+    for pg in pages:
+        M, _ = affines[pg]
+        for area, y, x, bbox in blobs[pg]:
+            if area < int(CFG.get("min_area_px",10)):
+                continue
+            lon,lat = apply_affine(M, float(x), float(y))
+            attrs = {"area_px":int(area),"bbox_px":[int(v) for v in bbox]}
+            if len(pages) > 1:
+                attrs["page"] = pg
+            feats.append({
+                "type":"Feature",
+                "geometry":{"type":"Point","coordinates":[lon,lat]},
+                "properties":{"fuente":"pdf_providencia_affine","attrs":attrs}
+            })
 
     # Export GeoJSON final y debug de CP
     Path("json").mkdir(parents=True, exist_ok=True)
@@ -86,14 +346,23 @@ def main():
                     "crs":{"type":"name","properties":{"name":"EPSG:4326"}}}, ensure_ascii=False)
     )
     dbg=[]
-    for (x,y),(lon,lat) in pairs:
-        dbg.append({"type":"Feature","geometry":{"type":"Point","coordinates":[lon,lat]},
-                    "properties":{"name":f"CP ({int(x)},{int(y)})"}})
+    for pg in pages:
+        for (x,y),(lon,lat) in affines[pg][1]:
+            dbg.append({"type":"Feature","geometry":{"type":"Point","coordinates":[lon,lat]},
+                        "properties":{"name":f"CP ({int(x)},{int(y)})"}})
     Path("json/metadata_bebederos_controlpoints.geojson").write_text(
         json.dumps({"type":"FeatureCollection","features":dbg,
                     "crs":{"type":"name","properties":{"name":"EPSG:4326"}}}, ensure_ascii=False)
     )
-    print(f"OK json/metadata_bebederos.geojson features={len(feats)} CP={len(dbg)}")
+    peak_main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    mem = f"pico_principal={peak_main:.0f}MB"
+    if info:
+        mem += (f" pico_worker={info['peak_worker_mb']:.0f}MB tope={max_mem_mb:.0f}MB "
+                f"teselas={info['tiles']} tile_px={info['tile_px']} workers={args.workers}")
+        if info["peak_worker_mb"] * args.workers > max_mem_mb:
+            print(f"[WARN] pico estimado {info['peak_worker_mb']*args.workers:.0f}MB sobre max_mem_mb; "
+                  f"baja workers o tile_px", file=sys.stderr)
+    print(f"OK json/metadata_bebederos.geojson features={len(feats)} CP={len(dbg)} t={t_det:.1f}s {mem}")
 
 if __name__=="__main__":
     main()
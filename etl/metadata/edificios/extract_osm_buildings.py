@@ -1,20 +1,21 @@
 #!/usr/bin/env python3
-import requests, json, math
+import argparse, json, math, sys
 from pathlib import Path
 import yaml
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))  # raíz del repo, para etl.utils
+from etl.utils.overpass import from_config, add_cli_args
+
 CFG = yaml.safe_load(Path("etl/metadata/edificios/buildings_config.yaml").read_text())
 S,W,N,E   = CFG["bbox"]
-URL       = CFG["overpass_url"]
-TIMEOUT   = int(CFG.get("timeout_s",180))
 LV_H      = float(CFG.get("default_level_h",3.2))
 LV_DEF    = int(CFG.get("default_levels",5))
 
-QL = f"""
-[out:json][timeout:120];
+QL = """
+[out:json][timeout:{timeout}];
 (
-  way["building"]({S},{W},{N},{E});
-  relation["building"]({S},{W},{N},{E});
+  way["building"]({bbox});
+  relation["building"]({bbox});
 );
 out tags geom;
 """
@@ -41,11 +42,17 @@ def geom_to_polygon(el):
     return [coords]
 
 def main():
-    r = requests.post(URL, data={"data":QL}, timeout=TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
+    ap = argparse.ArgumentParser()
+    add_cli_args(ap)
+    args = ap.parse_args()
+    client = from_config(CFG, args)
+    elements, failed = client.fetch(QL, [S,W,N,E], tuple(CFG.get("tiles", [2, 2])))
+    print(f"[overpass] {client.summary()}")
+    if failed:
+        print(f"[ERR] {len(failed)} teselas sin datos; vuelve a ejecutar para reanudar", file=sys.stderr)
+        sys.exit(2)
     feats=[]
-    for el in data.get("elements",[]):
+    for el in elements:
         if el.get("type") not in ("way","relation"): continue
         poly = geom_to_polygon(el)
         if not poly: continue
@@ -1,14 +1,21 @@
 #!/usr/bin/env python3
-import json, math, sys
+import argparse, hashlib, json, math, os, sys, time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
+import shapely
 import yaml
 from shapely.geometry import shape, mapping, Polygon, MultiPolygon, LineString, MultiLineString
-from shapely.affinity import translate
-from shapely.ops import unary_union, transform as shp_transform
-from pyproj import Transformer, CRS
+from pyproj import Transformer
 from astral import Observer
 from astral.sun import azimuth as sun_azimuth, elevation as sun_elevation
+from shadow_cache import ShadowCache
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))  # raíz del repo, para etl.utils
+from etl.utils.proj import reproject, transformer
 
 # Config
 CFG = yaml.safe_load(Path("etl/sombra/sombra_config.yaml").read_text())
@@ -20,6 +27,16 @@ B_GJ = Path(CFG["buildings_geojson"])
 INFRA_FILES = [Path(p) for p in CFG["infra_files"]]
 OUT_SHADOWS = Path(CFG["shadows_geojson"])
 OUT_SHADED  = Path(CFG["shaded_roads_geojson"])
+# Serie temporal (--series): zona horaria de las horas dadas y salida compacta
+TZ = ZoneInfo(CFG.get("timezone", "America/Santiago"))
+OUT_SERIES = Path(CFG.get("series_npz", "data/sombra_serie.npz"))
+# Paralelismo: teselas cuadradas de tile_m metros repartidas en `workers` procesos
+TILE_M = float(CFG.get("tile_m", 1000))
+WORKERS = int(CFG.get("workers") or os.cpu_count() or 1)
+# Caché de sombras por edificio (ver shadow_cache.py); el sol se cuantiza a baldes de sun_bucket_deg
+CACHE_DIR = CFG.get("shadow_cache_dir")
+CACHE_MB = float(CFG.get("shadow_cache_mb", 512))
+SUN_BUCKET_DEG = float(CFG.get("sun_bucket_deg", 0.25))
 
 def read_fc(p: Path):
     if not p.exists():
@@ -29,36 +46,13 @@ def read_fc(p: Path):
     except Exception as e:
         print(f"[ERR] JSON inválido: {p}: {e}", file=sys.stderr); sys.exit(2)
 
-def proj_forward(geom, fwd: Transformer):
-    # (lon,lat) -> (X,Y)
-    return shp_transform(lambda x, y: fwd.transform(x, y), geom)
-
-def proj_inverse(geom, inv: Transformer):
-    # (X,Y) -> (lon,lat)
-    return shp_transform(lambda x, y: inv.transform(x, y), geom)
-
 def ensure_poly(g):
     if g.geom_type == "Polygon": return [g]
     if g.geom_type == "MultiPolygon": return list(g.geoms)
     return []
 
-def main():
-    # Proyecciones
-    wgs84 = CRS.from_epsg(4326)
-    utm   = CRS.from_epsg(EPSG)
-    fwd = Transformer.from_crs(wgs84, utm, always_xy=True)   # lon,lat -> X,Y
-    inv = Transformer.from_crs(utm, wgs84, always_xy=True)   # X,Y -> lon,lat
-
-    # Sol a las 12:00 local (según config)
-    obs = Observer(latitude=LAT, longitude=LON)
-    elev = sun_elevation(obs, DT)           # grados sobre el horizonte
-    azim = sun_azimuth(obs, DT) % 360.0     # grados desde el Norte, sentido horario
-    if elev <= 0:
-        print(f"[WARN] Altitud solar <= 0 ({elev:.2f}°). Sombras muy largas o sin sol.", file=sys.stderr)
-    alt_rad = math.radians(max(elev, 1.0))  # evita tangente infinita
-    az_move_rad = math.radians((azim + 180.0) % 360.0)  # vector opuesto al sol
-
-    # Edificios con height_m
+def load_buildings(fwd: Transformer):
+    # Edificios con height_m, en UTM: [(geom, h)]
     b = read_fc(B_GJ)
     buildings = []
     for f in b.get("features", []):
@@ -81,8 +75,11 @@ def main():
         buildings.append((g, h))
     if not buildings:
         print("[ERR] No hay edificios con height_m válido en metadata_edificios.geojson", file=sys.stderr); sys.exit(2)
+    b_utm = reproject([g for g, _ in buildings], fwd)
+    return [(g, h) for g, (_, h) in zip(b_utm, buildings)]
 
-    # Infraestructura (líneas)
+def load_roads(fwd: Transformer):
+    # Infraestructura (líneas): [(geom UTM, geom WGS84, props)]
     roads=[]
     for p in INFRA_FILES:
         if not p.exists():
@@ -95,50 +92,167 @@ def main():
             g = shape(geom)
             if g.is_empty: continue
             if g.geom_type in ("LineString","MultiLineString"):
-                roads.append(g)
+                roads.append((g, f.get("properties") or {}))
     if not roads:
         print("[ERR] No hay vías en los GeoJSON de infraestructura", file=sys.stderr); sys.exit(2)
+    r_utm = reproject([g for g, _ in roads], fwd)
+    return [(gu, g, props) for gu, (g, props) in zip(r_utm, roads)]
 
-    # A UTM
-    b_utm = [(proj_forward(g, fwd), h) for g,h in buildings]
-    r_utm = [proj_forward(g, fwd) for g in roads]
-
-    # Sombras (trasladar footprint una distancia d = h / tan(alt), contra el sol)
-    tan_alt = math.tan(alt_rad)
-    sinA, cosA = math.sin(az_move_rad), math.cos(az_move_rad)
-
-    shadows=[]
-    for poly_wgs, h in b_utm:
-        for poly in ensure_poly(poly_wgs):
-            d  = h / tan_alt
-            dx = d * sinA
-            dy = d * cosA
-            moved = translate(poly, xoff=dx, yoff=dy)
-            hull  = poly.union(moved).convex_hull
-            shadows.append(hull)
-
-    if not shadows:
-        print("[ERR] No se generaron sombras", file=sys.stderr); sys.exit(2)
+# --- Motor ------------------------------------------------------------------
+# Una sombra (convex hull) por edificio, en bloque con shapely 2. Cada vía se
+# consulta contra un STRtree de esas sombras y se interseca sólo con la unión de
+# sus candidatas; el trabajo se reparte en teselas en un pool de procesos (fork:
+# los workers heredan sombras, vías y árbol sin serializarlos). La unión de
+# sombras para sombra_poligonos.geojson se arma por tesela (recortada a la
+# tesela) y se junta al final como una cobertura sin solapes.
+
+def building_arrays(b_utm):
+    # polígonos (multipolígonos separados) y su altura, como arreglos shapely
+    geoms = np.array([g for g, _ in b_utm], dtype=object)
+    h = np.array([h for _, h in b_utm], dtype=np.float64)
+    parts, idx = shapely.get_parts(geoms, return_index=True)
+    keep = shapely.get_type_id(parts) == 3  # Polygon
+    return parts[keep], h[idx[keep]]
+
+def shadow_hulls(polys, heights, elev, azim):
+    # hull(footprint ∪ footprint trasladado h/tan(alt) contra el sol) por edificio
+    d = heights / math.tan(math.radians(max(elev, 1.0)))
+    a = math.radians((azim + 180.0) % 360.0)
+    coords, idx = shapely.get_coordinates(polys, return_index=True)
+    moved = coords + np.column_stack((d * math.sin(a), d * math.cos(a)))[idx]
+    pts_idx = np.concatenate((idx, idx))
+    order = np.argsort(pts_idx, kind="stable")
+    pts = shapely.multipoints(np.vstack((coords, moved))[order], indices=pts_idx[order])
+    return shapely.convex_hull(pts)
+
+def cached_hulls(polys, heights, keys, elev, azim, cache):
+    # -> (sombras, elevación, azimut usados). Con caché el sol se lleva al centro de
+    # su balde y sólo se calculan los edificios sin acierto (nuevos o cambiados).
+    if cache is None:
+        return shadow_hulls(polys, heights, elev, azim), elev, azim
+    bucket, elev, azim = cache.bucket(elev, azim)
+    hulls = cache.get(bucket, keys)
+    miss = np.flatnonzero(np.array([h is None for h in hulls], dtype=bool))
+    if len(miss):
+        hulls[miss] = shadow_hulls(polys[miss], heights[miss], elev, azim)
+        cache.put(bucket, keys, hulls)
+    return hulls, elev, azim
+
+def open_cache(args, polys, heights):
+    if args.no_cache or not CACHE_DIR:
+        return None, None
+    cache = ShadowCache(CACHE_DIR, CACHE_MB, SUN_BUCKET_DEG)
+    return cache, ShadowCache.keys(polys, heights)
+
+_W = {}  # estado del worker (hulls, roads, tree, ...); con fork se hereda
 
-    shadow_union = unary_union(shadows)
+def _init_worker(state):
+    _W.update(state)
+    if "hulls" in state:
+        _W["tree"] = shapely.STRtree(state["hulls"])
 
-    # Intersecar con vías
-    shaded=[]
-    for ln in r_utm:
+def shade_roads(idx):
+    # -> ([(índice de vía, intersección)], errores) para las vías `idx`
+    hulls, roads, tree = _W["hulls"], _W["roads"], _W["tree"]
+    r, h = tree.query(roads[idx], predicate="intersects")
+    out, errors = [], 0
+    if not len(r):
+        return out, errors
+    cut = np.flatnonzero(np.diff(r)) + 1
+    for rr, hh in zip(np.split(r, cut), np.split(h, cut)):
+        i = int(idx[rr[0]])
         try:
-            if ln.intersects(shadow_union):
-                inter = ln.intersection(shadow_union)
-                if inter.is_empty:
-                    continue
-                # Simplificación ligera para aligerar el GeoJSON
-                inter = inter.buffer(0).simplify(0.05) or inter
-                shaded.append(inter)
-        except Exception:
-            pass
+            local = hulls[hh[0]] if len(hh) == 1 else shapely.union_all(hulls[hh])
+            inter = roads[i].intersection(local)
+        except shapely.errors.GEOSException:
+            errors += 1
+            continue
+        if not inter.is_empty:
+            out.append((i, inter))
+    return out, errors
+
+def _tile_worker(task):
+    box, idx = task
+    cand = _W["tree"].query(box, predicate="intersects")
+    piece = shapely.intersection(shapely.union_all(_W["hulls"][cand]), box) if len(cand) else None
+    shaded, errors = shade_roads(idx) if len(idx) else ([], 0)
+    return piece, shaded, errors
+
+def tile_tasks(hulls, roads, tile_m):
+    # teselas que tocan alguna sombra o vía; cada vía va a la tesela del centro de su bbox
+    hb, rb = shapely.bounds(hulls), shapely.bounds(roads)
+    x0 = min(hb[:, 0].min(), rb[:, 0].min()); y0 = min(hb[:, 1].min(), rb[:, 1].min())
+    x1 = max(hb[:, 2].max(), rb[:, 2].max()); y1 = max(hb[:, 3].max(), rb[:, 3].max())
+    nx, ny = max(1, math.ceil((x1 - x0) / tile_m)), max(1, math.ceil((y1 - y0) / tile_m))
+    ix = np.clip(((rb[:, 0] + rb[:, 2]) / 2 - x0) // tile_m, 0, nx - 1).astype(np.int64)
+    iy = np.clip(((rb[:, 1] + rb[:, 3]) / 2 - y0) // tile_m, 0, ny - 1).astype(np.int64)
+    tile = ix * ny + iy
+    order = np.argsort(tile, kind="stable")
+    keys, starts = np.unique(tile[order], return_index=True)
+    by_tile = dict(zip(keys.tolist(), np.split(order, starts[1:])))
+    tasks = []
+    for i in range(nx):
+        for j in range(ny):
+            box = shapely.box(x0 + i * tile_m, y0 + j * tile_m, x0 + (i + 1) * tile_m, y0 + (j + 1) * tile_m)
+            idx = by_tile.get(i * ny + j, np.zeros(0, dtype=np.int64))
+            tasks.append((box, idx))
+    return tasks
+
+def run_pool(fn, tasks, workers, state):
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(state)
+        return [fn(t) for t in tasks]
+    with ProcessPoolExecutor(workers, mp_context=mp.get_context("fork"),
+                             initializer=_init_worker, initargs=(state,)) as ex:
+        return list(ex.map(fn, tasks))
+
+def tiled_shade(hulls, roads, tile_m=TILE_M, workers=WORKERS):
+    # -> (unión de sombras, [(índice de vía, tramo sombreado)] en orden de vía, errores)
+    results = run_pool(_tile_worker, tile_tasks(hulls, roads, tile_m), workers,
+                       {"hulls": hulls, "roads": roads})
+    pieces = shapely.get_parts([p for p, _, _ in results if p is not None])
+    pieces = pieces[shapely.get_type_id(pieces) == 3]
+    try:
+        shadow_union = shapely.coverage_union_all(pieces)
+    except shapely.errors.GEOSException:
+        shadow_union = shapely.union_all(pieces)
+    shaded = sorted((x for _, sh, _ in results for x in sh), key=lambda x: x[0])
+    return shadow_union, shaded, sum(e for _, _, e in results)
+
+def run_single(args):
+    # Proyecciones
+    fwd = transformer(4326, EPSG)   # lon,lat -> X,Y
+    inv = transformer(EPSG, 4326)   # X,Y -> lon,lat
+
+    # Sol a las 12:00 local (según config)
+    obs = Observer(latitude=LAT, longitude=LON)
+    elev = sun_elevation(obs, DT)           # grados sobre el horizonte
+    azim = sun_azimuth(obs, DT) % 360.0     # grados desde el Norte, sentido horario
+    if elev <= 0:
+        print(f"[WARN] Altitud solar <= 0 ({elev:.2f}°). Sombras muy largas o sin sol.", file=sys.stderr)
+
+    b_utm = load_buildings(fwd)
+    r_utm = [g for g, _, _ in load_roads(fwd)]
+    polys, heights = building_arrays(b_utm)
+    if not len(polys):
+        print("[ERR] No se generaron sombras", file=sys.stderr); sys.exit(2)
+    roads = np.array(r_utm, dtype=object)
+
+    t0 = time.perf_counter()
+    cache, keys = open_cache(args, polys, heights)
+    hulls, elev, azim = cached_hulls(polys, heights, keys, elev, azim, cache)
+    if cache is not None:
+        print(f"[cache] {CACHE_DIR} sol en balde elev={elev:.3f}° azim={azim:.3f}° "
+              f"aciertos={cache.hits} fallos={cache.misses} desalojados={cache.evicted}")
+    shadow_union, shaded, errors = tiled_shade(hulls, roads, args.tile_m, args.workers)
+    print(f"[sombra] teselas={args.tile_m:g}m workers={args.workers} t={time.perf_counter()-t0:.1f}s")
+    if errors:
+        print(f"[WARN] {errors} vías fallaron al intersecar (GEOS) y se omiten", file=sys.stderr)
+    shaded = [g for _, g in shaded]
 
     # Salidas
     # 1) Polígonos de sombra
-    su_wgs = proj_inverse(shadow_union, inv)
+    su_wgs = reproject(shadow_union, inv)
     feats_polys=[]
     if su_wgs.geom_type == "Polygon":
         feats_polys=[{"type":"Feature","geometry":mapping(su_wgs),"properties":{}}]
@@ -147,7 +261,7 @@ def main():
     OUT_SHADOWS.write_text(json.dumps({"type":"FeatureCollection","features":feats_polys}, ensure_ascii=False))
 
     # 2) Vías sombreadas (líneas)
-    shaded_wgs=[proj_inverse(g, inv) for g in shaded]
+    shaded_wgs=reproject(shaded, inv) if shaded else []
     feats_lines=[]
     for g in shaded_wgs:
         if g.is_empty: continue
@@ -160,5 +274,117 @@ def main():
     print(f"OK sombras: {len(feats_polys)} polígonos | vías sombreadas: {len(feats_lines)}")
     print(f"Sol: elev={elev:.1f}°  azim={azim:.1f}°")
 
+# --- Serie temporal -------------------------------------------------------
+# Edificios y vías se leen y proyectan una vez; cada instante (posición del sol)
+# es una tarea del pool: sombras en bloque + STRtree, y la fracción sombreada de
+# cada vía sale de intersecarla con la unión de sus sombras candidatas.
+
+def sun_series(day, start, end, step_min):
+    # -> [(datetime local, elevación, azimut)] entre start y end inclusive
+    obs = Observer(latitude=LAT, longitude=LON)
+    t = datetime.combine(day, start, tzinfo=TZ)
+    t_end = datetime.combine(day, end, tzinfo=TZ)
+    out = []
+    while t <= t_end:
+        out.append((t, sun_elevation(obs, t), sun_azimuth(obs, t) % 360.0))
+        t += timedelta(minutes=step_min)
+    return out
+
+def _time_worker(sun):
+    elev, azim = sun
+    cache = _W["cache"]
+    h0, m0 = (cache.hits, cache.misses) if cache else (0, 0)
+    _W["hulls"], _, _ = cached_hulls(_W["polys"], _W["heights"], _W["keys"], elev, azim, cache)
+    hits, misses = (cache.hits - h0, cache.misses - m0) if cache else (0, 0)
+    _W["tree"] = shapely.STRtree(_W["hulls"])
+    roads, lengths = _W["roads"], _W["lengths"]
+    shaded, errors = shade_roads(np.arange(len(roads)))
+    frac = np.zeros(len(roads), dtype=np.float64)
+    for i, g in shaded:
+        frac[i] = g.length / lengths[i] if lengths[i] > 0 else 0.0
+    return np.clip(frac, 0.0, 1.0), errors, hits, misses
+
+def run_series(args):
+    fwd = transformer(4326, EPSG)
+
+    day = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else DT.date()
+    start = datetime.strptime(args.start, "%H:%M").time()
+    end = datetime.strptime(args.end, "%H:%M").time()
+    suns = sun_series(day, start, end, args.step)
+    if not suns:
+        print("[ERR] Rango horario vacío", file=sys.stderr); sys.exit(2)
+
+    polys, heights = building_arrays(load_buildings(fwd))
+    # vías únicas por geometría (igual que el DISTINCT ON de load_infra.sql); la clave
+    # md5 del WKB permite unir con via_arista por md5(ST_AsBinary(geom))
+    roads, keys, osm_ids, seen = [], [], [], set()
+    for g_utm, g_wgs, props in load_roads(fwd):
+        wkb = shapely.to_wkb(g_wgs, byte_order=1)
+        if wkb in seen:
+            continue
+        seen.add(wkb)
+        roads.append(g_utm)
+        keys.append(hashlib.md5(wkb).hexdigest())
+        osm_ids.append(int(props.get("osm_id") or -1))
+    roads = np.array(roads, dtype=object)
+    lengths = shapely.length(roads)
+
+    frac = np.ones((len(roads), len(suns)), dtype=np.float16)  # sin sol directo: 1.0
+    day_k = [k for k, (_, elev, _) in enumerate(suns) if elev > 0]
+    cache, keys = open_cache(args, polys, heights)
+    results = run_pool(_time_worker, [suns[k][1:] for k in day_k], args.workers,
+                       {"polys": polys, "heights": heights, "roads": roads, "lengths": lengths,
+                        "cache": cache, "keys": keys})
+    if cache is not None:
+        print(f"[cache] {CACHE_DIR} aciertos={sum(r[2] for r in results)} "
+              f"fallos={sum(r[3] for r in results)}")
+    for k, (f, errors, _, _) in zip(day_k, results):
+        t, elev, azim = suns[k]
+        frac[:, k] = f
+        print(f"[serie] {t:%H:%M} elev={elev:.1f}° azim={azim:.1f}° "
+              f"sombra_media={float(np.average(f, weights=lengths)):.3f}"
+              + (f" errores_geos={errors}" if errors else ""))
+
+    out = Path(args.out) if args.out else OUT_SERIES
+    out.parent.mkdir(parents=True, exist_ok=True)
+    times = np.array([t.isoformat() for t, _, _ in suns])
+    np.savez_compressed(out, times=times,
+                        elev=np.array([e for _, e, _ in suns], dtype=np.float32),
+                        azim=np.array([a for _, _, a in suns], dtype=np.float32),
+                        geom_md5=np.array(keys), osm_id=np.array(osm_ids, dtype=np.int64),
+                        length_m=lengths.astype(np.float32), frac=frac)
+    print(f"OK serie: {out} vías={len(roads)} instantes={len(suns)} ({out.stat().st_size/1e6:.2f} MB)")
+    if args.csv:
+        # tabla ancha: una fila por vía, una columna por instante
+        with open(args.csv, "w") as fh:
+            fh.write("geom_md5,osm_id,length_m," + ",".join(f"{t:%H:%M}" for t, _, _ in suns) + "\n")
+            for i in range(len(roads)):
+                fh.write(f"{keys[i]},{osm_ids[i]},{lengths[i]:.2f}," +
+                         ",".join(f"{v:.3f}" for v in frac[i].astype(np.float64)) + "\n")
+        print(f"OK csv: {args.csv}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Sombras de edificios sobre vías")
+    ap.add_argument("--series", action="store_true",
+                    help="fracción sombreada por vía para un rango horario (en vez de datetime_local)")
+    ap.add_argument("--date", help="AAAA-MM-DD (default: fecha de datetime_local)")
+    ap.add_argument("--start", default="08:00", help="HH:MM hora local")
+    ap.add_argument("--end", default="20:00", help="HH:MM hora local")
+    ap.add_argument("--step", type=int, default=30, help="minutos entre instantes")
+    ap.add_argument("--out", help=f"npz de salida (default: {OUT_SERIES})")
+    ap.add_argument("--csv", help="además, escribir la tabla en CSV")
+    ap.add_argument("--tile-m", type=float, default=TILE_M, help="lado de las teselas (m)")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="procesos en paralelo")
+    ap.add_argument("--no-cache", action="store_true", help="ignorar shadow_cache_dir")
+    args = ap.parse_args()
+    if args.tile_m <= 0 or args.workers <= 0:
+        ap.error("--tile-m y --workers deben ser > 0")
+    if args.series:
+        if args.step <= 0:
+            ap.error("--step debe ser > 0")
+        run_series(args)
+    else:
+        run_single(args)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+import hashlib, os, struct
+from pathlib import Path
+import numpy as np
+import shapely
+
+# Caché en disco de sombras por edificio para build_shadow_roads.py.
+# Clave: (md5 del footprint en UTM + height_m, balde de elevación/azimut solar).
+# Un archivo .npz por balde de sol con las claves y los WKB de las sombras; la
+# sombra se calcula en el centro del balde, así que un acierto es exacto.
+# Se desaloja por tamaño total (los baldes usados hace más tiempo primero).
+
+
+class ShadowCache:
+    def __init__(self, root, max_mb=512, bucket_deg=0.25):
+        self.root = Path(root)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bucket_deg = float(bucket_deg)
+        self.hits = self.misses = self.evicted = 0
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def bucket(self, elev, azim):
+        # -> (balde, elevación, azimut del centro del balde)
+        b = self.bucket_deg
+        qe, qa = int(np.floor(elev / b)), int(np.floor((azim % 360.0) / b))
+        return (qe, qa), (qe + 0.5) * b, (qa + 0.5) * b
+
+    @staticmethod
+    def keys(polys, heights):
+        # md5(WKB del footprint + altura al cm) por edificio
+        wkb = shapely.to_wkb(polys, byte_order=1)
+        return [hashlib.md5(w + struct.pack("<q", int(round(h * 100)))).hexdigest().encode()
+                for w, h in zip(wkb, heights.tolist())]
+
+    def _path(self, bucket):
+        return self.root / f"e{bucket[0]}_a{bucket[1]}_{self.bucket_deg:g}.npz"
+
+    def get(self, bucket, keys):
+        # -> arreglo de sombras (None donde no hay acierto)
+        out = np.full(len(keys), None, dtype=object)
+        p = self._path(bucket)
+        try:
+            with np.load(p) as z:
+                index = {k: i for i, k in enumerate(z["keys"].tolist())}
+                off, blob = z["off"], z["blob"].tobytes()
+            os.utime(p)  # marca de uso para el desalojo
+        except (OSError, ValueError, KeyError):
+            index = {}  # sin balde, desalojado por otro proceso o ilegible
+        pos = [(j, index.get(k)) for j, k in enumerate(keys)]
+        pos = [(j, i) for j, i in pos if i is not None]
+        if pos:
+            out[[j for j, _ in pos]] = shapely.from_wkb([blob[off[i]:off[i + 1]] for _, i in pos])
+        found = int(sum(g is not None for g in out))
+        self.hits += found
+        self.misses += len(keys) - found
+        return out
+
+    def put(self, bucket, keys, shadows):
+        # reescribe el balde con los edificios actuales (los que ya no están se descartan)
+        wkb = shapely.to_wkb(shadows, byte_order=1)
+        off = np.zeros(len(wkb) + 1, dtype=np.int64)
+        off[1:] = np.cumsum([len(w) for w in wkb])
+        p = self._path(bucket)
+        # sufijo .tmp (no .npz): evict() de otro proceso no debe contarlo ni borrarlo;
+        # con un archivo abierto np.savez no agrega ".npz" al nombre
+        tmp = p.with_name(f"{p.stem}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, keys=np.array(keys, dtype="S32"), off=off,
+                     blob=np.frombuffer(b"".join(wkb), dtype=np.uint8))
+        os.replace(tmp, p)
+        self.evict()
+
+    def evict(self):
+        # los baldes usados hace más tiempo primero; otro proceso puede estar
+        # desalojando en paralelo, así que un archivo que ya no está se salta
+        files = []
+        for f in self.root.glob("*.npz"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, f))
+        files.sort()
+        total = sum(s for _, s, _ in files)
+        for _, s, f in files[:-1]:  # nunca el recién escrito
+            if total <= self.max_bytes:
+                break
+            total -= s
+            f.unlink(missing_ok=True)
+            self.evicted += 1
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Micro-benchmark: shapely.ops.transform con lambda por geometría (lo que hacía
+# build_shadow_roads.py) vs etl.utils.proj.reproject (una llamada a pyproj).
+#   python -m etl.utils.bench_reproject --n 20000
+import argparse, time
+import numpy as np
+import shapely
+from shapely.ops import transform as shp_transform
+from etl.utils.proj import reproject, transformer
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000, help="edificios sintéticos")
+    ap.add_argument("--epsg", type=int, default=32719)
+    args = ap.parse_args()
+
+    rnd = np.random.default_rng(0)
+    x = -70.65 + rnd.random(args.n) * 0.06
+    y = -33.45 + rnd.random(args.n) * 0.04
+    s = 0.0001 + rnd.random(args.n) * 0.0002
+    geoms = shapely.box(x, y, x + s, y + s)
+    fwd = transformer(4326, args.epsg)
+
+    t0 = time.perf_counter()
+    old = [shp_transform(lambda a, b: fwd.transform(a, b), g) for g in geoms]
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = reproject(geoms, fwd)
+    t_new = time.perf_counter() - t0
+
+    diff = np.abs(shapely.get_coordinates(old) - shapely.get_coordinates(new)).max()
+    print(f"geometrías={args.n} vértices={len(shapely.get_coordinates(new))}")
+    print(f"por geometría (shapely.ops.transform): {t_old*1000:.0f} ms")
+    print(f"vectorizado (reproject):               {t_new*1000:.0f} ms  x{t_old/t_new:.0f}")
+    print(f"diferencia máx: {diff:.2e} m")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import hashlib, json, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+
+# Descarga concurrente para los extractores: pool de threads sobre una sola
+# requests.Session (conexiones reutilizadas), límite de tasa con token bucket,
+# reintentos con backoff exponencial (+ Retry-After en 429/503) y caché en disco
+# de respuestas JSON con TTL.
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s, burst=1):
+        self.rate = float(rate_per_s)
+        self.capacity = max(1.0, float(burst))
+        self.tokens = self.capacity
+        self.t = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+                self.t = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DiskCache:
+    # un archivo JSON por (url, params); vence por mtime
+    def __init__(self, root, ttl_s):
+        self.root = Path(root)
+        self.ttl_s = float(ttl_s)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(url, params):
+        raw = url + "?" + json.dumps(params or {}, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        p = self.root / f"{key}.json"
+        try:
+            if time.time() - p.stat().st_mtime > self.ttl_s:
+                return None
+            return json.loads(p.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        p = self.root / f"{key}.json"
+        tmp = p.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(value))
+        tmp.replace(p)
+
+
+class Fetcher:
+    def __init__(self, rate_per_s=5.0, burst=5, workers=8, retries=4, backoff_s=0.5,
+                 timeout_s=30, cache_dir=None, cache_ttl_s=900, no_cache=False):
+        self.bucket = TokenBucket(rate_per_s, burst)
+        self.workers = max(1, int(workers))
+        self.retries = int(retries)
+        self.backoff_s = float(backoff_s)
+        self.timeout_s = timeout_s
+        self.cache = DiskCache(cache_dir, cache_ttl_s) if cache_dir and not no_cache else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "cache_hits": 0, "retries": 0, "errors": 0}
+
+    def _count(self, k):
+        with self.lock:
+            self.stats[k] += 1
+
+    def get_json(self, url, params=None, use_cache=True):
+        key = DiskCache.key(url, params) if self.cache and use_cache else None
+        if key:
+            hit = self.cache.get(key)
+            if hit is not None:
+                self._count("cache_hits")
+                return hit
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            self._count("requests")
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout_s)
+                if r.status_code in RETRY_STATUS and attempt < self.retries:
+                    wait = r.headers.get("Retry-After")
+                    raise _Retry(float(wait) if wait and wait.isdigit() else None)
+                r.raise_for_status()
+                j = r.json()
+                if key:
+                    self.cache.put(key, j)
+                return j
+            except (_Retry, requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    self._count("errors")
+                    raise
+                self._count("retries")
+                wait = getattr(e, "wait", None)
+                time.sleep(wait if wait is not None else
+                           self.backoff_s * 2 ** attempt * (0.5 + random.random()))
+            except Exception:
+                self._count("errors")
+                raise
+
+    def map_json(self, calls):
+        # calls: [(url, params)] -> [json | Exception] en el mismo orden
+        def one(c):
+            try:
+                return self.get_json(*c)
+            except Exception as e:
+                return e
+        with ThreadPoolExecutor(self.workers) as ex:
+            return list(ex.map(one, calls))
+
+    def summary(self):
+        s = self.stats
+        return (f"requests={s['requests']} cache={s['cache_hits']} "
+                f"reintentos={s['retries']} errores={s['errors']}")
+
+
+class _Retry(Exception):
+    def __init__(self, wait=None):
+        super().__init__(f"reintentable (wait={wait})")
+        self.wait = wait
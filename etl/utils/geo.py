@@ -1,4 +1,6 @@
 import math
+import numpy as np
+
 def haversine_m(a,b):
     lat1, lon1 = a; lat2, lon2 = b
     R = 6371000.0
@@ -6,3 +8,22 @@ def haversine_m(a,b):
     dlon = math.radians(lon2-lon1)
     y = math.sin(dlat/2)**2 + math.cos(math.radians(lat1))*math.cos(math.radians(lat2))*math.sin(dlon/2)**2
     return 2*R*math.asin(math.sqrt(y))
+
+def haversine_seg_m(lat, lon):
+    # largos de cada tramo consecutivo de una polilínea (arreglos lat/lon en grados)
+    la, lo = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    y = np.sin(np.diff(la)/2)**2 + np.cos(la[:-1])*np.cos(la[1:])*np.sin(np.diff(lo)/2)**2
+    return 2*6371000.0*np.arcsin(np.sqrt(y))
+
+def haversine_cum_m(lat, lon):
+    # largo acumulado (m) en cada vértice, en Python puro: para polilíneas cortas
+    # el costo fijo de armar arreglos NumPy supera al del cálculo
+    out, acc = [0.0], 0.0
+    la0, lo0 = math.radians(lat[0]), math.radians(lon[0])
+    for k in range(1, len(lat)):
+        la1, lo1 = math.radians(lat[k]), math.radians(lon[k])
+        y = math.sin((la1-la0)/2)**2 + math.cos(la0)*math.cos(la1)*math.sin((lo1-lo0)/2)**2
+        acc += 2*6371000.0*math.asin(math.sqrt(y))
+        out.append(acc)
+        la0, lo0 = la1, lo1
+    return out
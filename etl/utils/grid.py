@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# Grilla regular de amenaza (temperatura, UV, ...) como arreglo NumPy + geotransform.
+# Fila 0 = borde norte, columna 0 = borde oeste (mismo orden que las celdas del
+# GeoJSON histórico). Se guarda en .npz con metadata (fuente, hora, variable);
+# el GeoJSON por celda es sólo una exportación (p.ej. para cargarlo en PostGIS).
+#   python -m etl.utils.grid data/amenaza_temp_grid.npz                 # resumen
+#   python -m etl.utils.grid data/amenaza_temp_grid.npz --at=-33.43,-70.61 --bilinear
+#   python -m etl.utils.grid data/amenaza_temp_grid.npz --geojson out.geojson
+import argparse, json
+from pathlib import Path
+import numpy as np
+
+
+class Grid:
+    def __init__(self, bbox, values, name="value", meta=None, layers=None):
+        # bbox: (S, W, N, E); values: (filas, columnas), NaN = sin dato;
+        # layers: arreglos extra por celda (misma forma), p.ej. timestamp por celda
+        self.bbox = tuple(float(v) for v in bbox)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.name = name
+        self.meta = dict(meta or {})
+        self.layers = {k: np.asarray(v) for k, v in (layers or {}).items()}
+        S, W, N, E = self.bbox
+        self.ny, self.nx = self.values.shape
+        self.dx = (E - W) / self.nx
+        self.dy = (N - S) / self.ny
+
+    @classmethod
+    def empty(cls, bbox, ny, nx, name="value", meta=None):
+        return cls(bbox, np.full((int(ny), int(nx)), np.nan, dtype=np.float32), name, meta)
+
+    @property
+    def geotransform(self):
+        # estilo GDAL: (x0, dx, 0, y0, 0, -dy)
+        S, W, N, E = self.bbox
+        return (W, self.dx, 0.0, N, 0.0, -self.dy)
+
+    def cells(self):
+        # [{"poly", "centroid", "row", "col"}] en el orden N→S, W→E
+        S, W, N, E = self.bbox
+        out = []
+        for iy in range(self.ny):
+            yN, yS = N - iy * self.dy, N - (iy + 1) * self.dy
+            for ix in range(self.nx):
+                xW, xE = W + ix * self.dx, W + (ix + 1) * self.dx
+                out.append({"poly": [[xW, yN], [xE, yN], [xE, yS], [xW, yS], [xW, yN]],
+                            "centroid": [(xW + xE) / 2.0, (yN + yS) / 2.0], "row": iy, "col": ix})
+        return out
+
+    # --- consultas (arreglos de puntos) -----------------------------------
+
+    def _frac(self, lon, lat):
+        # posición continua en unidades de celda, con el centro de la celda (0,0) en (0.5, 0.5)
+        S, W, N, E = self.bbox
+        fx = (np.asarray(lon, dtype=np.float64) - W) / self.dx
+        fy = (N - np.asarray(lat, dtype=np.float64)) / self.dy
+        return fx, fy
+
+    def nearest(self, lon, lat):
+        # valor de la celda que contiene cada punto; NaN fuera de la grilla
+        fx, fy = self._frac(lon, lat)
+        ix, iy = np.floor(fx).astype(np.int64), np.floor(fy).astype(np.int64)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+        out = np.full(np.shape(fx), np.nan, dtype=np.float64)
+        out[inside] = self.values[iy[inside], ix[inside]]
+        return out
+
+    def bilinear(self, lon, lat):
+        # interpolación entre centros de celda (extremos fijos al borde); las celdas
+        # sin dato se ignoran renormalizando los pesos. NaN fuera de la grilla.
+        fx, fy = self._frac(lon, lat)
+        inside = (fx >= 0) & (fx <= self.nx) & (fy >= 0) & (fy <= self.ny)
+        cx = np.clip(fx - 0.5, 0, self.nx - 1)
+        cy = np.clip(fy - 0.5, 0, self.ny - 1)
+        x0 = np.minimum(np.floor(cx).astype(np.int64), max(self.nx - 2, 0))
+        y0 = np.minimum(np.floor(cy).astype(np.int64), max(self.ny - 2, 0))
+        x1, y1 = np.minimum(x0 + 1, self.nx - 1), np.minimum(y0 + 1, self.ny - 1)
+        tx, ty = cx - x0, cy - y0
+        acc = np.zeros(np.shape(fx))
+        wsum = np.zeros(np.shape(fx))
+        for yy, xx, w in ((y0, x0, (1 - tx) * (1 - ty)), (y0, x1, tx * (1 - ty)),
+                          (y1, x0, (1 - tx) * ty), (y1, x1, tx * ty)):
+            v = self.values[yy, xx].astype(np.float64)
+            ok = ~np.isnan(v)
+            acc += np.where(ok, v * w, 0.0)
+            wsum += np.where(ok, w, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = acc / wsum
+        out[~inside | (wsum <= 0)] = np.nan
+        return out
+
+    # --- persistencia -------------------------------------------------------
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, values=self.values, bbox=np.array(self.bbox),
+                            geotransform=np.array(self.geotransform),
+                            meta=np.array(json.dumps({**self.meta, "name": self.name})),
+                            **{f"layer_{k}": v for k, v in self.layers.items()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"]))
+            layers = {k[6:]: z[k] for k in z.files if k.startswith("layer_")}
+            return cls(z["bbox"], z["values"], meta.pop("name", "value"), meta, layers)
+
+    def to_geojson(self, path=None, properties=None):
+        # FeatureCollection con un Polygon por celda (formato histórico de json/amenaza_*)
+        feats = []
+        for c in self.cells():
+            iy, ix = c["row"], c["col"]
+            v = self.values[iy, ix]
+            props = {self.name: None if np.isnan(v) else round(float(v), 4),
+                     "row": iy, "col": ix,
+                     "centroid": {"lon": c["centroid"][0], "lat": c["centroid"][1]}}
+            for k, arr in self.layers.items():
+                x = arr[iy, ix].item()
+                if isinstance(x, float):
+                    x = None if np.isnan(x) else int(x) if x.is_integer() else x
+                props[k] = x
+            feats.append({"type": "Feature",
+                          "geometry": {"type": "Polygon", "coordinates": [c["poly"]]},
+                          "properties": props})
+        gj = {"type": "FeatureCollection", "features": feats,
+              "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+              "properties": dict(properties if properties is not None else self.meta)}
+        if path:
+            Path(path).write_text(json.dumps(gj, ensure_ascii=False))
+        return gj
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("npz")
+    ap.add_argument("--at", action="append", default=[], help="lat,lon (repetible; con lat negativa usar --at=-33.4,-70.6)")
+    ap.add_argument("--bilinear", action="store_true")
+    ap.add_argument("--geojson", help="exportar a GeoJSON por celda")
+    args = ap.parse_args()
+    g = Grid.load(args.npz)
+    ok = ~np.isnan(g.values)
+    print(f"{g.name} {g.ny}x{g.nx} bbox={g.bbox} celdas_con_dato={int(ok.sum())} "
+          f"min={np.nanmin(g.values) if ok.any() else None} max={np.nanmax(g.values) if ok.any() else None} meta={g.meta}")
+    for s in args.at:
+        lat, lon = map(float, s.split(","))
+        fn = g.bilinear if args.bilinear else g.nearest
+        print(f"{lat},{lon} -> {float(fn([lon], [lat])[0]):.3f}")
+    if args.geojson:
+        g.to_geojson(args.geojson)
+        print(f"OK {args.geojson}")
+
+
+if __name__ == "__main__":
+    main()
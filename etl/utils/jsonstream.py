@@ -0,0 +1,44 @@
+import json, re
+
+# Lectura incremental de un arreglo grande dentro de un JSON, p.ej. "elements"
+# de Overpass o "features" de un GeoJSON: se decodifica un elemento a la vez
+# desde un buffer de tamaño acotado, sin cargar el archivo completo.
+
+_WS = re.compile(r"[\s,]*")
+
+
+def iter_array(path, key, chunk=1 << 20):
+    dec = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf = ""
+        head = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        while True:
+            m = head.search(buf)
+            if m:
+                buf = buf[m.end():]
+                break
+            more = f.read(chunk)
+            if not more:
+                return  # sin la clave: arreglo vacío
+            # conservar la cola por si la clave quedó cortada entre bloques
+            buf = buf[-len(key) - 16:] + more
+        # `pos` avanza sobre buf; el buffer se compacta sólo al leer un bloque nuevo
+        eof, pos = False, 0
+        while True:
+            pos = _WS.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, pos = dec.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield obj
+            if len(buf) - pos < chunk // 4 and not eof:
+                more = f.read(chunk)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
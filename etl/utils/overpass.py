@@ -0,0 +1,201 @@
+import hashlib, json, random, sys, time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import requests
+from requests.adapters import HTTPAdapter
+
+from etl.utils.fetch import TokenBucket
+
+# Cliente Overpass compartido por los extractores OSM.
+# - El bbox se divide en teselas; un pool acotado de threads las descarga
+#   repartiendo los intentos entre todos los overpass_urls.
+# - Cada tesela terminada se guarda en disco (cache_dir): una corrida
+#   interrumpida retoma sólo las que faltan. Las entradas vencen a los
+#   cache_ttl_s (por mtime, como etl/utils/fetch.py) y una corrida completa, sin
+#   teselas fallidas, borra las suyas: la siguiente vuelve a descargar.
+# - Una tesela que vence el timeout o choca con el límite de memoria/tamaño
+#   (remark "runtime error" o HTTP 504) se parte en 4 (quadtree) hasta max_depth;
+#   la partición también queda marcada en disco.
+# - Los elementos se deduplican por (tipo, id).
+# La consulta es una plantilla Overpass QL con {bbox} (s,w,n,e) y {timeout}.
+
+SPLIT_STATUS = {504}
+RETRY_STATUS = {429, 500, 502, 503}
+
+
+class SplitTile(Exception):
+    pass
+
+
+class OverpassClient:
+    def __init__(self, urls, user_agent="fase2-providencia-etl", timeout_s=120, workers=4,
+                 retries=3, backoff_s=2.0, rate_per_s=2.0, cache_dir="data/cache/overpass",
+                 max_depth=4, no_cache=False, cache_ttl_s=86400):
+        self.urls = list(urls)
+        self.ua = user_agent
+        self.timeout_s = int(timeout_s)
+        self.workers = max(1, int(workers))
+        self.retries = int(retries)
+        self.backoff_s = float(backoff_s)
+        self.bucket = TokenBucket(rate_per_s, max(1, self.workers))
+        self.cache = None if no_cache or not cache_dir else Path(cache_dir)
+        self.cache_ttl_s = float(cache_ttl_s)
+        if self.cache:
+            self.cache.mkdir(parents=True, exist_ok=True)
+        self.max_depth = int(max_depth)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = {"tiles": 0, "cached": 0, "split": 0, "failed": 0}
+
+    # --- teselas ------------------------------------------------------------
+
+    @staticmethod
+    def grid(bbox, nx=1, ny=1):
+        S, W, N, E = bbox
+        return [(S + (N - S) * iy / ny, W + (E - W) * ix / nx,
+                 S + (N - S) * (iy + 1) / ny, W + (E - W) * (ix + 1) / nx)
+                for iy in range(ny) for ix in range(nx)]
+
+    @staticmethod
+    def quad(b):
+        s, w, n, e = b
+        my, mx = (s + n) / 2, (w + e) / 2
+        return [(s, w, my, mx), (s, mx, my, e), (my, w, n, mx), (my, mx, n, e)]
+
+    def _key(self, query, b):
+        raw = query + "|" + ",".join(f"{v:.7f}" for v in b)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _cache_get(self, key):
+        if not self.cache:
+            return None
+        p = self.cache / f"{key}.json"
+        try:
+            if time.time() - p.stat().st_mtime > self.cache_ttl_s:
+                return None
+            return json.loads(p.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _cache_put(self, key, value):
+        if not self.cache:
+            return
+        p = self.cache / f"{key}.json"
+        tmp = p.with_suffix(f".{random.getrandbits(32):08x}.tmp")
+        tmp.write_text(json.dumps(value, ensure_ascii=False))
+        tmp.replace(p)
+
+    def _cache_drop(self, keys):
+        if not self.cache:
+            return
+        for key in keys:
+            (self.cache / f"{key}.json").unlink(missing_ok=True)
+
+    # --- descarga -----------------------------------------------------------
+
+    def _post(self, q, attempt, seed):
+        url = self.urls[(seed + attempt) % len(self.urls)]
+        self.bucket.acquire()
+        r = self.session.post(url, data={"data": q}, timeout=self.timeout_s + 15,
+                              headers={"User-Agent": self.ua, "Accept": "application/json"})
+        if r.status_code in SPLIT_STATUS:
+            raise SplitTile(f"HTTP {r.status_code} en {url}")
+        r.raise_for_status()
+        j = r.json()
+        remark = j.get("remark") or ""
+        if "runtime error" in remark:
+            # timeout o memoria del servidor: la respuesta viene incompleta
+            raise SplitTile(remark.strip()[:120])
+        return j
+
+    def _fetch_tile(self, query, b, depth):
+        # -> ("ok" | "cached", elementos) | ("split", None) | ("failed", error)
+        key = self._key(query, b)
+        hit = self._cache_get(key)
+        if hit is not None:
+            return ("split", None) if hit.get("split") else ("cached", hit["elements"])
+        q = query.replace("{bbox}", ",".join(f"{v:.7f}" for v in b)).replace("{timeout}", str(self.timeout_s))
+        seed = random.randrange(len(self.urls))
+        err = None
+        for attempt in range(self.retries + 1):
+            try:
+                j = self._post(q, attempt, seed)
+                self._cache_put(key, {"bbox": b, "elements": j.get("elements", [])})
+                return "ok", j.get("elements", [])
+            except (SplitTile, requests.Timeout) as e:
+                err = e
+                if depth < self.max_depth:
+                    self._cache_put(key, {"bbox": b, "split": True})
+                    return "split", None
+            except (requests.RequestException, ValueError) as e:
+                err = e
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status is not None and status not in RETRY_STATUS:
+                    break
+            if attempt < self.retries:
+                time.sleep(self.backoff_s * 2 ** attempt * (0.5 + random.random()))
+        return "failed", err
+
+    def fetch(self, query, bbox, tiles=(1, 1)):
+        # -> (elementos deduplicados, teselas fallidas [(bbox, error)])
+        pending = [(b, 0) for b in self.grid(bbox, *tiles)]
+        seen, elements, failed, keys = set(), [], [], []
+        with ThreadPoolExecutor(self.workers) as ex:
+            running = {}
+            while pending or running:
+                while pending and len(running) < self.workers * 2:
+                    b, d = pending.pop()
+                    running[ex.submit(self._fetch_tile, query, b, d)] = (b, d)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    b, d = running.pop(f)
+                    keys.append(self._key(query, b))
+                    status, res = f.result()
+                    if status == "split":
+                        self.stats["split"] += 1
+                        pending += [(c, d + 1) for c in self.quad(b)]
+                        continue
+                    if status == "failed":
+                        self.stats["failed"] += 1
+                        failed.append((b, res))
+                        print(f"[overpass] tesela {b} falló: {res}", file=sys.stderr)
+                        continue
+                    self.stats["tiles"] += 1
+                    self.stats["cached"] += status == "cached"
+                    for e in res:
+                        k = (e.get("type"), e.get("id"))
+                        if k in seen:
+                            continue
+                        seen.add(k)
+                        elements.append(e)
+        if not failed:
+            # corrida completa: la caché sólo servía para retomarla
+            self._cache_drop(keys)
+        return elements, failed
+
+    def summary(self):
+        s = self.stats
+        return f"teselas={s['tiles']} cache={s['cached']} partidas={s['split']} fallidas={s['failed']}"
+
+
+def from_config(cfg, args=None):
+    # overpass_urls (o overpass_url), user_agent, timeout_s, workers, cache_dir,
+    # cache_ttl_s, max_depth;
+    # args.overpass_url / args.no_cache (CLI) tienen prioridad
+    urls = cfg.get("overpass_urls") or [cfg.get("overpass_url", "https://overpass-api.de/api/interpreter")]
+    if args is not None and getattr(args, "overpass_url", None):
+        urls = [args.overpass_url]
+    return OverpassClient(urls, user_agent=cfg.get("user_agent", "fase2-providencia-etl"),
+                          timeout_s=cfg.get("timeout_s", 120), workers=cfg.get("workers", 2 * len(urls)),
+                          retries=cfg.get("retries", 3), rate_per_s=cfg.get("rate_per_s", 2),
+                          cache_dir=cfg.get("cache_dir", "data/cache/overpass"),
+                          cache_ttl_s=cfg.get("cache_ttl_s", 86400),
+                          max_depth=cfg.get("max_depth", 4),
+                          no_cache=bool(args is not None and getattr(args, "no_cache", False)))
+
+
+def add_cli_args(ap):
+    ap.add_argument("--overpass-url", help="usar sólo este endpoint (p.ej. el stub: http://127.0.0.1:8765/api/interpreter)")
+    ap.add_argument("--no-cache", action="store_true", help="ignorar la caché de teselas")
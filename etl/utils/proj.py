@@ -0,0 +1,20 @@
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+# Reproyección vectorizada: todas las coordenadas de un arreglo de geometrías
+# pasan por una sola llamada a pyproj (shapely.transform entrega un arreglo Nx2
+# con los vértices de todas las geometrías y las reconstruye con el resultado).
+
+def transformer(src_epsg, dst_epsg):
+    # always_xy: (lon, lat) / (X, Y)
+    return Transformer.from_crs(CRS.from_epsg(src_epsg), CRS.from_epsg(dst_epsg), always_xy=True)
+
+def reproject(geoms, tr: Transformer):
+    # geometría o arreglo/lista de geometrías -> mismo tipo/forma, reproyectado
+    def fn(xy):
+        x, y = tr.transform(xy[:, 0], xy[:, 1])
+        return np.column_stack((x, y))
+    if isinstance(geoms, list):
+        geoms = np.array(geoms, dtype=object)
+    return shapely.transform(geoms, fn)
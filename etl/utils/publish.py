@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Etapa de salida para la web: a partir de las capas GeoJSON del ETL (que se
+# siguen cargando tal cual en PostGIS) escribe en json/web/ una variante por
+# zoom, simplificada a ~1 píxel conservando la validez de cada geometría y con
+# coordenadas cuantizadas a 1/4 de píxel (opcionalmente en TopoJSON), más
+# hermanos precomprimidos .gz/.br de cada archivo para que nginx los sirva
+# directo (gzip_static). brotli es opcional: sin el paquete sólo se escriben .gz.
+#   python3 etl/utils/publish.py                                  # capas de la web
+#   python3 etl/utils/publish.py json/sombra_poligonos.geojson --zooms 13,15 --topojson
+import argparse, gzip, json, math
+from pathlib import Path
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LAYERS = [
+    "json/infra_provi_sector.geojson",
+    "json/infra_provi_sector_south.geojson",
+    "json/infra_provi_sector_south_exp.geojson",
+    "json/infra_provi_sector_east.geojson",
+    "json/infra_sombreada.geojson",
+    "json/sombra_poligonos.geojson",
+    "json/metadata_bebederos.geojson",
+    "json/amenaza_temp_grid.geojson",
+    "json/amenaza_uv_grid.geojson",
+]
+ZOOMS = (12, 14, 16)
+OUT_DIR = Path("json/web")
+
+
+def tolerance_deg(z):
+    # un píxel de una tesela de 256 px en el ecuador
+    return 360.0 / (256 * 2 ** z)
+
+
+def decimals(z):
+    return int(math.ceil(-math.log10(tolerance_deg(z) / 4)))
+
+
+def _round(c, d):
+    if isinstance(c[0], (int, float)):
+        return [round(float(v), d) for v in c]
+    return [_round(x, d) for x in c]
+
+
+def simplify(geoms, z):
+    # -> geometrías simplificadas y cuantizadas (None donde colapsan)
+    grid = 10.0 ** -decimals(z)
+    out = shapely.simplify(geoms, tolerance_deg(z), preserve_topology=True)
+    out = shapely.set_precision(out, grid)
+    out[shapely.is_empty(out)] = None
+    return out
+
+
+def geojson_bytes(head, geoms, props, d):
+    feats = [{"type": "Feature", "properties": p,
+              "geometry": {"type": m["type"], "coordinates": _round(m["coordinates"], d)}}
+             for g, p in zip(geoms, props) if g is not None for m in [mapping(g)]]
+    return json.dumps({**head, "features": feats}, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def topojson_bytes(name, geoms, props, d):
+    # arcos cuantizados y codificados en deltas; los arcos idénticos (o invertidos)
+    # se comparten, p.ej. el mismo tramo repetido en dos sectores
+    ok = [g for g in geoms if g is not None]
+    x0, y0 = (shapely.total_bounds(ok)[:2] if ok else (0.0, 0.0))
+    k = 10.0 ** -d
+    arcs, index = [], {}
+
+    def q(coords):
+        return np.round((np.asarray(coords)[:, :2] - (x0, y0)) / k).astype(np.int64)
+
+    def arc(coords):
+        a = q(coords)
+        a = a[np.r_[True, (np.diff(a, axis=0) != 0).any(axis=1)]]
+        if len(a) < 2:
+            return None
+        key, rkey = a.tobytes(), a[::-1].tobytes()
+        if key in index:
+            return index[key]
+        if rkey in index:
+            return ~index[rkey]
+        index[key] = len(arcs)
+        arcs.append(np.vstack([a[:1], np.diff(a, axis=0)]).tolist())
+        return index[key]
+
+    def rings(poly):
+        rs = [arc(poly.exterior.coords)] + [arc(r.coords) for r in poly.interiors]
+        return None if rs[0] is None else [[r] for r in rs if r is not None]
+
+    def obj(g):
+        t = g.geom_type
+        if t == "Point":
+            return {"type": t, "coordinates": q([g.coords[0]])[0].tolist()}
+        if t == "MultiPoint":
+            return {"type": t, "coordinates": q([p.coords[0] for p in g.geoms]).tolist()}
+        if t == "LineString":
+            a = arc(g.coords)
+            return None if a is None else {"type": t, "arcs": [a]}
+        if t == "MultiLineString":
+            al = [[a] for a in (arc(l.coords) for l in g.geoms) if a is not None]
+            return {"type": t, "arcs": al} if al else None
+        if t == "Polygon":
+            r = rings(g)
+            return None if r is None else {"type": t, "arcs": r}
+        if t == "MultiPolygon":
+            pl = [r for r in (rings(p) for p in g.geoms) if r is not None]
+            return {"type": t, "arcs": pl} if pl else None
+        return None
+
+    out = []
+    for g, p in zip(geoms, props):
+        o = obj(g) if g is not None else None
+        if o is not None:
+            o["properties"] = p
+            out.append(o)
+    topo = {"type": "Topology", "transform": {"scale": [k, k], "translate": [float(x0), float(y0)]},
+            "objects": {name: {"type": "GeometryCollection", "geometries": out}}, "arcs": arcs}
+    return json.dumps(topo, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def write(path, data, compress=True):
+    # -> {"raw", "gz", "br"} en bytes
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    sizes = {"raw": len(data), "gz": None, "br": None}
+    if compress:
+        gz = gzip.compress(data, compresslevel=9, mtime=0)
+        Path(f"{path}.gz").write_bytes(gz)
+        sizes["gz"] = len(gz)
+        if brotli is not None:
+            br = brotli.compress(data, quality=11)
+            Path(f"{path}.br").write_bytes(br)
+            sizes["br"] = len(br)
+    return sizes
+
+
+def compress_in_place(path):
+    # hermanos .gz/.br del archivo original (la web actual los pide sin variante)
+    data = path.read_bytes()
+    return write(path, data) if data else {"raw": 0, "gz": None, "br": None}
+
+
+def publish(src, zooms=ZOOMS, topojson=False, out_dir=OUT_DIR):
+    src = Path(src)
+    fc = json.loads(src.read_text())
+    head = {k: v for k, v in fc.items() if k != "features"}
+    feats = fc.get("features") or []
+    geoms = np.array([shapely.from_geojson(json.dumps(f["geometry"])) if f.get("geometry") else None
+                      for f in feats], dtype=object)
+    props = [f.get("properties") or {} for f in feats]
+    report = {"original": compress_in_place(src)}
+    for z in zooms:
+        g = simplify(geoms, z)
+        d = decimals(z)
+        if topojson:
+            data, ext = topojson_bytes(src.stem, g, props, d), "topojson"
+        else:
+            data, ext = geojson_bytes(head, g, props, d), "geojson"
+        report[f"z{z}"] = write(out_dir / f"{src.stem}.z{z}.{ext}", data)
+    return report
+
+
+def _fmt(s):
+    parts = [f"{s['raw']/1024:.0f}KB"]
+    if s["gz"] is not None:
+        parts.append(f"gz {s['gz']/1024:.0f}KB")
+    if s["br"] is not None:
+        parts.append(f"br {s['br']/1024:.0f}KB")
+    return " / ".join(parts)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("paths", nargs="*", default=LAYERS)
+    ap.add_argument("--zooms", default=",".join(map(str, ZOOMS)))
+    ap.add_argument("--topojson", action="store_true", help="variantes en TopoJSON en vez de GeoJSON")
+    ap.add_argument("--out-dir", default=str(OUT_DIR))
+    args = ap.parse_args()
+    zooms = [int(z) for z in args.zooms.split(",") if z]
+    before = after = 0
+    for p in args.paths:
+        if not Path(p).is_file():
+            continue
+        r = publish(p, zooms, args.topojson, Path(args.out_dir))
+        before += r["original"]["raw"]
+        after += sum(min(v for v in s.values() if v is not None) for k, s in r.items() if k != "original")
+        print(f"[publish] {Path(p).stem}: original {_fmt(r['original'])} | " +
+              " | ".join(f"{k} {_fmt(s)}" for k, s in r.items() if k != "original"))
+    if before:
+        print(f"[publish] total original {before/1024:.0f}KB -> variantes comprimidas {after/1024:.0f}KB "
+              f"(brotli {'sí' if brotli else 'no instalado'})")
+
+
+if __name__ == "__main__":
+    main()
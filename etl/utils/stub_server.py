@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Servidor HTTP local que imita las APIs externas de los extractores, para
+# probarlos sin red. Respuestas deterministas según las coordenadas.
+#   python -m etl.utils.stub_server --port 8765 [--fail-rate 0.2] [--latency-ms 50]
+#   python3 etl/amenazas/extract_openmeteo_temp_grid.py --api-base http://127.0.0.1:8765/v1/forecast
+#   python3 etl/amenazas/extract_openweather_uv_grid.py --api-base http://127.0.0.1:8765/data/3.0/onecall
+#   python3 etl/infraestructura/extract_osm_infra.py --overpass-url http://127.0.0.1:8765/api/interpreter
+import argparse, json, math, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+def fake_temp(lat, lon):
+    return round(25.0 + 3.0 * math.sin(lat * 40.0) + 2.0 * math.cos(lon * 40.0), 1)
+
+def fake_uv(lat, lon):
+    return round(max(0.0, 8.0 + 2.0 * math.sin((lat + lon) * 50.0)), 2)
+
+def open_meteo(q):
+    lats = [float(v) for v in q["latitude"][0].split(",")]
+    lons = [float(v) for v in q["longitude"][0].split(",")]
+    now = time.strftime("%Y-%m-%dT%H:00", time.gmtime())
+    out = [{"latitude": la, "longitude": lo,
+            "current_weather": {"temperature": fake_temp(la, lo), "time": now}}
+           for la, lo in zip(lats, lons)]
+    # como Open-Meteo: objeto con una coordenada, lista con varias
+    return out[0] if len(out) == 1 else out
+
+def onecall(q):
+    la, lo = float(q["lat"][0]), float(q["lon"][0])
+    return {"lat": la, "lon": lo, "current": {"uvi": fake_uv(la, lo), "dt": int(time.time())}}
+
+# Overpass: red sintética en una malla fija de OVERPASS_STEP grados; cada tramo
+# de calle y cada edificio tiene id estable, así teselas vecinas devuelven los
+# mismos elementos en el borde (para probar la deduplicación). Una consulta con
+# más de OVERPASS_MAX elementos responde como Overpass al quedarse sin memoria.
+OVERPASS_STEP = 0.002
+OVERPASS_MAX = 400
+
+def _overpass_elements(s, w, n, e, buildings):
+    st = OVERPASS_STEP
+    out = []
+    for i in range(math.floor(s / st), math.ceil(n / st) + 1):
+        for j in range(math.floor(w / st) - 1, math.ceil(e / st) + 1):
+            la, lo = i * st, j * st
+            eid = (i + 100000) * 1000000 + (j + 100000)
+            if buildings:
+                if (i + j) % 3:
+                    continue
+                c = [la + st / 2, lo + st / 2]
+                if not (s <= c[0] <= n and w <= c[1] <= e):
+                    continue
+                h = st / 5
+                ring = [(c[0] - h, c[1] - h), (c[0] - h, c[1] + h), (c[0] + h, c[1] + h),
+                        (c[0] + h, c[1] - h), (c[0] - h, c[1] - h)]
+                tags = {"building": "yes", "building:levels": str(1 + (i * 7 + j) % 6)}
+            else:
+                # tramo horizontal (la, lo) -> (la, lo + st); entra si cruza el bbox
+                if not (s <= la <= n and lo <= e and lo + st >= w):
+                    continue
+                ring = [(la, lo), (la, lo + st)]
+                tags = {"highway": "residential" if j % 4 else "primary", "name": f"Calle {i}"}
+            out.append({"type": "way", "id": eid, "nodes": [eid * 10 + k for k in range(len(ring))],
+                        "geometry": [{"lat": a, "lon": b} for a, b in ring], "tags": tags})
+    return out
+
+def overpass(q):
+    ql = q["data"][0]
+    m = re.search(r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)", ql) or \
+        re.search(r"\[bbox:\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\]", ql)
+    if not m:
+        raise ValueError("stub: consulta sin bbox")
+    s, w, n, e = map(float, m.groups())
+    els = _overpass_elements(s, w, n, e, '"building"' in ql)
+    base = {"version": 0.6, "generator": "stub", "osm3s": {"copyright": "stub"}}
+    if len(els) > OVERPASS_MAX:
+        return {**base, "elements": els[:OVERPASS_MAX // 2],
+                "remark": "runtime error: Query run out of memory using about 2048 MB of RAM."}
+    return {**base, "elements": els}
+
+ROUTES = {"/v1/forecast": open_meteo, "/data/3.0/onecall": onecall, "/api/interpreter": overpass}
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, para probar la reutilización de conexiones
+    fail_rate = 0.0
+    latency_s = 0.0
+    hits = 0
+    lock = threading.Lock()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def reply(self, code, body, headers=()):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_query(self, path, q):
+        with Handler.lock:
+            Handler.hits += 1
+        if Handler.latency_s:
+            time.sleep(Handler.latency_s)
+        if path == "/stats":
+            return self.reply(200, {"hits": Handler.hits})
+        fn = ROUTES.get(path)
+        if fn is None:
+            return self.reply(404, {"error": f"ruta desconocida {path}"})
+        if random.random() < Handler.fail_rate:
+            return self.reply(503, {"error": "stub: fallo simulado"}, [("Retry-After", "0")])
+        try:
+            self.reply(200, fn(q))
+        except (KeyError, ValueError) as e:
+            self.reply(400, {"error": str(e)})
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        self.handle_query(u.path, parse_qs(u.query))
+
+    def do_POST(self):
+        # Overpass recibe la consulta como formulario (data=...) en el cuerpo
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+        self.handle_query(urlparse(self.path).path, parse_qs(body))
+
+def serve(port=8765, fail_rate=0.0, latency_ms=0.0, background=False, overpass_max=None):
+    global OVERPASS_MAX
+    if overpass_max:
+        OVERPASS_MAX = overpass_max
+    Handler.fail_rate = fail_rate
+    Handler.latency_s = latency_ms / 1000.0
+    srv = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    if background:
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        return srv
+    print(f"stub en http://127.0.0.1:{srv.server_port} rutas={sorted(ROUTES)}")
+    srv.serve_forever()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="fracción de respuestas 503")
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--overpass-max", type=int, default=OVERPASS_MAX,
+                    help="elementos por consulta antes de simular 'out of memory'")
+    args = ap.parse_args()
+    serve(args.port, args.fail_rate, args.latency_ms, overpass_max=args.overpass_max)
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,14 @@ echo "[1/6] Levantando stack (db, app, web)…"
 docker compose up -d --build
 
 echo "[2/6] Ejecutando ETL (amenazas y metadata) en host…"
-# NOTA: Infraestructura ya la tienes en json/. Si quisieras re-extraer, llama a tus extract_*.py aquí.
+# NOTA: Infraestructura ya la tienes en json/. Si quisieras re-extraer, llama a tus extract_*.py aquí
+# y transforma con --split (p.ej. transform_sector.py --split) para cargar la topología directo.
 python3 etl/amenazas/extract_openmeteo_temp_grid.py
 python3 etl/amenazas/extract_openweather_uv_grid.py
 python3 etl/metadata/edificios/extract_osm_buildings.py
 python3 etl/sombra/build_shadow_roads.py || echo "[WARN] sombras opcional"
+# variantes por zoom simplificadas/cuantizadas y .gz/.br para nginx (json/web/)
+python3 etl/utils/publish.py
 
 echo "[3/6] Creando tablas base…"
 docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/initdb/002_schema.sql
@@ -20,20 +23,31 @@ docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/
 docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/load_sombras.sql
 
 echo "[4/6] Cargando GeoJSON → PostGIS (ogr2ogr en el contenedor db)…"
-# Infraestructura -> via_arista_stg (append múltiple) y merge a via_arista
-for f in infra_provi_sector.geojson infra_provi_sector_south.geojson infra_provi_sector_south_exp.geojson infra_provi_sector_east.geojson; do
-  if [ -s "json/$f" ]; then
-    docker compose exec -T db ogr2ogr -f PostgreSQL PG:"host=localhost dbname=gis user=postgres password=postgres" \
-      /data/json/$f -nln via_arista_stg -nlt LINESTRING -lco GEOMETRY_NAME=geom $(test "$f" = "infra_provi_sector.geojson" && echo -overwrite || echo -append)
-  fi
-done
-docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/load_infra.sql
+# Infraestructura -> via_arista: COPY binario + upsert por hash de geometría
+# (los sectores se solapan; las aristas repetidas se saltan). Si el GeoJSON viene
+# de transform_osm.py --split, source/target salen de los nodos OSM y no hace falta
+# pgr_createTopology; si no, topología sólo de las aristas nuevas.
+# TOPOLOGY=full la reconstruye entera.
+python3 etl/infraestructura/load_infra.py json/infra_provi_sector.geojson json/infra_provi_sector_south.geojson \
+  json/infra_provi_sector_south_exp.geojson json/infra_provi_sector_east.geojson
+SIN_TOPO=$(docker compose exec -T db psql -U postgres -d gis -tAc \
+  "SELECT count(*) FROM via_arista WHERE source IS NULL OR target IS NULL")
+if [ "${TOPOLOGY:-incremental}" = "full" ]; then
+  docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/topology_infra.sql
+elif [ "${SIN_TOPO//[[:space:]]/}" != "0" ]; then
+  docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/topology_infra_incremental.sql
+else
+  echo "[infra] source/target cargados desde --split: se omite pgr_createTopology"
+fi
 
 # Bebederos
 if [ -s json/metadata_bebederos.geojson ]; then
   docker compose exec -T db ogr2ogr -f PostgreSQL PG:"host=localhost dbname=gis user=postgres password=postgres" \
-    /data/json/metadata_bebederos.geojson -nln bebedero -nlt POINT -lco GEOMETRY_NAME=geom -overwrite
+    /data/json/metadata_bebederos.geojson -nln bebedero -nlt POINT -lco GEOMETRY_NAME=geom -lco FID=id -overwrite
 fi
+# Bebedero más cercano por nodo: justo después de cargar bebederos y vías (ogr2ogr
+# -overwrite no toca grafo_version; el build sí, al guardar via_bebedero_meta)
+docker compose exec -T app python bebederos.py build
 # Edificios
 if [ -s json/metadata_edificios.geojson ]; then
   docker compose exec -T db ogr2ogr -f PostgreSQL PG:"host=localhost dbname=gis user=postgres password=postgres" \
@@ -58,10 +72,22 @@ if [ -s json/infra_sombreada.geojson ]; then
   docker compose exec -T db ogr2ogr -f PostgreSQL PG:"host=localhost dbname=gis user=postgres password=postgres" \
     /data/json/infra_sombreada.geojson -nln via_sombreada -nlt LINESTRING -lco GEOMETRY_NAME=geom -overwrite
 fi
+# Triggers de versión por capa para la caché de /tiles (ogr2ogr -overwrite los borra)
+docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/capas_version.sql
+# Exposición por arista (sombra/temperatura/UV) para los perfiles de /route
+docker compose exec -T db psql -U postgres -d gis -v ON_ERROR_STOP=1 -f db/load/load_exposicion.sql
+# Contraction Hierarchies por perfil (offline) y recarga del grafo en la API
+docker compose exec -T app python ch.py build
+# Grafo binario que los workers de la API mapean en memoria, con la CH, los bebederos
+# y el índice de snap en archivos hermanos (último paso: guarda grafo_version)
+docker compose exec -T app python graph_file.py export
+docker compose restart app
 
 echo "[5/6] Verificación rápida…"
 docker compose exec -T db psql -U postgres -d gis -c "SELECT COUNT(*) vias FROM via_arista;"
 docker compose exec -T db psql -U postgres -d gis -c "SELECT COUNT(*) nodos FROM via_nodo;"
+# topología incremental vs. reconstrucción completa (recalcula todo en una copia; usar a mano):
+#   docker compose exec -T db psql -U postgres -d gis -f db/load/topology_infra_check.sql
 docker compose exec -T db psql -U postgres -d gis -c "SELECT COUNT(*) bebederos FROM bebedero;"
 docker compose exec -T db psql -U postgres -d gis -c "SELECT COUNT(*) edificios FROM edificio;"
 docker compose exec -T db psql -U postgres -d gis -c "SELECT COUNT(*) uv_celdas FROM amenaza_uv_grid;"
@@ -0,0 +1,8 @@
+import os, sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]  # raíz del repo
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "etl" / "sombra"))  # shadow_cache, que build_shadow_roads importa plano
+# los scripts del ETL leen su YAML con rutas relativas a la raíz (como en main.sh)
+os.chdir(ROOT)
@@ -0,0 +1,137 @@
+# Fetcher y OverpassClient contra etl/utils/stub_server (sin red): reintentos,
+# caché en disco, lotes de coordenadas, partición quadtree, deduplicación y
+# reanudación desde la caché de teselas.
+import itertools, time
+import pytest
+
+from etl.amenazas import extract_openmeteo_temp_grid as temp
+from etl.utils import stub_server
+from etl.utils.fetch import Fetcher
+from etl.utils.grid import Grid
+from etl.utils.overpass import OverpassClient
+
+QUERY = '[out:json][timeout:{timeout}];way["highway"]({bbox});out geom;'
+BBOX = (-33.44, -70.62, -33.42, -70.60)
+
+
+class Failures:
+    # reemplaza a random en el stub: responde 503 a las llamadas marcadas con 0.0
+    def __init__(self, seq):
+        self.it = itertools.chain(seq, itertools.repeat(1.0))
+
+    def random(self):
+        return next(self.it)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(stub_server, "OVERPASS_MAX", stub_server.OVERPASS_MAX)
+    monkeypatch.setattr(stub_server.Handler, "hits", 0)
+    srv = stub_server.serve(port=0, background=True)
+    yield f"http://127.0.0.1:{srv.server_port}"
+    srv.shutdown()
+    srv.server_close()
+
+
+def fail(monkeypatch, seq):
+    monkeypatch.setattr(stub_server.Handler, "fail_rate", 0.5)
+    monkeypatch.setattr(stub_server, "random", Failures(seq))
+
+
+def expected_ids(bbox):
+    return {e["id"] for e in stub_server._overpass_elements(*bbox, False)}
+
+
+# --- Fetcher ----------------------------------------------------------------
+
+def test_retry_after_503(stub, monkeypatch):
+    fail(monkeypatch, [0.0, 0.0])
+    # con backoff_s=5 el reintento tardaría segundos si no respetara Retry-After: 0
+    f = Fetcher(rate_per_s=0, retries=3, backoff_s=5.0)
+    t0 = time.perf_counter()
+    j = f.get_json(stub + "/data/3.0/onecall", {"lat": -33.43, "lon": -70.61})
+    assert time.perf_counter() - t0 < 1.0
+    assert j["current"]["uvi"] == stub_server.fake_uv(-33.43, -70.61)
+    assert f.stats["retries"] == 2 and f.stats["requests"] == 3 and f.stats["errors"] == 0
+
+
+def test_cache_hit(stub, tmp_path):
+    url, params = stub + "/data/3.0/onecall", {"lat": -33.43, "lon": -70.61}
+    f = Fetcher(rate_per_s=0, cache_dir=tmp_path, cache_ttl_s=60)
+    assert f.get_json(url, params) == f.get_json(url, params)
+    assert f.stats["requests"] == 1 and f.stats["cache_hits"] == 1
+    assert stub_server.Handler.hits == 1
+    # vencida: vuelve a pedir
+    assert Fetcher(rate_per_s=0, cache_dir=tmp_path, cache_ttl_s=-1).get_json(url, params)
+    assert stub_server.Handler.hits == 2
+
+
+def test_batches(stub, monkeypatch):
+    monkeypatch.setattr(temp, "BATCH", 3)
+    cells = Grid.empty(BBOX, 2, 4, "temp_c").cells()   # 8 celdas: lotes de 3, 3 y 2
+    api = stub + "/v1/forecast"
+    calls = temp.batch_calls(cells, api)
+    assert [p["latitude"].count(",") + 1 for _, p in calls] == [3, 3, 2]
+    out = temp.fetch_temps(cells, Fetcher(rate_per_s=0), api)
+    assert [t for t, _ in out] == [stub_server.fake_temp(round(c["centroid"][1], 6), round(c["centroid"][0], 6))
+                                   for c in cells]
+
+
+def test_failed_batch(stub, monkeypatch):
+    # un lote que agota los reintentos deja sus celdas sin dato, no las demás
+    monkeypatch.setattr(temp, "BATCH", 4)
+    fail(monkeypatch, [0.0, 0.0])
+    cells = Grid.empty(BBOX, 2, 4, "temp_c").cells()
+    out = temp.fetch_temps(cells, Fetcher(rate_per_s=0, workers=1, retries=1), stub + "/v1/forecast")
+    assert [t is None for t, _ in out] == [True] * 4 + [False] * 4
+
+
+# --- OverpassClient -----------------------------------------------------------
+
+def client(url, cache_dir, **kw):
+    return OverpassClient([url + "/api/interpreter"], rate_per_s=0, cache_dir=cache_dir, **kw)
+
+
+def test_quadtree_split(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(stub_server, "OVERPASS_MAX", 40)
+    c = client(stub, tmp_path, max_depth=4)
+    elements, failed = c.fetch(QUERY, BBOX, tiles=(1, 1))
+    assert not failed and c.stats["split"] > 0
+    ids = [e["id"] for e in elements]
+    # teselas vecinas comparten los tramos del borde: cada uno una sola vez
+    assert len(ids) == len(set(ids))
+    assert set(ids) == expected_ids(BBOX)
+
+
+def test_split_depth_exhausted(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(stub_server, "OVERPASS_MAX", 2)
+    c = client(stub, tmp_path, max_depth=1, retries=0)
+    elements, failed = c.fetch(QUERY, BBOX)
+    assert len(failed) == 4 and c.stats["split"] == 1
+
+
+def test_resume_from_cache(stub, tmp_path, monkeypatch):
+    # primera corrida: una de las 4 teselas falla; las otras quedan en caché
+    fail(monkeypatch, [0.0])
+    c = client(stub, tmp_path, retries=0, workers=1)
+    elements, failed = c.fetch(QUERY, BBOX, tiles=(2, 2))
+    assert len(failed) == 1 and c.stats["tiles"] == 3
+    assert len(list(tmp_path.glob("*.json"))) == 3
+    # segunda: sólo se descarga la que faltaba
+    hits = stub_server.Handler.hits
+    c = client(stub, tmp_path)
+    elements, failed = c.fetch(QUERY, BBOX, tiles=(2, 2))
+    assert not failed and c.stats["cached"] == 3
+    assert stub_server.Handler.hits == hits + 1
+    ids = [e["id"] for e in elements]
+    assert len(ids) == len(set(ids)) and set(ids) == expected_ids(BBOX)
+    # corrida completa: la caché de teselas se borra
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_cache_ttl(stub, tmp_path, monkeypatch):
+    fail(monkeypatch, [0.0])
+    client(stub, tmp_path, retries=0, workers=1).fetch(QUERY, BBOX, tiles=(2, 2))
+    c = client(stub, tmp_path, cache_ttl_s=-1)
+    elements, failed = c.fetch(QUERY, BBOX, tiles=(2, 2))
+    assert not failed and c.stats["cached"] == 0
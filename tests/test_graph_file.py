@@ -0,0 +1,66 @@
+# graph_file: grafo y componentes derivados (CH, bebederos, snap) en archivos
+# hermanos, ida y vuelta, y descarte cuando cambia la versión o su fuente.
+import sys
+import numpy as np
+import pytest
+
+from bench.run import ROOT, edges_from_osm
+from bench.synth import City
+
+sys.path.insert(0, str(ROOT / "app"))
+import bebederos, ch, graph_file
+from graph import Graph
+from snap import SnapIndex
+
+
+@pytest.fixture(scope="module")
+def saved(tmp_path_factory):
+    c = City(0.3, seed=2)
+    e, n, w = edges_from_osm(c.write(tmp_path_factory.mktemp("city"))["osm"])
+    g = Graph.from_rows(e, n, [], w)
+    g.version = 7
+    ix = SnapIndex(g)
+    hier = {"shortest": ch.build(g, "shortest", log=lambda *a: None)}
+    s, west, nn, east = c.bbox
+    near = bebederos.build(g, [(1, west, s), (2, east, nn)], ix)
+    path = str(tmp_path_factory.mktemp("art") / "graph.bin")
+    graph_file.save(g, path)
+    graph_file.save_ch(path, g, [["shortest", 1]], hier)
+    graph_file.save_nearest(path, g, [None, "h"], near)
+    graph_file.save_snap(path, g, {"cell": ix.cell}, ix)
+    return path, g, hier, near, ix
+
+
+def test_roundtrip(saved):
+    path, g, hier, near, ix = saved
+    m = graph_file.load(path, 7, verify=True)
+    h = graph_file.load_ch(path, m, [["shortest", 1]], verify=True)
+    for k in ch.ARRAYS:
+        assert np.array_equal(getattr(h["shortest"], k), getattr(hier["shortest"], k))
+    rng = np.random.default_rng(0)
+    for s, t in rng.integers(0, g.n_nodes, (20, 2)).tolist():
+        assert h["shortest"].shortest_path(s, t)[0] == pytest.approx(hier["shortest"].shortest_path(s, t)[0])
+    nr = graph_file.load_nearest(path, m, [None, "h"])
+    for k in bebederos.ARRAYS:
+        assert np.array_equal(getattr(nr, k), getattr(near, k))
+    mx = graph_file.load_snap(path, m, {"cell": ix.cell})
+    lon0, lat0 = float(np.nanmean(g.lon)), float(np.nanmean(g.lat))
+    for lon, lat in zip(lon0 + rng.uniform(-0.01, 0.01, 50), lat0 + rng.uniform(-0.01, 0.01, 50)):
+        assert mx.nearest_node(lon, lat) == ix.nearest_node(lon, lat)
+        assert mx.nearest_edge(lon, lat) == ix.nearest_edge(lon, lat)
+    assert mx.covers(lon0, lat0)
+
+
+def test_stale(saved):
+    path, g, *_ = saved
+    with pytest.raises(graph_file.GraphFileError):
+        graph_file.load(path, 8)
+    m = graph_file.load(path, 7)
+    with pytest.raises(graph_file.GraphFileError):
+        graph_file.load_ch(path, m, [["shortest", 2]])   # CH rehecha en la BD
+    with pytest.raises(graph_file.GraphFileError):
+        graph_file.load_nearest(path, m, [None, "otro"])  # bebederos movidos
+    with pytest.raises(graph_file.GraphFileError):
+        graph_file.load_snap(path, m, {"cell": 50.0})
+    with pytest.raises(graph_file.GraphFileError):
+        graph_file.load_part(path, "snap", g, [["shortest", 1]])
@@ -0,0 +1,106 @@
+# tiled_shade (teselas + STRtree + pool) contra la implementación original de
+# build_shadow_roads (una unión global de sombras), sobre una ciudad sintética.
+import math
+import numpy as np
+import pytest
+import shapely
+from shapely.affinity import translate
+from shapely.geometry import shape
+from shapely.ops import unary_union
+from astral import Observer
+from astral.sun import azimuth, elevation
+
+import build_shadow_roads as bsr
+from bench.synth import City
+from etl.infraestructura.transform_osm import features
+from etl.utils.proj import reproject, transformer
+
+
+def legacy_shade(b_utm, r_utm, elev, azim):
+    # implementación original (una unión global), sólo como referencia
+    alt_rad = math.radians(max(elev, 1.0))  # evita tangente infinita
+    az_move_rad = math.radians((azim + 180.0) % 360.0)  # vector opuesto al sol
+
+    # Sombras (trasladar footprint una distancia d = h / tan(alt), contra el sol)
+    tan_alt = math.tan(alt_rad)
+    sinA, cosA = math.sin(az_move_rad), math.cos(az_move_rad)
+
+    shadows=[]
+    for poly_wgs, h in b_utm:
+        for poly in bsr.ensure_poly(poly_wgs):
+            d  = h / tan_alt
+            dx = d * sinA
+            dy = d * cosA
+            moved = translate(poly, xoff=dx, yoff=dy)
+            hull  = poly.union(moved).convex_hull
+            shadows.append(hull)
+
+    shadow_union = unary_union(shadows)
+
+    # Intersecar con vías
+    shaded=[]
+    for i, ln in enumerate(r_utm):
+        try:
+            if ln.intersects(shadow_union):
+                inter = ln.intersection(shadow_union)
+                if inter.is_empty:
+                    continue
+                shaded.append((i, inter))
+        except Exception:
+            pass
+    return shadow_union, shaded
+
+
+def check_outputs(shadow_union, shaded, ref_union, ref_shaded, n_roads, tol):
+    # misma área sombreada (diferencia simétrica relativa) y mismo largo sombreado por vía (m)
+    area_diff = shadow_union.symmetric_difference(ref_union).area / max(ref_union.area, 1.0)
+    got, ref = np.zeros(n_roads), np.zeros(n_roads)
+    for i, g in shaded:
+        got[i] = g.length
+    for i, g in ref_shaded:
+        ref[i] = g.length
+    len_diff = float(np.abs(got - ref).max()) if n_roads else 0.0
+    n_got = len(shapely.get_parts(shadow_union))
+    n_ref = len(shapely.get_parts(ref_union))
+    ok = area_diff <= 1e-6 and len_diff <= tol and n_got == n_ref
+    print(f"[check] area_rel={area_diff:.2e} largo_max={len_diff:.4f}m (tol {tol}m) "
+          f"poligonos={n_got}/{n_ref} vias={len(shaded)}/{len(ref_shaded)} -> {'OK' if ok else 'DIFERENTE'}")
+    return ok
+
+
+@pytest.fixture(scope="module")
+def city(tmp_path_factory):
+    # ~0.5 km²: unos cientos de edificios y decenas de vías; con teselas de 150 m hay varias
+    files = City(0.5, seed=3).write(tmp_path_factory.mktemp("city"))
+    fwd = transformer(4326, bsr.EPSG)
+    fc = bsr.read_fc(files["buildings"])["features"]
+    b = reproject([shape(f["geometry"]) for f in fc], fwd)
+    b_utm = list(zip(b, (float(f["properties"]["height_m"]) for f in fc)))
+    r_utm = reproject([shapely.linestrings(f["geometry"]["coordinates"]) for f in features(files["osm"])], fwd)
+    return b_utm, list(r_utm)
+
+
+@pytest.mark.parametrize("sun", [(55.0, 20.0), (12.0, 290.0)])   # (elevación, azimut): mediodía y tarde
+@pytest.mark.parametrize("tile_m,workers", [(bsr.TILE_M, 1), (150.0, 1), (150.0, 2)])
+def test_tiled_matches_legacy(city, sun, tile_m, workers):
+    b_utm, r_utm = city
+    elev, azim = sun
+    polys, heights = bsr.building_arrays(b_utm)
+    hulls = bsr.shadow_hulls(polys, heights, elev, azim)
+    union, shaded, errors = bsr.tiled_shade(hulls, np.array(r_utm, dtype=object), tile_m, workers)
+    ref_union, ref_shaded = legacy_shade(b_utm, r_utm, elev, azim)
+    assert errors == 0
+    assert ref_shaded, "la ciudad de prueba debería tener vías sombreadas"
+    assert check_outputs(union, shaded, ref_union, ref_shaded, len(r_utm), tol=0.01)
+
+
+def test_sun_at_config_datetime(city):
+    # el instante de sombra_config.yaml (el que usa run_single) también coincide
+    b_utm, r_utm = city
+    obs = Observer(latitude=bsr.LAT, longitude=bsr.LON)
+    elev, azim = elevation(obs, bsr.DT), azimuth(obs, bsr.DT) % 360.0
+    polys, heights = bsr.building_arrays(b_utm)
+    union, shaded, _ = bsr.tiled_shade(bsr.shadow_hulls(polys, heights, elev, azim),
+                                       np.array(r_utm, dtype=object), 150.0, 1)
+    ref_union, ref_shaded = legacy_shade(b_utm, r_utm, elev, azim)
+    assert check_outputs(union, shaded, ref_union, ref_shaded, len(r_utm), tol=0.01)
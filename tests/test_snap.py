@@ -0,0 +1,50 @@
+# SnapIndex contra fuerza bruta, y puntos lejanos de la red (costo acotado, covers()).
+import sys, time
+import numpy as np
+import pytest
+
+from bench.run import ROOT, edges_from_osm
+from bench.synth import City
+
+sys.path.insert(0, str(ROOT / "app"))
+from graph import Graph
+from snap import SnapIndex
+
+
+@pytest.fixture(scope="module")
+def city(tmp_path_factory):
+    c = City(1.0, seed=1)
+    files = c.write(tmp_path_factory.mktemp("city"))
+    e, n, w = edges_from_osm(files["osm"])
+    g = Graph.from_rows(e, n, [], w)
+    return c, SnapIndex(g)
+
+
+def test_matches_brute_force(city):
+    c, ix = city
+    s, w, n, e = c.bbox
+    rng = np.random.default_rng(0)
+    every = np.arange(len(ix.sx0))
+    for lon, lat in zip(rng.uniform(w - 0.02, e + 0.02, 200), rng.uniform(s - 0.02, n + 0.02, 200)):
+        px, py = ix.to_m(lon, lat)
+        _, d = ix.nearest_node(lon, lat)
+        assert d == pytest.approx(np.hypot(ix.nx - px, ix.ny - py).min())
+        hit = ix.nearest_edge(lon, lat)
+        assert hit["dist_m"] == pytest.approx(ix._seg_dist(every, px, py)[0].min())
+
+
+@pytest.mark.parametrize("lat,lon", [(-32.9, -70.618), (-32.0, -70.618), (-70.6, -33.4), (0.0, 0.0)])
+def test_far_points(city, lat, lon):
+    c, ix = city
+    t0 = time.perf_counter()
+    assert ix.nearest_node(lon, lat)[0] is not None
+    assert ix.nearest_edge(lon, lat) is not None
+    assert time.perf_counter() - t0 < 0.1
+    assert not ix.covers(lon, lat)
+
+
+def test_covers(city):
+    c, ix = city
+    s, w, n, e = c.bbox
+    assert ix.covers((w + e) / 2, (s + n) / 2)
+    assert not ix.covers(float("nan"), s)